@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.db import transaction
 from .models import Cart, CartItem
 
 
@@ -15,10 +16,10 @@ class CartItemInline(admin.TabularInline):
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'session_key_short', 'total_items', 'total_price_display', 'created_at', 'updated_at')
+    list_display = ('id', 'user', 'session_key_short', 'item_count', 'total_price_display', 'created_at', 'updated_at')
     list_filter = ('created_at', 'updated_at')
     search_fields = ('user__username', 'user__email', 'session_key')
-    readonly_fields = ('created_at', 'updated_at', 'total_items', 'total_price_display')
+    readonly_fields = ('created_at', 'updated_at', 'item_count', 'total_price_display')
     inlines = [CartItemInline]
 
     def session_key_short(self, obj):
@@ -42,3 +43,10 @@ class CartItemAdmin(admin.ModelAdmin):
     def total_price_display(self, obj):
         return f"${obj.total_price:.2f}"
     total_price_display.short_description = 'Total Price'
+
+    def delete_queryset(self, request, queryset):
+        # Bulk deletes skip CartItem.delete(), so recompute the affected carts
+        with transaction.atomic():
+            cart_ids = list(queryset.values_list('cart_id', flat=True).distinct())
+            super().delete_queryset(request, queryset)
+            Cart.objects.filter(pk__in=cart_ids).recompute_totals()
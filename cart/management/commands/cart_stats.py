@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from cart.models import Cart
+from cart.utils import get_avoided_writes
+
+
+class Command(BaseCommand):
+    help = 'Show cart table size and how many writes read-only cart requests have avoided'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Carts: {Cart.objects.count()}')
+        self.stdout.write(f'Anonymous carts: {Cart.objects.filter(user__isnull=True).count()}')
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Session/cart inserts avoided by read-only requests: {get_avoided_writes()}'
+            )
+        )
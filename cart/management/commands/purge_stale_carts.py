@@ -0,0 +1,102 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from cart.models import Cart, CartItem
+
+DB_SESSION_ENGINES = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete anonymous carts (and their items and expired sessions) that have '
+        'not been touched for a number of days. Works in small index-driven '
+        'batches, each in its own short transaction, so it is safe to run from '
+        'cron while the shop is live.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=30,
+            help='Purge anonymous carts not updated for this many days (default: 30)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of carts deleted per batch (default: 500)',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0.1,
+            help='Seconds to pause between batches to limit load (default: 0.1)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show what would be purged without deleting anything',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # Served by the partial index on updated_at for anonymous carts
+        stale = Cart.objects.filter(user__isnull=True, updated_at__lt=cutoff).order_by('updated_at')
+
+        if options['dry_run']:
+            cart_count = stale.count()
+            item_count = CartItem.objects.filter(cart__in=stale.values('pk')).count()
+            self.stdout.write(
+                self.style.WARNING(
+                    f'DRY RUN: Would purge {cart_count} anonymous carts with {item_count} items '
+                    f'not updated since {cutoff:%Y-%m-%d %H:%M}'
+                )
+            )
+            return
+
+        purge_sessions = settings.SESSION_ENGINE in DB_SESSION_ENGINES
+        carts_deleted = items_deleted = sessions_deleted = 0
+        started = time.monotonic()
+
+        while True:
+            with transaction.atomic():
+                # Skip carts a live request is writing to right now
+                batch = list(
+                    stale.select_for_update(skip_locked=True)
+                    .values_list('pk', 'session_key')[:options['batch_size']]
+                )
+                if not batch:
+                    break
+
+                cart_ids = [pk for pk, _ in batch]
+                _, deleted = Cart.objects.filter(pk__in=cart_ids).delete()
+                carts_deleted += deleted.get(Cart._meta.label, 0)
+                items_deleted += deleted.get(CartItem._meta.label, 0)
+
+                if purge_sessions:
+                    session_keys = [key for _, key in batch if key]
+                    sessions_deleted += Session.objects.filter(
+                        session_key__in=session_keys,
+                        expire_date__lt=timezone.now(),
+                    ).delete()[0]
+
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Purged {carts_deleted} carts, {items_deleted} items and '
+                f'{sessions_deleted} expired sessions in {elapsed:.1f}s'
+            )
+        )
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from cart.models import Cart
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored item_count and subtotal of every cart from its items'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of cart ids recomputed per UPDATE statement (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        bounds = Cart.objects.aggregate(low=Min('pk'), high=Max('pk'))
+
+        if bounds['low'] is None:
+            self.stdout.write(self.style.WARNING('No carts found'))
+            return
+
+        updated = 0
+        for start in range(bounds['low'], bounds['high'] + 1, batch_size):
+            updated += Cart.objects.filter(
+                pk__gte=start, pk__lt=start + batch_size
+            ).recompute_totals()
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Recomputed totals for {updated} carts')
+        )
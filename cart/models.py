@@ -1,8 +1,96 @@
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.utils import timezone
 from decimal import Decimal
-from products.models import Product
+from products.models import Product, product_prices_changed
+
+
+class CartQuerySet(models.QuerySet):
+    def add_to_totals(self, product_id, quantity_delta):
+        """
+        Shift the stored totals by ``quantity_delta`` units of a product, in
+        one UPDATE that reads the current price with a subquery.
+        """
+        price = Product.objects.filter(pk=product_id).order_by().values('price')[:1]
+        return self.update(
+            item_count=F('item_count') + quantity_delta,
+            subtotal=F('subtotal') + quantity_delta * Subquery(price),
+            updated_at=timezone.now(),
+        )
+
+    def recompute_totals(self):
+        """Recalculate the stored totals from the cart lines, set-based."""
+        lines = CartItem.objects.filter(cart=OuterRef('pk')).values('cart')
+        return self.update(
+            item_count=Coalesce(
+                Subquery(lines.annotate(n=Sum('quantity')).values('n')), 0
+            ),
+            subtotal=Coalesce(
+                Subquery(lines.annotate(t=Sum(F('quantity') * F('product__price'))).values('t')),
+                Decimal('0.00'),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+
+
+class CartItemQuerySet(models.QuerySet):
+    def add_quantity(self, cart, product, quantity):
+        """
+        Atomically add ``quantity`` of ``product`` to ``cart``.
+
+        Inserts the line or increments the existing one in a single
+        ``INSERT ... ON CONFLICT (cart_id, product_id) DO UPDATE ...
+        RETURNING`` statement, so concurrent adds (double clicks) can never
+        lose an update, then shifts the cart totals in the same transaction.
+        Returns ``(item_id, old_quantity, new_quantity)``.
+        """
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+
+        with transaction.atomic(using=self.db):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    INSERT INTO {table} (cart_id, product_id, quantity, added_at, updated_at)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (cart_id, product_id) DO UPDATE
+                    SET quantity = {table}.quantity + excluded.quantity,
+                        updated_at = excluded.updated_at
+                    RETURNING id, quantity
+                    """,
+                    [cart.pk, product.pk, quantity, now, now],
+                )
+                item_id, new_quantity = cursor.fetchone()
+            Cart.objects.using(self.db).filter(pk=cart.pk).add_to_totals(product.pk, quantity)
+
+        return item_id, new_quantity - quantity, new_quantity
+
+    def merge_cart(self, source, target):
+        """
+        Move every line of ``source`` into ``target`` with one set-based
+        ``INSERT ... SELECT ... ON CONFLICT DO UPDATE``, summing quantities of
+        products already in ``target``. The caller deletes ``source``.
+        """
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (cart_id, product_id, quantity, added_at, updated_at)
+                SELECT %s, product_id, quantity, added_at, %s FROM {table} WHERE cart_id = %s
+                ON CONFLICT (cart_id, product_id) DO UPDATE
+                SET quantity = {table}.quantity + excluded.quantity,
+                    updated_at = excluded.updated_at
+                """,
+                [target.pk, now, source.pk],
+            )
 
 
 class Cart(models.Model):
@@ -14,11 +102,26 @@ class Cart(models.Model):
         related_name='carts'
     )
     session_key = models.CharField(max_length=40, null=True, blank=True)
+
+    # Denormalised totals, kept in step with every CartItem write
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CartQuerySet.as_manager()
+
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['session_key'], name='cart_session_key_idx'),
+            # Drives purge_stale_carts: oldest anonymous carts first
+            models.Index(
+                fields=['updated_at'], name='cart_anon_updated_idx',
+                condition=models.Q(user__isnull=True),
+            ),
+        ]
 
     def __str__(self):
         if self.user:
@@ -30,20 +133,30 @@ class Cart(models.Model):
     @property
     def total_items(self):
         """Return total number of items in cart."""
-        return sum(item.quantity for item in self.items.all())
+        return self.item_count
 
     @property
     def total_price(self):
         """Return total price of all items in cart."""
-        return sum(item.total_price for item in self.items.all())
+        return self.subtotal
+
+    def refresh_totals(self):
+        """Reload the stored totals after items were changed."""
+        self.refresh_from_db(fields=['item_count', 'subtotal'])
 
     def clear(self):
         """Remove all items from cart."""
-        self.items.all().delete()
+        with transaction.atomic():
+            self.items.all().delete()
+            Cart.objects.filter(pk=self.pk).update(
+                item_count=0, subtotal=Decimal('0.00'), updated_at=timezone.now()
+            )
+        self.item_count = 0
+        self.subtotal = Decimal('0.00')
 
     def is_empty(self):
         """Check if cart is empty."""
-        return not self.items.exists()
+        return self.item_count == 0
 
 
 class CartItem(models.Model):
@@ -60,6 +173,8 @@ class CartItem(models.Model):
     added_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = ('cart', 'product')
         ordering = ['-added_at']
@@ -67,6 +182,36 @@ class CartItem(models.Model):
     def __str__(self):
         return f"{self.quantity}x {self.product.name}"
 
+    def _locked_quantity(self):
+        """The stored quantity, row locked until the transaction ends, or ``None``."""
+        return CartItem.objects.select_for_update().filter(pk=self.pk).values_list(
+            'quantity', flat=True
+        ).first()
+
+    def save(self, *args, **kwargs):
+        """Save the line and shift the cart totals by the quantity change."""
+        with transaction.atomic():
+            # The quantity this instance was loaded with may be stale by now
+            previous = 0 if self._state.adding else self._locked_quantity() or 0
+            super().save(*args, **kwargs)
+            delta = self.quantity - previous
+            if delta:
+                Cart.objects.filter(pk=self.cart_id).add_to_totals(self.product_id, delta)
+
+    save.alters_data = True
+
+    def delete(self, *args, **kwargs):
+        """Delete the line and take its stored quantity off the cart totals."""
+        with transaction.atomic():
+            quantity = self._locked_quantity()
+            deleted, counts = super().delete(*args, **kwargs)
+            # Only the request that removed the row takes it off the totals
+            if deleted and quantity:
+                Cart.objects.filter(pk=self.cart_id).add_to_totals(self.product_id, -quantity)
+            return deleted, counts
+
+    delete.alters_data = True
+
     @property
     def total_price(self):
         """Return total price for this cart item."""
@@ -84,3 +229,53 @@ class CartItem(models.Model):
             self.save()
         else:
             self.delete()
+
+
+
+class CartCounterQuerySet(models.QuerySet):
+    def add(self, name, amount):
+        """Add ``amount`` to counter ``name`` with one UPDATE, creating it if needed."""
+        counter = self.filter(name=name)
+        if not counter.update(value=F('value') + amount):
+            self.bulk_create([CartCounter(name=name)], ignore_conflicts=True)
+            counter.update(value=F('value') + amount)
+
+
+class CartCounter(models.Model):
+    """A named running total, e.g. the writes read-only cart requests avoided."""
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    objects = CartCounterQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+@receiver(post_save, sender=Product)
+def refresh_cart_totals_for_product(sender, instance, created, update_fields=None, **kwargs):
+    """A price change moves the subtotal of every cart holding the product."""
+    if created or (update_fields is not None and 'price' not in update_fields):
+        return
+    if instance.price_changed():
+        Cart.objects.filter(items__product=instance).recompute_totals()
+
+
+@receiver(product_prices_changed)
+def refresh_cart_totals_for_prices(sender, product_ids, using, **kwargs):
+    """The same for bulk repricing with update() or bulk_update()."""
+    Cart.objects.using(using).filter(items__product__in=product_ids).recompute_totals()
+
+
+@receiver(pre_delete, sender=Product)
+def remember_carts_for_product(sender, instance, **kwargs):
+    instance._cart_ids = list(
+        Cart.objects.filter(items__product=instance).values_list('pk', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Product)
+def refresh_cart_totals_after_product_delete(sender, instance, **kwargs):
+    """Cascade-deleted cart lines bypass CartItem.delete(), so recompute."""
+    cart_ids = getattr(instance, '_cart_ids', None)
+    if cart_ids:
+        Cart.objects.filter(pk__in=cart_ids).recompute_totals()
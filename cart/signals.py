@@ -0,0 +1,11 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from .utils import merge_session_cart_with_user_cart
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    """Fold the anonymous cart into the user's cart as part of logging in."""
+    if request is not None and hasattr(request, 'session'):
+        merge_session_cart_with_user_cart(request, user)
@@ -1,3 +1,407 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core.context_processors import cart_info
+from products.models import Product
+
+from .models import Cart, CartCounter, CartItem
+from .utils import (
+    _flush_avoided_writes_at_exit, flush_avoided_writes, get_avoided_writes, record_avoided_writes,
+)
+
+
+class CartInfoContextProcessorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('siti', password='secret')
+        cls.cart = Cart.objects.create(user=cls.user)
+        for number, price in enumerate(['18.90', '7.50', '3.00']):
+            product = Product.objects.create(
+                name=f'Product {number}', sku=f'P-{number}',
+                price=Decimal(price), is_published=True,
+            )
+            CartItem.objects.create(cart=cls.cart, product=product, quantity=number + 1)
+
+    def request(self, user=None):
+        request = RequestFactory().get('/')
+        request.user = user or AnonymousUser()
+        request.session = SessionStore()
+        return request
+
+    def test_values_are_lazy(self):
+        request = self.request(self.user)
+        with self.assertNumQueries(0):
+            cart_info(request)
+
+    def test_count_and_total_share_one_query(self):
+        request = self.request(self.user)
+        context = cart_info(request)
+        with self.assertNumQueries(1):
+            self.assertEqual(context['cart_count'], 6)
+            self.assertEqual(context['cart_total'], 18.90 + 15.00 + 9.00)
+            self.assertEqual(str(context['cart_count']), '6')
+
+    def test_anonymous_without_session_costs_nothing(self):
+        request = self.request()
+        context = cart_info(request)
+        with self.assertNumQueries(0):
+            self.assertEqual(context['cart_count'], 0)
+            self.assertEqual(context['cart_total'], 0.0)
+
+
+class CartTotalsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('aminah', password='secret')
+        cls.rendang = Product.objects.create(
+            name='Rendang', sku='R-1', price=Decimal('18.90'), is_published=True
+        )
+        cls.sambal = Product.objects.create(
+            name='Sambal', sku='S-1', price=Decimal('7.50'), is_published=True
+        )
+
+    def setUp(self):
+        self.cart = Cart.objects.create(user=self.user)
+
+    def assertTotals(self, item_count, subtotal):
+        self.cart.refresh_totals()
+        self.assertEqual(self.cart.total_items, item_count)
+        self.assertEqual(self.cart.total_price, Decimal(subtotal))
+
+    def test_item_writes_keep_totals_in_step(self):
+        item = CartItem.objects.create(cart=self.cart, product=self.rendang, quantity=2)
+        CartItem.objects.create(cart=self.cart, product=self.sambal, quantity=1)
+        self.assertTotals(3, '45.30')
+
+        item.increase_quantity(3)
+        self.assertTotals(6, '102.00')
+
+        item.decrease_quantity(4)
+        self.assertTotals(2, '26.40')
+
+        item = CartItem.objects.get(pk=item.pk)
+        item.quantity = 4
+        item.save()
+        self.assertTotals(5, '83.10')
+
+        item.delete()
+        self.assertTotals(1, '7.50')
+
+        self.cart.clear()
+        self.assertTotals(0, '0.00')
+        self.assertTrue(self.cart.is_empty())
+
+    def test_stale_instances_of_one_line_keep_totals_in_step(self):
+        CartItem.objects.create(cart=self.cart, product=self.rendang, quantity=3)
+        # Two requests, e.g. a double click, load the same line
+        first, second = CartItem.objects.get(), CartItem.objects.get()
+
+        first.quantity = 5
+        first.save()
+        second.quantity = 4
+        second.save()
+        self.assertTotals(4, '75.60')
+
+        first.delete()
+        second.delete()
+        self.assertTotals(0, '0.00')
+
+    def test_price_change_and_product_delete_update_totals(self):
+        CartItem.objects.create(cart=self.cart, product=self.rendang, quantity=2)
+        CartItem.objects.create(cart=self.cart, product=self.sambal, quantity=1)
+
+        self.rendang.price = Decimal('20.00')
+        self.rendang.save()
+        self.assertTotals(3, '47.50')
+
+        self.sambal.delete()
+        self.assertTotals(2, '40.00')
+
+    def test_bulk_repricing_updates_totals(self):
+        CartItem.objects.create(cart=self.cart, product=self.rendang, quantity=2)
+        CartItem.objects.create(cart=self.cart, product=self.sambal, quantity=1)
+
+        # The filter stops matching once the price moves
+        Product.objects.filter(price=Decimal('18.90')).update(price=Decimal('19.90'))
+        self.assertTotals(3, '47.30')
+
+        self.sambal.price = Decimal('8.00')
+        Product.objects.bulk_update([self.sambal], ['price'])
+        self.assertTotals(3, '47.80')
+
+    def test_saves_without_price_change_leave_carts_alone(self):
+        CartItem.objects.create(cart=self.cart, product=self.rendang, quantity=2)
+        product = Product.objects.get(pk=self.rendang.pk)
+        product.description = 'Slow-cooked beef.'
+        with CaptureQueriesContext(connection) as queries:
+            product.save()
+            product.save(update_fields=['stock'])
+        self.assertFalse(any('cart_cart' in q['sql'] for q in queries.captured_queries))
+
+    def test_reading_totals_is_one_query(self):
+        for product in (self.rendang, self.sambal):
+            CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+        with self.assertNumQueries(1):
+            cart = Cart.objects.get(pk=self.cart.pk)
+            self.assertEqual((cart.total_items, cart.total_price), (4, Decimal('52.80')))
+
+    def test_ajax_add_returns_fresh_totals(self):
+        self.client.force_login(self.user)
+        url = reverse('cart:add_to_cart', args=[self.rendang.pk])
+        self.client.post(url, {'quantity': 1}, HTTP_HX_REQUEST='true')
+        response = self.client.post(url, {'quantity': 2}, HTTP_HX_REQUEST='true')
+        self.assertEqual(response.json()['cart_count'], 3)
+        self.assertEqual(response.json()['cart_total'], 56.70)
+
+    def test_repair_command_recomputes_drifted_totals(self):
+        CartItem.objects.create(cart=self.cart, product=self.rendang, quantity=2)
+        Cart.objects.filter(pk=self.cart.pk).update(item_count=99, subtotal=Decimal('1.00'))
+        call_command('recompute_cart_totals', batch_size=1, stdout=StringIO())
+        self.assertTotals(2, '37.80')
+
+
+class AddQuantityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            name='Rendang', sku='R-1', price=Decimal('18.90'), is_published=True
+        )
+        cls.cart = Cart.objects.create()
+
+    def test_insert_then_increment(self):
+        item_id, old, new = CartItem.objects.add_quantity(self.cart, self.product, 2)
+        self.assertEqual((old, new), (0, 2))
+        self.assertEqual(CartItem.objects.add_quantity(self.cart, self.product, 3), (item_id, 2, 5))
+        self.cart.refresh_totals()
+        self.assertEqual((self.cart.total_items, self.cart.total_price), (5, Decimal('94.50')))
+
+    def test_add_is_one_upsert_plus_totals(self):
+        with CaptureQueriesContext(connection) as queries:
+            CartItem.objects.add_quantity(self.cart, self.product, 1)
+        statements = [q['sql'] for q in queries if 'SAVEPOINT' not in q['sql']]
+        self.assertEqual(len(statements), 2)
+        self.assertIn('ON CONFLICT', statements[0])
+
+
+    def test_sold_out_products_are_not_added(self):
+        Product.objects.filter(pk=self.product.pk).update(stock=0)
+        url = reverse('cart:add_to_cart', args=[self.product.pk])
+
+        response = self.client.post(url, HTTP_HX_REQUEST='true')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['message'], 'Sorry, Rendang is sold out.')
+        response = self.client.post(url)
+        self.assertRedirects(response, reverse('products:product_detail', args=[self.product.slug]))
+        self.assertFalse(CartItem.objects.exists())
+
+class ConcurrentAddQuantityTests(TransactionTestCase):
+    workers = 8
+    adds_per_worker = 10
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            name='Rendang', sku='R-1', price=Decimal('18.90'), is_published=True
+        )
+        self.cart = Cart.objects.create()
+
+    def add_repeatedly(self, barrier, errors):
+        try:
+            barrier.wait()
+            for _ in range(self.adds_per_worker):
+                while True:
+                    try:
+                        CartItem.objects.add_quantity(self.cart, self.product, 1)
+                        break
+                    except OperationalError as exc:
+                        # SQLite reports lock contention instead of waiting;
+                        # the failed transaction rolled back, so retry it.
+                        if 'locked' not in str(exc):
+                            raise
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            connection.close()
+
+    def test_parallel_adds_lose_no_updates(self):
+        barrier = threading.Barrier(self.workers)
+        errors = []
+        threads = [
+            threading.Thread(target=self.add_repeatedly, args=(barrier, errors))
+            for _ in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        expected = self.workers * self.adds_per_worker
+        item = CartItem.objects.get(cart=self.cart, product=self.product)
+        self.assertEqual(item.quantity, expected)
+        self.cart.refresh_totals()
+        self.assertEqual(self.cart.total_items, expected)
+        self.assertEqual(self.cart.total_price, Decimal('18.90') * expected)
+
+
+class LoginCartMergeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('farid', password='secret')
+        cls.products = [
+            Product.objects.create(
+                name=f'Product {number}', sku=f'P-{number}',
+                price=Decimal('5.00'), is_published=True,
+            )
+            for number in range(6)
+        ]
+
+    def add_anonymously(self, products, quantity=2):
+        for product in products:
+            self.client.post(reverse('cart:add_to_cart', args=[product.pk]), {'quantity': quantity})
+        return Cart.objects.get(user__isnull=True)
+
+    def login(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.login(username='farid', password='secret')
+        return queries
+
+    def test_login_merges_into_existing_user_cart(self):
+        user_cart = Cart.objects.create(user=self.user)
+        CartItem.objects.add_quantity(user_cart, self.products[0], 1)
+        CartItem.objects.add_quantity(user_cart, self.products[1], 1)
+        session_cart = self.add_anonymously(self.products[:3])
+
+        self.login()
+
+        self.assertFalse(Cart.objects.filter(pk=session_cart.pk).exists())
+        quantities = dict(user_cart.items.values_list('product__sku', 'quantity'))
+        self.assertEqual(quantities, {'P-0': 3, 'P-1': 3, 'P-2': 2})
+        user_cart.refresh_totals()
+        self.assertEqual((user_cart.total_items, user_cart.total_price), (8, Decimal('40.00')))
+
+    def test_merge_query_count_does_not_grow_with_cart_size(self):
+        Cart.objects.create(user=self.user)
+        self.add_anonymously(self.products[:1])
+        small = len(self.login())
+
+        self.client.logout()
+        self.add_anonymously(self.products)
+        self.assertEqual(len(self.login()), small)
+
+    def test_user_without_cart_takes_over_session_cart(self):
+        session_cart = self.add_anonymously(self.products[:2])
+        self.login()
+        session_cart.refresh_from_db()
+        self.assertEqual(session_cart.user, self.user)
+        self.assertEqual(session_cart.total_items, 4)
+
+    def test_second_merge_is_a_no_op(self):
+        from .utils import merge_session_cart_with_user_cart
+
+        Cart.objects.create(user=self.user)
+        self.add_anonymously(self.products[:1])
+        self.login()
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        self.assertIsNone(merge_session_cart_with_user_cart(request, self.user))
+        self.assertEqual(Cart.objects.get(user=self.user).total_items, 2)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ReadOnlyCartRequestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            name='Rendang', sku='R-1', price=Decimal('18.90'), is_published=True
+        )
+
+    def setUp(self):
+        cache.clear()
+        # Start from nothing pending, whatever earlier tests counted
+        flush_avoided_writes()
+        CartCounter.objects.all().delete()
+
+    def test_reads_create_no_session_or_cart(self):
+        for name in ('cart_detail', 'cart_count', 'cart_items_partial', 'cart_summary_partial'):
+            with self.subTest(view=name):
+                response = self.client.get(reverse(f'cart:{name}'))
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('sessionid', response.cookies)
+
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(Session.objects.exists())
+        # Counted in memory; nothing is written until a flush
+        self.assertEqual(get_avoided_writes(), 0)
+        flush_avoided_writes()
+        self.assertEqual(get_avoided_writes(), 8)
+
+    def test_avoided_writes_are_flushed_when_due_and_at_exit(self):
+        record_avoided_writes(2)
+        self.assertEqual(get_avoided_writes(), 0)
+        with mock.patch('cart.utils.AVOIDED_WRITES_FLUSH_SECONDS', 0):
+            record_avoided_writes(1)
+        self.assertEqual(get_avoided_writes(), 3)
+
+        record_avoided_writes(4)
+        _flush_avoided_writes_at_exit()
+        self.assertEqual(get_avoided_writes(), 7)
+
+    def test_first_post_materialises_cart(self):
+        self.client.post(reverse('cart:add_to_cart', args=[self.product.pk]))
+        self.assertEqual(Cart.objects.count(), 1)
+
+        response = self.client.get(reverse('cart:cart_count'))
+        self.assertEqual(response.json(), {'cart_count': 1, 'cart_total': 18.90})
+        self.assertEqual(Cart.objects.count(), 1)
+
+
+class PurgeStaleCartsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        product = Product.objects.create(name='Rendang', sku='R-1', price=Decimal('18.90'))
+        cls.user = User.objects.create_user('lina', password='secret')
+        old = timezone.now() - timedelta(days=45)
+        for number in range(5):
+            session = Session.objects.create(
+                session_key=f'stale{number}', session_data='', expire_date=old,
+            )
+            cart = Cart.objects.create(session_key=session.session_key)
+            CartItem.objects.add_quantity(cart, product, 1)
+        Cart.objects.update(updated_at=old)
+        cls.user_cart = Cart.objects.create(user=cls.user)
+        Cart.objects.filter(pk=cls.user_cart.pk).update(updated_at=old)
+        cls.fresh_cart = Cart.objects.create(session_key='fresh')
+
+    def purge(self, *args):
+        out = StringIO()
+        call_command('purge_stale_carts', '--sleep=0', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_deletes_nothing(self):
+        output = self.purge('--dry-run')
+        self.assertIn('Would purge 5 anonymous carts with 5 items', output)
+        self.assertEqual(Cart.objects.count(), 7)
+
+    def test_purges_stale_anonymous_carts_in_batches(self):
+        output = self.purge('--batch-size=2')
+        self.assertIn('Purged 5 carts, 5 items and 5 expired sessions', output)
+        self.assertEqual(
+            set(Cart.objects.values_list('pk', flat=True)),
+            {self.user_cart.pk, self.fresh_cart.pk},
+        )
+        self.assertFalse(CartItem.objects.exists())
+        self.assertFalse(Session.objects.exists())
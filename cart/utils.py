@@ -1,4 +1,30 @@
-from .models import Cart
+import atexit
+import os
+import threading
+import time
+from decimal import Decimal
+
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Cart, CartCounter, CartItem
+
+# Session key holding the anonymous cart id. Session data survives the key
+# rotation done by login(), so the cart can still be found and merged then.
+SESSION_CART_ID = 'cart_id'
+
+# CartCounter of session/cart inserts skipped by read-only requests. Each
+# process counts in memory and adds its count to the row at most every
+# AVOIDED_WRITES_FLUSH_SECONDS, and once more when it exits, so page views
+# do not write.
+AVOIDED_WRITES_COUNTER = 'avoided_writes'
+AVOIDED_WRITES_FLUSH_SECONDS = 60
+
+_avoided_writes_lock = threading.Lock()
+_pending_avoided_writes = 0
+_avoided_writes_flushed_at = time.monotonic()
+_avoided_writes_pid = os.getpid()
 
 
 def get_or_create_cart(request):
@@ -11,32 +37,11 @@ def get_or_create_cart(request):
     if request.user.is_authenticated:
         # For authenticated users, get or create cart by user
         session_key = getattr(request.session, 'session_key', None)
+        # (the anonymous cart was already merged by the user_logged_in signal)
         cart, created = Cart.objects.get_or_create(
             user=request.user,
             defaults={'session_key': session_key}
         )
-
-        # If user was anonymous and now logged in, try to merge session cart
-        if created and request.session.session_key:
-            try:
-                session_cart = Cart.objects.get(
-                    session_key=request.session.session_key,
-                    user__isnull=True
-                )
-                # Transfer items from session cart to user cart
-                for item in session_cart.items.all():
-                    cart_item, item_created = cart.items.get_or_create(
-                        product=item.product,
-                        defaults={'quantity': item.quantity}
-                    )
-                    if not item_created:
-                        cart_item.quantity += item.quantity
-                        cart_item.save()
-
-                # Delete the old session cart
-                session_cart.delete()
-            except Cart.DoesNotExist:
-                pass
     else:
         # For anonymous users, get or create cart by session key
         session_key = getattr(request.session, 'session_key', None)
@@ -48,6 +53,8 @@ def get_or_create_cart(request):
             session_key=session_key,
             user__isnull=True
         )
+        if created:
+            request.session[SESSION_CART_ID] = cart.pk
 
     return cart
 
@@ -75,35 +82,134 @@ def get_cart_for_request(request):
         return None
 
 
-def merge_session_cart_with_user_cart(request, user_cart):
+def get_cart_for_read(request):
     """
-    Merge session cart items with user cart when user logs in.
+    Get the cart for a read-only request without ever writing.
+
+    Returns the existing cart, or an empty, unsaved ``Cart`` when there is
+    none, so crawlers and probes hitting cart pages create neither a session
+    nor a cart row. The session and cart are only materialised by
+    ``get_or_create_cart`` on the first mutating POST.
     """
-    session_key = getattr(request.session, 'session_key', None)
-    if not session_key:
-        return
+    cart = get_cart_for_request(request)
+    if cart is None:
+        # get_or_create_cart would have inserted a cart, plus a session for
+        # visitors that did not have one yet
+        has_session = request.user.is_authenticated or request.session.session_key
+        record_avoided_writes(1 if has_session else 2)
+        cart = Cart(user=request.user if request.user.is_authenticated else None)
+    return cart
+
 
+def record_avoided_writes(count):
+    """Count ``count`` avoided writes in this process, flushing now and then."""
+    global _pending_avoided_writes, _avoided_writes_pid
+    with _avoided_writes_lock:
+        # A forked worker must not flush its parent's count again
+        if _avoided_writes_pid != os.getpid():
+            _pending_avoided_writes, _avoided_writes_pid = 0, os.getpid()
+        _pending_avoided_writes += count
+        due = time.monotonic() - _avoided_writes_flushed_at >= AVOIDED_WRITES_FLUSH_SECONDS
+    if due:
+        flush_avoided_writes()
+
+
+def flush_avoided_writes():
+    """Add this process's pending count to the shared counter row."""
+    global _pending_avoided_writes, _avoided_writes_flushed_at
+    with _avoided_writes_lock:
+        count, _pending_avoided_writes = _pending_avoided_writes, 0
+        _avoided_writes_flushed_at = time.monotonic()
+    if count:
+        CartCounter.objects.add(AVOIDED_WRITES_COUNTER, count)
+
+
+@atexit.register
+def _flush_avoided_writes_at_exit():
+    if _avoided_writes_pid != os.getpid():
+        return
     try:
-        session_cart = Cart.objects.get(
-            session_key=session_key,
-            user__isnull=True
-        )
+        flush_avoided_writes()
+    except DatabaseError:
+        # The database may be gone by now, e.g. after the test run
+        pass
+
+
+def get_avoided_writes():
+    """Return how many session/cart inserts read-only requests have skipped."""
+    return CartCounter.objects.filter(name=AVOIDED_WRITES_COUNTER).values_list(
+        'value', flat=True
+    ).first() or 0
 
-        # Transfer items from session cart to user cart
-        for session_item in session_cart.items.all():
-            user_cart_item, created = user_cart.items.get_or_create(
-                product=session_item.product,
-                defaults={'quantity': session_item.quantity}
-            )
 
-            if not created:
-                # Item already exists in user cart, add quantities
-                user_cart_item.quantity += session_item.quantity
-                user_cart_item.save()
+def get_cart_summary(request):
+    """
+    Return ``(total_items, total_price)`` for the current user or session.
+
+    Both values are read from the cart's stored totals in a single-row query
+    and memoised on the request, so every reader in one request shares it.
+    Anonymous visitors without a session cost no query at all.
+    """
+    summary = getattr(request, '_cart_summary', None)
+    if summary is None:
+        summary = _load_cart_summary(request)
+        request._cart_summary = summary
+    return summary
+
+
+def _load_cart_summary(request):
+    if request.user.is_authenticated:
+        carts = Cart.objects.filter(user=request.user)
+    else:
+        session_key = getattr(request.session, 'session_key', None)
+        if not session_key:
+            return 0, Decimal('0.00')
+        carts = Cart.objects.filter(session_key=session_key, user__isnull=True)
 
-        # Delete the session cart after merging
+    totals = carts.values_list('item_count', 'subtotal').first()
+    return totals or (0, Decimal('0.00'))
+
+
+def merge_session_cart_with_user_cart(request, user):
+    """
+    Merge the anonymous session cart into the user's cart when they log in.
+
+    Runs in one transaction that locks the session cart row, so concurrent
+    logins from the same session cannot merge it twice. If the user has no
+    cart yet the session cart is simply handed over; otherwise its lines are
+    copied across with one set-based upsert and it is deleted.
+    Returns the user's cart, or None if there was nothing to merge.
+    """
+    cart_id = request.session.pop(SESSION_CART_ID, None)
+    session_key = getattr(request.session, 'session_key', None)
+
+    session_carts = Cart.objects.filter(user__isnull=True)
+    if cart_id:
+        session_carts = session_carts.filter(pk=cart_id)
+    elif session_key:
+        session_carts = session_carts.filter(session_key=session_key)
+    else:
+        return None
+
+    with transaction.atomic():
+        session_cart = session_carts.select_for_update().first()
+        if session_cart is None:
+            # No session cart, or a concurrent login already merged it
+            return None
+
+        user_cart = Cart.objects.select_for_update().filter(user=user).first()
+        if user_cart is None:
+            session_cart.user = user
+            session_cart.save(update_fields=['user', 'updated_at'])
+            return session_cart
+
+        if session_cart.item_count:
+            CartItem.objects.merge_cart(source=session_cart, target=user_cart)
+            Cart.objects.filter(pk=user_cart.pk).update(
+                item_count=F('item_count') + session_cart.item_count,
+                subtotal=F('subtotal') + session_cart.subtotal,
+                updated_at=timezone.now(),
+            )
         session_cart.delete()
 
-    except Cart.DoesNotExist:
-        # No session cart to merge
-        pass
+    return user_cart
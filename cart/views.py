@@ -5,11 +5,19 @@ from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 from django.template.loader import render_to_string
-from products.models import Product
+from products.models import Product, primary_image_prefetch
 from .models import Cart, CartItem
-from .utils import get_or_create_cart
+from .utils import get_cart_for_read, get_or_create_cart
 import random
 
+def get_cart_items(cart):
+    """Cart lines with their product and its primary image, in two queries."""
+    if not cart.pk:
+        return []
+    return cart.items.select_related('product').prefetch_related(
+        primary_image_prefetch('product__images')
+    )
+
 def get_quantity_update_message(old_quantity, new_quantity, product_name):
     """Get a user-friendly message for quantity changes"""
     if new_quantity > old_quantity:
@@ -49,11 +57,11 @@ def get_empty_message():
 
 def cart_detail(request):
     """Display cart contents."""
-    cart = get_or_create_cart(request)
+    cart = get_cart_for_read(request)
 
     context = {
         'cart': cart,
-        'cart_items': cart.items.select_related('product').all() if cart else [],
+        'cart_items': get_cart_items(cart),
     }
 
     return render(request, 'cart/cart_detail.html', context)
@@ -63,6 +71,16 @@ def cart_detail(request):
 def add_to_cart(request, product_id):
     """Add a product to the cart."""
     product = get_object_or_404(Product, id=product_id, is_published=True)
+    is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.headers.get('HX-Request')
+
+    # Checkout would refuse it anyway; don't let it into the cart
+    if product.is_sold_out:
+        message = f"Sorry, {product.name} is sold out."
+        if is_ajax:
+            return JsonResponse({'success': False, 'message': message}, status=409)
+        messages.error(request, message)
+        return redirect('products:product_detail', slug=product.slug)
+
     cart = get_or_create_cart(request)
 
     # Get quantity from POST data, default to 1
@@ -73,26 +91,19 @@ def add_to_cart(request, product_id):
     except (ValueError, TypeError):
         quantity = 1
 
-    # Check if item already exists in cart
-    cart_item, created = CartItem.objects.get_or_create(
-        cart=cart,
-        product=product,
-        defaults={'quantity': quantity}
-    )
+    # Insert the line or add to it in one atomic statement
+    _, old_quantity, new_quantity = CartItem.objects.add_quantity(cart, product, quantity)
 
-    if not created:
-        # Item already exists, update quantity
-        old_quantity = cart_item.quantity
-        cart_item.quantity += quantity
-        cart_item.save()
-        # Use specific message for quantity changes
-        message = get_quantity_update_message(old_quantity, cart_item.quantity, product.name)
+    if old_quantity:
+        # Item already existed, use specific message for quantity changes
+        message = get_quantity_update_message(old_quantity, new_quantity, product.name)
     else:
         # New item added
         message = get_add_message(quantity, product.name)
 
     # Handle AJAX requests
-    if request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.headers.get('HX-Request'):
+    if is_ajax:
+        cart.refresh_totals()
         return JsonResponse({
             'success': True,
             'message': message,
@@ -135,6 +146,7 @@ def update_cart_item(request, item_id):
 
     # Handle AJAX requests
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.headers.get('HX-Request'):
+        cart.refresh_totals()
         if quantity < 1:
             # Item was removed
             return JsonResponse({
@@ -169,6 +181,7 @@ def remove_from_cart(request, item_id):
 
     # Handle AJAX requests
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.headers.get('HX-Request'):
+        cart.refresh_totals()
         return JsonResponse({
             'success': True,
             'message': message,
@@ -206,22 +219,22 @@ def clear_cart(request):
 
 def cart_count(request):
     """Return cart count for AJAX requests."""
-    cart = get_or_create_cart(request)
+    cart = get_cart_for_read(request)
 
     return JsonResponse({
-        'cart_count': cart.total_items if cart else 0,
-        'cart_total': float(cart.total_price) if cart else 0.0
+        'cart_count': cart.total_items,
+        'cart_total': float(cart.total_price)
     })
 
 
 # HTMX specific views for partial updates
 def cart_items_partial(request):
     """Return partial template for cart items (for HTMX updates)."""
-    cart = get_or_create_cart(request)
+    cart = get_cart_for_read(request)
 
     context = {
         'cart': cart,
-        'cart_items': cart.items.select_related('product').all() if cart else [],
+        'cart_items': get_cart_items(cart),
     }
 
     return render(request, 'cart/partials/cart_items.html', context)
@@ -229,7 +242,7 @@ def cart_items_partial(request):
 
 def cart_summary_partial(request):
     """Return partial template for cart summary (for HTMX updates)."""
-    cart = get_or_create_cart(request)
+    cart = get_cart_for_read(request)
 
     context = {
         'cart': cart,
@@ -3,8 +3,10 @@ Context processors for the core application.
 These functions add global variables to template contexts.
 """
 
-from products.models import Category
-from cart.utils import get_cart_for_request
+from django.utils.functional import SimpleLazyObject
+
+from products.cache import get_category_navigation
+from cart.utils import get_cart_for_request, get_cart_summary
 
 
 def categories(request):
@@ -12,20 +14,26 @@ def categories(request):
     Add all categories to the template context.
     This makes categories available in all templates without explicitly passing them.
 
+    The list is resolved lazily, so pages that never loop over it pay nothing,
+    and comes from the cached category navigation (see products/cache.py), so
+    pages that do usually pay nothing either. Each category also carries the
+    number of published products in it.
+
     Usage in templates:
     {% for category in categories %}
-        <a href="#">{{ category.name }}</a>
+        <a href="#">{{ category.name }} ({{ category.product_count }})</a>
     {% endfor %}
     """
-    try:
-        return {
-            'categories': Category.objects.all().order_by('name')
-        }
-    except Exception:
-        # Return empty list if database isn't ready or there's an error
-        return {
-            'categories': []
-        }
+    def load():
+        try:
+            return get_category_navigation()
+        except Exception:
+            # Return empty tuple if database isn't ready or there's an error
+            return ()
+
+    return {
+        'categories': SimpleLazyObject(load)
+    }
 
 
 def site_info(request):
@@ -45,20 +53,14 @@ def site_info(request):
 def cart_info(request):
     """
     Add shopping cart information to the template context.
-    """
-    cart = get_cart_for_request(request)
-
-    cart_count = 0
-    cart_total = 0.00
-
-    if cart:
-        cart_count = cart.total_items
-        cart_total = float(cart.total_price)
 
+    Every value is lazy: pages that never show the cart run no query, and
+    ``cart_count``/``cart_total`` share one memoised aggregate query.
+    """
     return {
-        'cart_count': cart_count,
-        'cart_total': cart_total,
-        'cart': cart,
+        'cart_count': SimpleLazyObject(lambda: get_cart_summary(request)[0]),
+        'cart_total': SimpleLazyObject(lambda: float(get_cart_summary(request)[1])),
+        'cart': SimpleLazyObject(lambda: get_cart_for_request(request)),
     }
 
 
@@ -113,6 +113,35 @@ if not all([os.getenv('DB_NAME'), os.getenv('DB_USER'), os.getenv('DB_PASSWORD')
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Catalog reads are cached under a version counter (products/cache.py), so the
+# cache must be shared by every worker process: Redis when REDIS_URL is set,
+# otherwise a file-based cache shared by all workers on this host. With more
+# than one host, set REDIS_URL: a version bump on one host does not reach the
+# file-based cache of another, which keeps serving its catalog pages until
+# they expire (products.cache.CATALOG_CACHE_TIMEOUT, ten minutes).
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': BASE_DIR / '.cache',
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        }
+    }
+
+# Test runs get a private in-memory cache (core/test_runner.py)
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -180,6 +209,20 @@ EMAIL_HOST_USER = "resend"
 EMAIL_HOST_PASSWORD = os.getenv("RESEND_API_KEY")  # Your Resend API key
 DEFAULT_FROM_EMAIL = "noreply@applikasi.tech"  # Your verified sender domain
 
+# Product catalog: use keyset (cursor) pagination with infinite scroll
+# instead of numbered pages. Can also be enabled per request with ?cursor=
+PRODUCT_CURSOR_PAGINATION = os.getenv('PRODUCT_CURSOR_PAGINATION', 'False').lower() == 'true'
+
+# Kitchen board: open boards keep a server-sent event stream. Serve the app
+# under ASGI (e.g. gunicorn core.asgi:application -k uvicorn.workers.UvicornWorker)
+# so that waiting streams cost no worker; under WSGI each one holds a thread.
+# Streams beyond this many per process are refused with 503.
+KITCHEN_BOARD_MAX_STREAMS = int(os.getenv('KITCHEN_BOARD_MAX_STREAMS', '50'))
+
+# Orders: node id (0-65535) embedded in generated order numbers. Leave unset
+# to derive one from the host name and process id.
+ORDER_NUMBER_NODE_ID = os.getenv('ORDER_NUMBER_NODE_ID')
+
 # Security settings for production
 if not DEBUG:
     SECURE_BROWSER_XSS_FILTER = True
@@ -42,10 +42,10 @@ STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
 import tempfile
 MEDIA_ROOT = tempfile.mkdtemp()
 
-# Cache - Use dummy cache for tests
+# Cache - Use a private in-memory cache for tests
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
@@ -0,0 +1,29 @@
+"""
+Test runner that keeps test runs off the shared cache.
+
+The project's cache is shared with the running site (Redis or the
+file-based cache under ``.cache/``), and catalog pages are cached under a
+version counter that outlives a test database. Each run therefore gets a
+private in-memory cache, so nothing leaks into the site's cache or from one
+run into the next.
+"""
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._cache_override = override_settings(CACHES=TEST_CACHES)
+        self._cache_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._cache_override.disable()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,57 @@
+"""
+Leased work queues on database tables.
+
+The mail outbox (``pages.outbox``) and the image jobs
+(``products.image_jobs``) are both tables of rows with ``status``,
+``attempts``, ``next_attempt_at`` and ``last_error``, worked off by
+background workers. ``LeasedQueue`` holds what they share:
+
+* due rows are claimed with ``SELECT ... FOR UPDATE SKIP LOCKED`` and leased
+  by pushing ``next_attempt_at`` forward, in a transaction that commits
+  before any work is done, so several workers can run side by side and a
+  worker that dies mid-batch lets the lease expire for the rows to be
+  picked up again;
+* a failed row is retried after ``backoff(attempts)`` seconds until
+  ``max_attempts`` is reached, then marked ``failed``.
+"""
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+
+class LeasedQueue:
+    def __init__(self, model, lease_seconds, backoff):
+        self.model = model
+        self.lease_seconds = lease_seconds
+        self.backoff = backoff
+
+    def claim(self, batch_size):
+        """
+        Lease up to ``batch_size`` due rows to this worker and return them.
+        Rows locked by another worker's claim are skipped, not waited for.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            batch = list(
+                self.model.objects
+                .select_for_update(skip_locked=True)
+                .filter(status='pending', next_attempt_at__lte=now)
+                .order_by('next_attempt_at')[:batch_size]
+            )
+            if batch:
+                self.model.objects.filter(pk__in=[row.pk for row in batch]).update(
+                    next_attempt_at=now + timedelta(seconds=self.lease_seconds)
+                )
+        return batch
+
+    def record_failure(self, row, error, max_attempts):
+        """Schedule a retry of ``row`` after ``error``, or give up on it."""
+        attempts = row.attempts + 1
+        update = {'attempts': attempts, 'last_error': f'{type(error).__name__}: {error}'}
+        if attempts >= max_attempts:
+            update['status'] = 'failed'
+        else:
+            update['next_attempt_at'] = timezone.now() + timedelta(seconds=self.backoff(attempts))
+        self.model.objects.filter(pk=row.pk).update(**update)
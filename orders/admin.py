@@ -1,6 +1,14 @@
-from django.contrib import admin
+from datetime import date, timedelta
+
+from django.contrib import admin, messages
+from django.http import StreamingHttpResponse
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
 from django.utils.html import format_html
-from .models import Order, OrderItem
+from .exports import CONTENT_TYPES, stream_orders
+from .models import DailySales, Order, OrderItem, OrderStatusEvent
+from .reports import get_watermark, sales_report
 
 
 class OrderItemInline(admin.TabularInline):
@@ -16,13 +24,25 @@ class OrderItemInline(admin.TabularInline):
     total_price.short_description = "Total Price"
 
 
+class OrderStatusEventInline(admin.TabularInline):
+    model = OrderStatusEvent
+    extra = 0
+    can_delete = False
+    fields = ('created_at', 'from_status', 'to_status', 'changed_by', 'note')
+    readonly_fields = fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('order_number', 'customer_name', 'status', 'total_amount', 'created_at', 'order_status_badge')
     list_filter = ('status', 'created_at', 'updated_at')
     search_fields = ('order_number', 'customer_name', 'customer_email', 'customer_phone')
-    readonly_fields = ('order_number', 'created_at', 'updated_at', 'total_items')
-    inlines = [OrderItemInline]
+    # Status only changes through the actions, so every change is logged
+    readonly_fields = ('order_number', 'status', 'created_at', 'updated_at', 'total_items')
+    inlines = [OrderItemInline, OrderStatusEventInline]
 
     fieldsets = (
         ('Order Information', {
@@ -62,28 +82,57 @@ class OrderAdmin(admin.ModelAdmin):
         return obj.total_items
     total_items.short_description = 'Total Items'
 
-    actions = ['mark_as_confirmed', 'mark_as_preparing', 'mark_as_ready', 'mark_as_delivered']
+    actions = [
+        'mark_as_confirmed', 'mark_as_preparing', 'mark_as_ready', 'mark_as_delivered',
+        'mark_as_cancelled', 'export_as_csv', 'export_as_jsonl',
+    ]
+
+    def _transition(self, request, queryset, to_status):
+        # One conditional UPDATE plus one bulk insert of events, however many are selected
+        moved = queryset.transition(to_status, changed_by=request.user, note='admin action')
+        label = dict(Order.STATUS_CHOICES)[to_status].lower()
+        if moved:
+            self.message_user(request, f'{moved} orders marked as {label}.')
+        else:
+            self.message_user(
+                request, f'No selected orders can be marked as {label}.', messages.WARNING
+            )
 
     def mark_as_confirmed(self, request, queryset):
-        updated = queryset.update(status='confirmed')
-        self.message_user(request, f'{updated} orders marked as confirmed.')
+        self._transition(request, queryset, 'confirmed')
     mark_as_confirmed.short_description = 'Mark selected orders as confirmed'
 
     def mark_as_preparing(self, request, queryset):
-        updated = queryset.update(status='preparing')
-        self.message_user(request, f'{updated} orders marked as preparing.')
+        self._transition(request, queryset, 'preparing')
     mark_as_preparing.short_description = 'Mark selected orders as preparing'
 
     def mark_as_ready(self, request, queryset):
-        updated = queryset.update(status='ready')
-        self.message_user(request, f'{updated} orders marked as ready.')
+        self._transition(request, queryset, 'ready')
     mark_as_ready.short_description = 'Mark selected orders as ready'
 
     def mark_as_delivered(self, request, queryset):
-        updated = queryset.update(status='delivered')
-        self.message_user(request, f'{updated} orders marked as delivered.')
+        self._transition(request, queryset, 'delivered')
     mark_as_delivered.short_description = 'Mark selected orders as delivered'
 
+    def mark_as_cancelled(self, request, queryset):
+        self._transition(request, queryset, 'cancelled')
+    mark_as_cancelled.short_description = 'Cancel selected orders'
+
+    def _export(self, queryset, fmt):
+        # Streamed line by line; select all to export everything matching the filters
+        response = StreamingHttpResponse(stream_orders(queryset, fmt), content_type=CONTENT_TYPES[fmt])
+        filename = f'orders-{timezone.localtime():%Y%m%d-%H%M%S}.{fmt}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    def export_as_csv(self, request, queryset):
+        return self._export(queryset, 'csv')
+    export_as_csv.short_description = 'Export selected orders as CSV'
+
+    def export_as_jsonl(self, request, queryset):
+        return self._export(queryset, 'jsonl')
+    export_as_jsonl.short_description = 'Export selected orders as JSON Lines'
+
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
@@ -95,3 +144,46 @@ class OrderItemAdmin(admin.ModelAdmin):
     def total_price(self, obj):
         return f"RM {obj.total_price}"
     total_price.short_description = "Total Price"
+
+
+@admin.register(DailySales)
+class DailySalesAdmin(admin.ModelAdmin):
+    """Read-only view of the sales rollups plus the sales report."""
+    list_display = ('date', 'order_count', 'cancelled_count', 'units', 'revenue')
+    date_hierarchy = 'date'
+    change_list_template = 'admin/orders/dailysales/change_list.html'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path('report/', self.admin_site.admin_view(self.report_view), name='orders_sales_report'),
+        ] + super().get_urls()
+
+    def report_view(self, request):
+        """Sales report for a date range, read from the rollup tables only."""
+        end = _parse_date(request.GET.get('end')) or timezone.localdate()
+        start = _parse_date(request.GET.get('start')) or end - timedelta(days=364)
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Sales report',
+            'report': sales_report(start, end),
+            'watermark': get_watermark(),
+        }
+        return TemplateResponse(request, 'admin/orders/sales_report.html', context)
+
+
+def _parse_date(value):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
@@ -0,0 +1,101 @@
+"""
+Streaming order exports (CSV and JSON Lines).
+
+Orders are read with ``iterator(chunk_size=...)``, which uses a server-side
+cursor on PostgreSQL, and their items are prefetched one chunk at a time, so
+memory stays flat however many orders are exported. Output is produced line
+by line as a generator, suitable for ``StreamingHttpResponse`` or a file.
+
+CSV has one row per order item with the order columns repeated; JSONL has
+one object per order with its items nested.
+"""
+
+import csv
+import json
+
+from django.db.models import Prefetch
+
+from .models import OrderItem
+
+CHUNK_SIZE = 2000
+
+ORDER_FIELDS = (
+    'order_number', 'status', 'created_at', 'customer_name', 'customer_email',
+    'customer_phone', 'delivery_address', 'total_amount', 'notes',
+)
+ITEM_FIELDS = ('sku', 'product', 'quantity', 'price', 'line_total')
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+class Echo:
+    """File-like object whose ``write`` just returns the line for yielding."""
+
+    def write(self, value):
+        return value
+
+
+def iter_orders(queryset, chunk_size=CHUNK_SIZE):
+    """Yield orders in id order, prefetching items for each chunk only."""
+    items = OrderItem.objects.select_related('product').only(
+        'order_id', 'quantity', 'price', 'product__name', 'product__sku',
+    ).order_by('pk')
+    return (
+        queryset
+        .order_by('pk')
+        .only(*ORDER_FIELDS)
+        .prefetch_related(Prefetch('items', queryset=items))
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def _order_values(order):
+    return {
+        'order_number': order.order_number,
+        'status': order.status,
+        'created_at': order.created_at.isoformat(),
+        'customer_name': order.customer_name,
+        'customer_email': order.customer_email,
+        'customer_phone': order.customer_phone,
+        'delivery_address': order.delivery_address,
+        'total_amount': str(order.total_amount),
+        'notes': order.notes,
+    }
+
+
+def _item_values(item):
+    return {
+        'sku': item.product.sku,
+        'product': item.product.name,
+        'quantity': item.quantity,
+        'price': str(item.price),
+        'line_total': str(item.total_price),
+    }
+
+
+def stream_csv(queryset, chunk_size=CHUNK_SIZE):
+    writer = csv.writer(Echo())
+    yield writer.writerow(ORDER_FIELDS + ITEM_FIELDS)
+    for order in iter_orders(queryset, chunk_size):
+        values = list(_order_values(order).values())
+        for item in order.items.all():
+            yield writer.writerow(values + list(_item_values(item).values()))
+
+
+def stream_jsonl(queryset, chunk_size=CHUNK_SIZE):
+    for order in iter_orders(queryset, chunk_size):
+        record = _order_values(order)
+        record['items'] = [_item_values(item) for item in order.items.all()]
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def stream_orders(queryset, fmt, chunk_size=CHUNK_SIZE):
+    """Return a generator of text lines exporting ``queryset`` as ``fmt``."""
+    if fmt == 'csv':
+        return stream_csv(queryset, chunk_size)
+    if fmt == 'jsonl':
+        return stream_jsonl(queryset, chunk_size)
+    raise ValueError(f'Unsupported export format: {fmt!r}')
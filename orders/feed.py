@@ -0,0 +1,240 @@
+"""
+Change feed for the kitchen board.
+
+On PostgreSQL a statement-level trigger on the orders table sends
+``NOTIFY kitchen_orders`` whenever orders are inserted or change status.
+Notifications are delivered on commit and identical ones within a
+transaction are collapsed, so a 10k-order admin action is a single wake-up.
+
+Elsewhere (SQLite in development) the feed polls the board version, the
+newest ``Order.updated_at``, which is one lookup on the ``updated_at`` index.
+The value is shared through the cache for ``POLL_INTERVAL``.
+
+Either way each process runs one ``BoardFeed`` watcher thread, holding the
+only ``LISTEN`` connection (or doing the only polling) for every board that
+process serves, and only while some board is open. Open boards subscribe to
+it: ``watch_board`` for async streams under ASGI, where a board costs no
+worker at all, and ``wait_for_changes`` for WSGI, where it holds a thread.
+Both yield ``True`` when the board should reload and ``False`` as a
+heartbeat when nothing happened.
+"""
+
+import asyncio
+import logging
+import select
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Max
+
+logger = logging.getLogger(__name__)
+
+ORDERS_TABLE = 'orders_order'
+CHANNEL = 'kitchen_orders'
+PG_TRIGGER = 'orders_order_kitchen_notify'
+PG_FUNCTION = 'orders_order_kitchen_notify'
+
+POLL_INTERVAL = 2
+HEARTBEAT_INTERVAL = 15
+BOARD_VERSION_KEY = 'orders:kitchen_board_version'
+
+
+def install_change_feed(schema_editor):
+    """Create the NOTIFY trigger (PostgreSQL only; other backends poll)."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f"""
+        CREATE OR REPLACE FUNCTION {PG_FUNCTION}() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{CHANNEL}', '');
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    schema_editor.execute(f'DROP TRIGGER IF EXISTS {PG_TRIGGER} ON {ORDERS_TABLE}')
+    schema_editor.execute(f"""
+        CREATE TRIGGER {PG_TRIGGER}
+        AFTER INSERT OR DELETE OR UPDATE OF status ON {ORDERS_TABLE}
+        FOR EACH STATEMENT EXECUTE FUNCTION {PG_FUNCTION}()
+    """)
+
+
+def uninstall_change_feed(schema_editor):
+    """Drop everything created by ``install_change_feed``."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP TRIGGER IF EXISTS {PG_TRIGGER} ON {ORDERS_TABLE}')
+    schema_editor.execute(f'DROP FUNCTION IF EXISTS {PG_FUNCTION}()')
+
+
+def get_board_version():
+    """Newest order change, shared between boards for ``POLL_INTERVAL``."""
+    version = cache.get(BOARD_VERSION_KEY)
+    if version is None:
+        from .models import Order
+
+        latest = Order.objects.order_by().aggregate(latest=Max('updated_at'))['latest']
+        version = latest.isoformat() if latest else ''
+        cache.set(BOARD_VERSION_KEY, version, POLL_INTERVAL)
+    return version
+
+
+class Subscription:
+    """A board waiting on the feed from a thread (WSGI)."""
+
+    def __init__(self):
+        self.changed = threading.Event()
+
+    def notify(self):
+        self.changed.set()
+
+    def wait(self, timeout):
+        """Whether a change arrived within ``timeout`` seconds."""
+        changed = self.changed.wait(timeout)
+        self.changed.clear()
+        return changed
+
+
+class AsyncSubscription:
+    """A board waiting on the feed from an event loop (ASGI)."""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        self.loop.call_soon_threadsafe(self.changed.set)
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except TimeoutError:
+            return False
+        self.changed.clear()
+        return True
+
+
+class BoardFeed:
+    """
+    Fans one watcher thread out to every board open in this process. The
+    thread starts with the first subscriber and stops, closing its
+    connection, soon after the last one leaves.
+    """
+
+    def __init__(self, using='default'):
+        self.using = using
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.thread = None
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    def subscribe(self, subscription):
+        with self.lock:
+            self.subscribers.add(subscription)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='kitchen-board-feed', daemon=True)
+                self.thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def notify(self):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            subscription.notify()
+
+    def _keep_running(self):
+        # Checked and cleared under the lock, so subscribe() starts a new
+        # thread exactly when this one has decided to stop
+        with self.lock:
+            if self.subscribers:
+                return True
+            self.thread = None
+            return False
+
+    def _run(self):
+        try:
+            while True:
+                try:
+                    if connections[self.using].vendor == 'postgresql':
+                        return self._listen()
+                    return self._poll()
+                except Exception:
+                    logger.exception('Kitchen board feed failed; reconnecting')
+                    time.sleep(POLL_INTERVAL)
+                    if not self._keep_running():
+                        return
+                    # Changes may have been missed while disconnected
+                    self.notify()
+        finally:
+            connections.close_all()
+
+    def _listen(self):
+        wrapper = connections[self.using]
+        # A dedicated connection: LISTEN needs autocommit and must not be pooled
+        connection = wrapper.get_new_connection(wrapper.get_connection_params())
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f'LISTEN {CHANNEL}')
+            while self._keep_running():
+                # Wake up now and then to notice that every board has gone
+                readable, _, _ = select.select([connection], [], [], HEARTBEAT_INTERVAL)
+                if not readable:
+                    continue
+                connection.poll()
+                if connection.notifies:
+                    connection.notifies.clear()
+                    self.notify()
+        finally:
+            connection.close()
+
+    def _poll(self):
+        version = get_board_version()
+        while self._keep_running():
+            time.sleep(POLL_INTERVAL)
+            latest = get_board_version()
+            if latest != version:
+                version = latest
+                self.notify()
+
+
+board_feed = BoardFeed()
+
+
+def wait_for_changes(duration, feed=None):
+    """
+    Yield ``True`` for each change to the orders and ``False`` as a
+    heartbeat at least every ``HEARTBEAT_INTERVAL`` seconds, for up to
+    ``duration`` seconds. Blocks the calling thread.
+    """
+    if feed is None:
+        feed = board_feed
+    subscription = feed.subscribe(Subscription())
+    try:
+        deadline = time.monotonic() + duration
+        while (remaining := deadline - time.monotonic()) > 0:
+            yield subscription.wait(min(remaining, HEARTBEAT_INTERVAL))
+    finally:
+        feed.unsubscribe(subscription)
+
+
+async def watch_board(duration, feed=None):
+    """``wait_for_changes`` for event loops; waiting costs no thread."""
+    if feed is None:
+        feed = board_feed
+    subscription = feed.subscribe(AsyncSubscription())
+    try:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + duration
+        while (remaining := deadline - loop.time()) > 0:
+            yield await subscription.wait(min(remaining, HEARTBEAT_INTERVAL))
+    finally:
+        feed.unsubscribe(subscription)
@@ -1,3 +1,5 @@
+import uuid
+
 from django import forms
 from django.core.validators import RegexValidator
 
@@ -58,6 +60,18 @@ class CheckoutForm(forms.Form):
         label='Order Notes (Optional)'
     )
 
+    # One key per rendered form; resubmitting the same form reuses it
+    idempotency_key = forms.RegexField(
+        regex=r'^[0-9a-f]{32}$',
+        required=False,
+        widget=forms.HiddenInput,
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.is_bound:
+            self.initial.setdefault('idempotency_key', uuid.uuid4().hex)
+
     def clean_customer_name(self):
         name = self.cleaned_data.get('customer_name')
         if name:
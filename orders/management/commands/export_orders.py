@@ -0,0 +1,71 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.exports import CHUNK_SIZE, stream_orders
+from orders.models import Order
+from orders.reports import day_range
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream orders with their items as CSV or JSON Lines to stdout or a file. '
+        'Orders are read in chunks through a server-side cursor, so memory use '
+        'does not grow with the number of orders.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'jsonl'],
+            default='csv',
+            help='Output format (default: csv)',
+        )
+        parser.add_argument(
+            '--output',
+            help='Write to this file instead of stdout',
+        )
+        parser.add_argument(
+            '--status',
+            action='append',
+            default=[],
+            choices=[value for value, _ in Order.STATUS_CHOICES],
+            help='Only export orders with this status (repeatable)',
+        )
+        parser.add_argument(
+            '--since',
+            metavar='YYYY-MM-DD',
+            help='Only export orders placed on or after this day',
+        )
+        parser.add_argument(
+            '--until',
+            metavar='YYYY-MM-DD',
+            help='Only export orders placed on or before this day',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help=f'Orders fetched per round trip (default: {CHUNK_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        if options['status']:
+            orders = orders.filter(status__in=options['status'])
+        try:
+            if options['since']:
+                orders = orders.filter(created_at__gte=day_range(date.fromisoformat(options['since']))[0])
+            if options['until']:
+                orders = orders.filter(created_at__lt=day_range(date.fromisoformat(options['until']))[1])
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+
+        lines = stream_orders(orders, options['format'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(lines)
+            self.stderr.write(self.style.SUCCESS(f'Exported orders to {options["output"]}'))
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,47 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.reports import get_watermark, refresh_days, rollup_since, set_watermark
+
+
+class Command(BaseCommand):
+    help = (
+        'Refresh the daily, product and category sales rollups. Only days '
+        'with orders changed since the last run are rebuilt.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Ignore the watermark and rebuild every day with orders',
+        )
+        parser.add_argument(
+            '--day',
+            action='append',
+            default=[],
+            metavar='YYYY-MM-DD',
+            help='Rebuild this day only (repeatable); leaves the watermark alone',
+        )
+
+    def handle(self, *args, **options):
+        if options['day']:
+            try:
+                days = [date.fromisoformat(value) for value in options['day']]
+            except ValueError as e:
+                raise CommandError(f'Invalid --day: {e}')
+            refreshed = refresh_days(days)
+            self.stdout.write(self.style.SUCCESS(f'Refreshed {refreshed} days'))
+            return
+
+        since = None if options['full'] else get_watermark()
+        refreshed, watermark = rollup_since(since)
+        set_watermark(watermark)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Refreshed {refreshed} days '
+                f'({"full rebuild" if since is None else f"orders changed since {since:%Y-%m-%d %H:%M:%S}"})'
+            )
+        )
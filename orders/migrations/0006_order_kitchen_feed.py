@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:52
+
+from django.db import migrations, models
+
+from orders.feed import install_change_feed, uninstall_change_feed
+
+
+def install(apps, schema_editor):
+    install_change_feed(schema_editor)
+
+
+def uninstall(apps, schema_editor):
+    uninstall_change_feed(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_order_status_events'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'confirmed', 'preparing'])), fields=['created_at'], name='order_kitchen_queue_idx'),
+        ),
+        migrations.RunPython(install, uninstall),
+    ]
@@ -1,8 +1,71 @@
-from django.db import models
+from django.db import connections, models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 from decimal import Decimal
-from products.models import Product
+from products.models import Category, Product
+
+from .numbering import next_order_number
+
+
+class OrderQuerySet(models.QuerySet):
+    def transition(self, to_status, changed_by=None, note=''):
+        """
+        Move every order in this queryset that may go to ``to_status`` (see
+        ``Order.TRANSITIONS``) and log an ``OrderStatusEvent`` for each.
+
+        Runs one conditional ``UPDATE ... WHERE status = <source> ...
+        RETURNING id`` per allowed source status (one for most targets) and
+        one bulk insert of events, however many orders are selected. Orders
+        in any other status are left alone. Cancelling also puts the items
+        back into stock with one more UPDATE. Returns the number that moved.
+        """
+        sources = Order.allowed_sources(to_status)
+        if not sources:
+            return 0
+
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        selected_sql, selected_params = self.order_by().values('pk').query.sql_with_params()
+        now = timezone.now()
+
+        events = []
+        with transaction.atomic(using=self.db):
+            with connection.cursor() as cursor:
+                for source in sources:
+                    cursor.execute(
+                        f"""
+                        UPDATE {table} SET {qn('status')} = %s, {qn('updated_at')} = %s
+                        WHERE {qn('status')} = %s AND {qn('id')} IN ({selected_sql})
+                        RETURNING {qn('id')}
+                        """,
+                        [to_status, connection.ops.adapt_datetimefield_value(now), source,
+                         *selected_params],
+                    )
+                    events.extend(
+                        OrderStatusEvent(
+                            order_id=order_id, from_status=source, to_status=to_status,
+                            changed_by=changed_by, note=note, created_at=now,
+                        )
+                        for (order_id,) in cursor.fetchall()
+                    )
+            OrderStatusEvent.objects.using(self.db).bulk_create(events)
+            if to_status == 'cancelled' and events:
+                release_stock([event.order_id for event in events], using=self.db)
+
+        return len(events)
+
+
+def release_stock(order_ids, using='default'):
+    """Put the items of cancelled orders back into stock, in one UPDATE."""
+    ordered = OrderItem.objects.using(using).filter(order_id__in=order_ids)
+    returned = (
+        ordered.filter(product=models.OuterRef('pk'))
+        .values('product').annotate(total=models.Sum('quantity')).values('total')
+    )
+    return Product.objects.using(using).filter(
+        pk__in=ordered.values('product'), stock__isnull=False,
+    ).update(stock=models.F('stock') + models.Subquery(returned))
 
 
 class Order(models.Model):
@@ -15,6 +78,16 @@ class Order(models.Model):
         ('cancelled', 'Cancelled'),
     ]
 
+    # Allowed status changes: current status -> statuses it may move to
+    TRANSITIONS = {
+        'pending': ('confirmed', 'cancelled'),
+        'confirmed': ('preparing', 'cancelled'),
+        'preparing': ('ready',),
+        'ready': ('delivered',),
+        'delivered': (),
+        'cancelled': (),
+    }
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
     order_number = models.CharField(max_length=100, unique=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
@@ -29,12 +102,34 @@ class Order(models.Model):
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     notes = models.TextField(blank=True)
 
+    # Issued with the checkout form so a repeated submission finds this order
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True, editable=False)
+
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = OrderQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Order history: a user's orders, newest first, keyset-paginated
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+            # Sales rollups: orders changed since the watermark, and by day
+            models.Index(fields=['updated_at'], name='order_updated_idx'),
+            models.Index(fields=['created_at'], name='order_created_idx'),
+            # Kitchen board: orders still to be prepared, oldest first
+            models.Index(
+                fields=['created_at'], name='order_kitchen_queue_idx',
+                condition=models.Q(status__in=['pending', 'confirmed', 'preparing']),
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'idempotency_key'], name='order_user_idempotency_key_uniq',
+            ),
+        ]
 
     def __str__(self):
         return f"Order {self.order_number} by {self.customer_name}"
@@ -43,17 +138,32 @@ class Order(models.Model):
     def total_items(self):
         return sum(item.quantity for item in self.items.all())
 
+    @classmethod
+    def allowed_sources(cls, to_status):
+        """Statuses an order may be in to move to ``to_status``."""
+        return [source for source, targets in cls.TRANSITIONS.items() if to_status in targets]
+
+    def can_transition_to(self, to_status):
+        return to_status in self.TRANSITIONS.get(self.status, ())
+
+    def transition_to(self, to_status, changed_by=None, note=''):
+        """
+        Move this order to ``to_status`` if allowed from the status it has in
+        the database. Returns ``True`` if it moved.
+        """
+        moved = Order.objects.filter(pk=self.pk).transition(to_status, changed_by, note)
+        if moved:
+            self.status = to_status
+        return bool(moved)
+
     def generate_order_number(self):
-        """Generate a unique order number"""
-        import uuid
-        return f"KC-{uuid.uuid4().hex[:8].upper()}"
+        """Generate a unique, time-ordered order number"""
+        return next_order_number()
 
     def save(self, *args, **kwargs):
         if not self.order_number:
+            # Unique by construction, so no lookup before the insert
             self.order_number = self.generate_order_number()
-            # Ensure uniqueness
-            while Order.objects.filter(order_number=self.order_number).exists():
-                self.order_number = self.generate_order_number()
         super().save(*args, **kwargs)
 
 
@@ -78,3 +188,102 @@ class OrderItem(models.Model):
         if not self.price:
             self.price = self.product.price
         super().save(*args, **kwargs)
+
+
+class OrderStatusEvent(models.Model):
+    """Append-only log of order status changes."""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='status_events')
+    from_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    to_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    changed_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    note = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['order', 'created_at'], name='order_status_event_order_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.order_id}: {self.from_status} → {self.to_status}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Order status events are append-only.')
+        super().save(*args, **kwargs)
+
+
+class DailySales(models.Model):
+    """Sales for one day (shop time zone), maintained by ``rollup_sales``."""
+    date = models.DateField(unique=True)
+    order_count = models.PositiveIntegerField(default=0)
+    cancelled_count = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        ordering = ['-date']
+        verbose_name = 'Daily sales'
+        verbose_name_plural = 'Daily sales'
+
+    def __str__(self):
+        return f"Sales on {self.date}"
+
+
+class DailyProductSales(models.Model):
+    """Sales of one product on one day, maintained by ``rollup_sales``."""
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    order_count = models.PositiveIntegerField(default=0)
+    cancelled_count = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        ordering = ['-date']
+        verbose_name = 'Daily product sales'
+        verbose_name_plural = 'Daily product sales'
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product'], name='daily_product_sales_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.product} on {self.date}"
+
+
+class DailyCategorySales(models.Model):
+    """
+    Sales of one category on one day, maintained by ``rollup_sales``.
+    Products without a category are rolled up under ``category=None``.
+    """
+    date = models.DateField()
+    category = models.ForeignKey(
+        Category, on_delete=models.CASCADE, null=True, blank=True, related_name='daily_sales'
+    )
+    order_count = models.PositiveIntegerField(default=0)
+    cancelled_count = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        ordering = ['-date']
+        verbose_name = 'Daily category sales'
+        verbose_name_plural = 'Daily category sales'
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'category'], name='daily_category_sales_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.category or 'Uncategorised'} on {self.date}"
+
+
+class RollupWatermark(models.Model):
+    """How far an incremental job has processed, by ``Order.updated_at``."""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} @ {self.value}"
@@ -0,0 +1,100 @@
+"""
+Time-ordered order numbers that are unique by construction.
+
+An order number packs three parts into a 70-bit integer, written as 14
+Crockford base32 characters after the ``KC-`` prefix:
+
+* 42 bits: milliseconds since ``EPOCH_MS`` (good for ~139 years)
+* 16 bits: node id of the generating process
+* 12 bits: per-millisecond sequence within that process
+
+Two processes with different node ids can never produce the same number and
+one process never repeats itself, so no database lookup is needed before the
+insert. Fixed width means the numbers sort by creation time, both as strings
+and in the unique index, which keeps index inserts at the right-hand edge.
+
+The node id comes from the ``ORDER_NUMBER_NODE_ID`` setting, which suits
+deployments running one process per container. Otherwise it is derived from
+the host name and process id, and two processes may hash alike. The unique
+index on ``order_number`` then rejects the second insert of a number, and
+``orders.views.place_order`` retries the order once with a fresh one.
+"""
+
+import hashlib
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+
+PREFIX = 'KC-'
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+NODE_BITS = 16
+SEQUENCE_BITS = 12
+WIDTH = 14
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+MAX_NODE = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+
+def default_node_id():
+    seed = f'{socket.gethostname()}:{os.getpid()}'.encode()
+    return int.from_bytes(hashlib.blake2b(seed, digest_size=2).digest(), 'big')
+
+
+def encode(value, width=WIDTH):
+    chars = []
+    for _ in range(width):
+        value, digit = divmod(value, 32)
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+class OrderNumberGenerator:
+    """Thread-safe, monotonic order number source for one process."""
+
+    def __init__(self, node_id, clock=time.time):
+        if not 0 <= node_id <= MAX_NODE:
+            raise ValueError(f'Order number node id must be between 0 and {MAX_NODE}')
+        self.node_id = node_id
+        self.clock = clock
+        self.last_ms = -1
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def _now_ms(self):
+        return int(self.clock() * 1000) - EPOCH_MS
+
+    def __call__(self):
+        with self.lock:
+            # Never step backwards, even if the wall clock does
+            now = max(self._now_ms(), self.last_ms)
+            if now == self.last_ms:
+                self.sequence = (self.sequence + 1) & MAX_SEQUENCE
+                if self.sequence == 0:
+                    # Sequence exhausted for this millisecond: borrow the next one
+                    now += 1
+            else:
+                self.sequence = 0
+            self.last_ms = now
+
+            value = (now << (NODE_BITS + SEQUENCE_BITS)) | (self.node_id << SEQUENCE_BITS) | self.sequence
+            return PREFIX + encode(value)
+
+
+_generator = None
+_generator_pid = None
+
+
+def next_order_number():
+    """Return a new order number from this process's generator."""
+    global _generator, _generator_pid
+
+    # A forked worker must not share its parent's node id and sequence
+    if _generator is None or _generator_pid != os.getpid():
+        node_id = getattr(settings, 'ORDER_NUMBER_NODE_ID', None)
+        _generator = OrderNumberGenerator(default_node_id() if node_id is None else int(node_id))
+        _generator_pid = os.getpid()
+    return _generator()
@@ -0,0 +1,143 @@
+"""
+Sales rollups.
+
+``DailySales``, ``DailyProductSales`` and ``DailyCategorySales`` hold one
+row per day (per product / category) with order counts, cancellations, units
+and revenue. Cancelled orders count towards ``cancelled_count`` only.
+
+``refresh_days`` rebuilds whole days from the raw orders, so it can be
+re-run for any day at any time. ``rollup_since`` finds the days touched by
+orders changed after a watermark and refreshes just those, which is what the
+``rollup_sales`` command runs on a schedule. Reports then read only the
+rollup tables.
+"""
+
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (
+    DailyCategorySales, DailyProductSales, DailySales, Order, OrderItem, RollupWatermark,
+)
+
+WATERMARK_NAME = 'rollup_sales'
+# Refresh at most this many days per transaction
+DAYS_PER_BATCH = 31
+
+CANCELLED = Q(status='cancelled')
+
+
+def day_range(day):
+    """Return the ``[start, end)`` datetimes of ``day`` in the shop time zone."""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def _created_on(days, prefix=''):
+    # Explicit ranges rather than __date lookups, so the created_at index is used
+    condition = Q()
+    for day in days:
+        start, end = day_range(day)
+        condition |= Q(**{f'{prefix}created_at__gte': start, f'{prefix}created_at__lt': end})
+    return condition
+
+
+def affected_days(since):
+    """Days (by creation) of the orders changed after ``since``."""
+    orders = Order.objects.all() if since is None else Order.objects.filter(updated_at__gt=since)
+    return sorted(
+        orders.annotate(day=TruncDate('created_at'))
+        .order_by().values_list('day', flat=True).distinct()
+    )
+
+
+def refresh_days(days):
+    """Rebuild all rollup rows for ``days`` from the orders placed on them."""
+    days = sorted(set(days))
+    for start in range(0, len(days), DAYS_PER_BATCH):
+        batch = days[start:start + DAYS_PER_BATCH]
+        with transaction.atomic():
+            _refresh_batch(batch)
+    return len(days)
+
+
+def _refresh_batch(days):
+    items = (
+        OrderItem.objects
+        .filter(_created_on(days, 'order__'))
+        .annotate(day=TruncDate('order__created_at'))
+        .order_by()
+    )
+    not_cancelled = ~Q(order__status='cancelled')
+    cancelled = Q(order__status='cancelled')
+    measures = {
+        'order_count': Count('order', distinct=True, filter=not_cancelled),
+        'cancelled_count': Count('order', distinct=True, filter=cancelled),
+        'units': Sum('quantity', filter=not_cancelled, default=0),
+        'revenue': Sum(F('quantity') * F('price'), filter=not_cancelled, default=0),
+    }
+
+    DailySales.objects.filter(date__in=days).delete()
+    DailyProductSales.objects.filter(date__in=days).delete()
+    DailyCategorySales.objects.filter(date__in=days).delete()
+
+    DailySales.objects.bulk_create(
+        DailySales(date=row.pop('day'), **row)
+        for row in items.values('day').annotate(**measures)
+    )
+    DailyProductSales.objects.bulk_create(
+        DailyProductSales(date=row.pop('day'), product_id=row.pop('product'), **row)
+        for row in items.values('day', 'product').annotate(**measures)
+    )
+    DailyCategorySales.objects.bulk_create(
+        DailyCategorySales(date=row.pop('day'), category_id=row.pop('product__category'), **row)
+        for row in items.values('day', 'product__category').annotate(**measures)
+    )
+
+
+def rollup_since(since, overlap=timedelta(minutes=5)):
+    """
+    Refresh the days touched by orders changed after ``since`` (or all days
+    when ``since`` is ``None``). ``overlap`` re-reads a short window before
+    the watermark to catch transactions that committed late; refreshing a
+    day twice is harmless. Returns ``(days_refreshed, new_watermark)``.
+    """
+    started = timezone.now()
+    days = affected_days(None if since is None else since - overlap)
+    return refresh_days(days), started
+
+
+def get_watermark(name=WATERMARK_NAME):
+    return RollupWatermark.objects.filter(name=name).values_list('value', flat=True).first()
+
+
+def set_watermark(value, name=WATERMARK_NAME):
+    RollupWatermark.objects.update_or_create(name=name, defaults={'value': value})
+
+
+def sales_report(start, end, top=10):
+    """
+    Summarise sales between ``start`` and ``end`` (inclusive dates) from the
+    rollup tables only.
+    """
+    totals = ('order_count', 'cancelled_count', 'units', 'revenue')
+    in_range = Q(date__gte=start, date__lte=end)
+    sums = {field: Sum(field, default=0) for field in totals}
+
+    return {
+        'start': start,
+        'end': end,
+        'totals': DailySales.objects.filter(in_range).aggregate(**sums),
+        'days': list(DailySales.objects.filter(in_range).order_by('date').values('date', *totals)),
+        'products': list(
+            DailyProductSales.objects.filter(in_range)
+            .values('product__name').annotate(**sums).order_by('-revenue')[:top]
+        ),
+        'categories': list(
+            DailyCategorySales.objects.filter(in_range)
+            .values('category__name').annotate(**sums).order_by('-revenue')
+        ),
+    }
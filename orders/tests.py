@@ -1,3 +1,620 @@
-from django.test import TestCase
+import csv
+import json
+import threading
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from cart.models import Cart, CartItem
+from pages.models import EmailOutbox
+from products.models import Category, Product
+
+from . import feed
+from .models import (
+    DailyCategorySales, DailyProductSales, DailySales, Order, OrderItem, OrderStatusEvent,
+)
+from .views import ORDERS_PER_PAGE
+from .numbering import PREFIX, WIDTH, OrderNumberGenerator
+
+CHECKOUT_DATA = {
+    'customer_name': 'Siti Aminah',
+    'customer_email': 'siti@example.com',
+    'customer_phone': '+60123456789',
+    'delivery_address': '12 Jalan Ampang, Kuala Lumpur',
+}
+
+# Session, user, idempotency key lookup, cart, lock, lines, order, order
+# items, cart clear and the queued confirmation email; none of it depends on
+# the number of cart lines.
+CHECKOUT_QUERY_BUDGET = 12
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('siti', password='secret')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'Kuih {number:03d}', slug=f'kuih-{number:03d}', sku=f'KU-{number:03d}',
+                    price=Decimal('2.50') + number % 4, is_published=True)
+            for number in range(100)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def fill_cart(self, lines):
+        cart, _ = Cart.objects.get_or_create(user=self.user)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=2)
+            for product in self.products[:lines]
+        ])
+        Cart.objects.filter(pk=cart.pk).recompute_totals()
+        return cart
+
+    def checkout(self, idempotency_key=None):
+        data = {**CHECKOUT_DATA, 'idempotency_key': idempotency_key or uuid.uuid4().hex}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('orders:checkout'), data)
+        return response, [q['sql'] for q in queries if 'SAVEPOINT' not in q['sql']]
+
+    def test_checkout_copies_cart_into_order_and_empties_it(self):
+        cart = self.fill_cart(3)
+        response, _ = self.checkout()
+
+        order = Order.objects.get()
+        self.assertRedirects(response, reverse('orders:order_detail', args=[order.order_number]))
+        self.assertEqual(
+            list(order.items.order_by('product__sku').values_list('product__sku', 'quantity', 'price')),
+            [('KU-000', 2, Decimal('2.50')), ('KU-001', 2, Decimal('3.50')), ('KU-002', 2, Decimal('4.50'))],
+        )
+        self.assertEqual(order.total_amount, Decimal('21.00'))
+        cart.refresh_from_db()
+        self.assertEqual((cart.item_count, cart.subtotal), (0, Decimal('0.00')))
+        self.assertFalse(cart.items.exists())
+        self.assertEqual(EmailOutbox.objects.get().to, ['siti@example.com'])
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        budget = None
+        for lines in (1, 10, 100):
+            with self.subTest(lines=lines):
+                self.fill_cart(lines)
+                _, queries = self.checkout()
+                self.assertEqual(Order.objects.latest('pk').items.count(), lines)
+                if budget is None:
+                    budget = len(queries)
+                self.assertEqual(len(queries), budget, '\n'.join(queries))
+                self.assertLessEqual(len(queries), CHECKOUT_QUERY_BUDGET, '\n'.join(queries))
+                self.assertEqual(sum('INSERT INTO "orders_orderitem"' in sql for sql in queries), 1)
+
+    def test_checkout_rejects_short_lines_and_writes_nothing(self):
+        cart = self.fill_cart(3)
+        Product.objects.filter(pk=self.products[0].pk).update(stock=1)
+        Product.objects.filter(pk=self.products[1].pk).update(stock=0)
+        Product.objects.filter(pk=self.products[2].pk).update(stock=10)
+
+        response, _ = self.checkout()
+
+        self.assertRedirects(response, reverse('cart:cart_detail'), fetch_redirect_response=False)
+        errors = [str(m) for m in response.wsgi_request._messages]
+        self.assertEqual(errors, ['Only 1 of Kuih 000 left (you asked for 2).', 'Kuih 001 is sold out.'])
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(EmailOutbox.objects.exists())
+        self.assertEqual(cart.items.count(), 3)
+        self.assertEqual(Product.objects.get(pk=self.products[2].pk).stock, 10)
+
+    def test_checkout_takes_stock(self):
+        self.fill_cart(2)
+        Product.objects.filter(pk__in=[p.pk for p in self.products[:2]]).update(stock=5)
+        self.checkout()
+        self.assertEqual(
+            list(Product.objects.filter(pk__in=[p.pk for p in self.products[:3]]).order_by('sku').values_list('stock', flat=True)),
+            [3, 3, None],
+        )
+
+    def test_checkout_form_carries_idempotency_key(self):
+        self.fill_cart(1)
+        response = self.client.get(reverse('orders:checkout'))
+        key = response.context['form'].initial['idempotency_key']
+        self.assertContains(response, f'name="idempotency_key" value="{key}"')
+
+    def test_resubmitted_form_returns_existing_order_without_writes(self):
+        self.fill_cart(2)
+        key = uuid.uuid4().hex
+        first, _ = self.checkout(key)
+
+        self.fill_cart(2)
+        second, queries = self.checkout(key)
+
+        self.assertEqual(second.url, first.url)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(len([sql for sql in queries if 'orders_order' in sql]), 1)
+        self.assertFalse([sql for sql in queries if 'cart_' in sql])
+        self.assertFalse([sql for sql in queries if sql.startswith(('INSERT', 'UPDATE', 'DELETE'))])
+
+    def test_order_number_taken_by_another_process_is_retried_once(self):
+        taken = Order.objects.create(
+            user=self.user, order_number='KC-TAKEN', total_amount=Decimal('1.00'), **CHECKOUT_DATA
+        )
+        self.fill_cart(1)
+        with mock.patch('orders.models.next_order_number', side_effect=['KC-TAKEN', 'KC-FRESH']):
+            response, _ = self.checkout()
+        self.assertRedirects(response, reverse('orders:order_detail', args=['KC-FRESH']))
+        self.assertEqual(Order.objects.exclude(pk=taken.pk).get().items.count(), 1)
+
+        self.fill_cart(1)
+        with mock.patch('orders.models.next_order_number', return_value='KC-TAKEN'):
+            with self.assertRaises(IntegrityError):
+                self.checkout()
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    submissions = 8
+
+    def setUp(self):
+        self.user = User.objects.create_user('nora', password='secret')
+        product = Product.objects.create(name='Kuih Lapis', sku='KU-1', price=Decimal('3.00'))
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.add_quantity(cart, product, 2)
+        self.clients = []
+        for _ in range(self.submissions):
+            client = Client()
+            client.force_login(self.user)
+            self.clients.append(client)
+
+    def submit(self, client, data, barrier, responses, errors):
+        try:
+            barrier.wait()
+            while True:
+                try:
+                    responses.append(client.post(reverse('orders:checkout'), data))
+                    break
+                except OperationalError as exc:
+                    # SQLite reports lock contention instead of waiting; a
+                    # client would retry the same submission.
+                    if 'locked' not in str(exc):
+                        raise
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            connection.close()
+
+    def test_identical_concurrent_submissions_create_one_order(self):
+        data = {**CHECKOUT_DATA, 'idempotency_key': uuid.uuid4().hex}
+        barrier = threading.Barrier(self.submissions)
+        responses, errors = [], []
+        threads = [
+            threading.Thread(target=self.submit, args=(client, data, barrier, responses, errors))
+            for client in self.clients
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        order = Order.objects.get()
+        self.assertEqual(order.items.get().quantity, 2)
+        expected = reverse('orders:order_detail', args=[order.order_number])
+        self.assertEqual({response.url for response in responses}, {expected})
+
+
+class OrderHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('hafiz')
+        other = User.objects.create_user('other')
+        products = Product.objects.bulk_create([
+            Product(name=f'Dodol {n}', slug=f'dodol-{n}', sku=f'DO-{n}', price=Decimal('4.00'))
+            for n in range(5)
+        ])
+        for owner, count in ((cls.user, ORDERS_PER_PAGE * 2 + 3), (other, 2)):
+            for number in range(count):
+                order = Order.objects.create(
+                    user=owner, customer_name='Hafiz', customer_email='hafiz@example.com',
+                    customer_phone='+60123456789', delivery_address='Ipoh, Perak',
+                    total_amount=Decimal('8.00'),
+                )
+                OrderItem.objects.bulk_create([
+                    OrderItem(order=order, product=product, quantity=2, price=product.price)
+                    for product in products[:1 + number % 5]
+                ])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_walks_history_newest_first_with_constant_queries(self):
+        url, seen, budget = reverse('orders:order_list'), [], None
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            if budget is None:
+                budget = len(queries)
+            self.assertEqual(len(queries), budget)
+
+            page = response.context['orders']
+            self.assertLessEqual(len(page), ORDERS_PER_PAGE)
+            for order in page:
+                self.assertEqual(order.line_count, order.items.count())
+                self.assertEqual(order.item_count, 2 * order.line_count)
+                self.assertEqual(order.items_total, Decimal('8.00') * order.line_count)
+            seen.extend(page)
+            url = page.has_next and f"{reverse('orders:order_list')}?cursor={page.next_cursor}"
+
+        expected = list(Order.objects.filter(user=self.user).order_by('-created_at', '-pk'))
+        self.assertEqual(seen, expected)
+
+    def test_items_are_prefetched_for_visible_page_only(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('orders:order_list'))
+        item_queries = [q['sql'] for q in queries if 'FROM "orders_orderitem"' in q['sql']]
+        self.assertEqual(len(item_queries), 1)
+        visible = [order.pk for order in response.context['orders']]
+        self.assertEqual(len(visible), ORDERS_PER_PAGE)
+        prefetched = item_queries[0].rsplit(' IN (', 1)[1].split(')')[0].split(', ')
+        self.assertEqual(sorted(map(int, prefetched)), sorted(visible))
+
+
+class SalesRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('farah')
+        snacks = Category.objects.create(name='Snacks')
+        cls.kerepek = Product.objects.create(name='Kerepek', sku='SN-1', category=snacks, price=Decimal('5.00'))
+        cls.sambal = Product.objects.create(name='Sambal', sku='SA-1', price=Decimal('8.00'))
+        cls.day1, cls.day2 = date(2026, 3, 1), date(2026, 3, 2)
+
+        # Late evening in shop time still belongs to that day
+        cls.order_a = cls.place(cls.day1, 23, [(cls.kerepek, 2), (cls.sambal, 1)])
+        cls.order_b = cls.place(cls.day1, 9, [(cls.kerepek, 1)])
+        cls.order_c = cls.place(cls.day2, 12, [(cls.sambal, 3)], status='cancelled')
+
+    @classmethod
+    def place(cls, day, hour, lines, status='pending'):
+        order = Order.objects.create(
+            user=cls.user, customer_name='Farah', customer_email='farah@example.com',
+            customer_phone='+60123456789', delivery_address='Melaka',
+            total_amount=sum(p.price * q for p, q in lines), status=status,
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=p, quantity=q, price=p.price) for p, q in lines
+        )
+        created = timezone.make_aware(datetime.combine(day, datetime.min.time()) + timedelta(hours=hour))
+        Order.objects.filter(pk=order.pk).update(created_at=created, updated_at=created)
+        return order
+
+    def rollup(self, *args):
+        out = StringIO()
+        call_command('rollup_sales', *args, stdout=out)
+        return out.getvalue()
+
+    def test_rolls_up_days_products_and_categories(self):
+        self.assertIn('Refreshed 2 days (full rebuild)', self.rollup())
+
+        self.assertEqual(
+            list(DailySales.objects.order_by('date').values_list('date', 'order_count', 'cancelled_count', 'units', 'revenue')),
+            [(self.day1, 2, 0, 4, Decimal('23.00')), (self.day2, 0, 1, 0, Decimal('0.00'))],
+        )
+        self.assertEqual(
+            DailyProductSales.objects.filter(date=self.day1, product=self.kerepek)
+            .values_list('order_count', 'units', 'revenue').get(),
+            (2, 3, Decimal('15.00')),
+        )
+        self.assertEqual(
+            dict(DailyCategorySales.objects.filter(date=self.day1).values_list('category__name', 'revenue')),
+            {'Snacks': Decimal('15.00'), None: Decimal('8.00')},
+        )
+
+    def test_incremental_run_only_refreshes_changed_days(self):
+        self.rollup()
+        self.assertIn('Refreshed 0 days', self.rollup())
+
+        order = Order.objects.get(pk=self.order_b.pk)
+        order.status = 'cancelled'
+        order.save()
+        self.assertIn('Refreshed 1 days', self.rollup())
+        self.assertEqual(
+            DailySales.objects.filter(date=self.day1).values_list('order_count', 'cancelled_count', 'revenue').get(),
+            (1, 1, Decimal('18.00')),
+        )
+
+    def test_report_reads_only_rollups(self):
+        self.rollup()
+        admin_user = User.objects.create_superuser('boss', 'boss@example.com', 'secret')
+        self.client.force_login(admin_user)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:orders_sales_report'), {'start': '2026-01-01', 'end': '2026-12-31'})
+
+        self.assertEqual(response.context['report']['totals']['revenue'], Decimal('23.00'))
+        self.assertContains(response, 'Kerepek')
+        raw = [q['sql'] for q in queries if '"orders_order"' in q['sql'] or '"orders_orderitem"' in q['sql']]
+        self.assertEqual(raw, [])
+
+
+class OrderExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_superuser('zul', 'zul@example.com', 'secret')
+        cls.user = user
+        product = Product.objects.create(name='Serunding, Daging', sku='SE-1', price=Decimal('12.50'))
+        extra = Product.objects.create(name='Kuah Kacang', sku='KK-1', price=Decimal('6.00'))
+        cls.orders = []
+        for number in range(5):
+            order = Order.objects.create(
+                user=user, customer_name='Zul', customer_email='zul@example.com',
+                customer_phone='+60123456789', delivery_address='Kota Bharu',
+                total_amount=Decimal('31.00'), status='delivered' if number % 2 else 'pending',
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=2, price=product.price),
+                OrderItem(order=order, product=extra, quantity=1, price=extra.price),
+            ])
+            cls.orders.append(order)
+
+    def test_admin_action_streams_csv_rows_per_item(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('admin:orders_order_changelist'), {
+            'action': 'export_as_csv',
+            '_selected_action': [order.pk for order in self.orders[:2]],
+        })
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment;', response['Content-Disposition'])
+
+        rows = list(csv.DictReader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0]['order_number'], self.orders[0].order_number)
+        self.assertEqual((rows[0]['product'], rows[0]['line_total']), ('Serunding, Daging', '25.00'))
+
+    def test_command_exports_jsonl_in_chunks(self):
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('export_orders', '--format=jsonl', '--chunk-size=2', stdout=out)
+
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([r['order_number'] for r in records], [o.order_number for o in self.orders])
+        self.assertEqual([i['sku'] for i in records[0]['items']], ['SE-1', 'KK-1'])
+        # Items are prefetched once per chunk of two orders
+        item_queries = [q for q in queries if 'FROM "orders_orderitem"' in q['sql']]
+        self.assertEqual(len(item_queries), 3)
+
+    def test_command_filters_by_status(self):
+        out = StringIO()
+        call_command('export_orders', '--format=jsonl', '--status=delivered', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+
+class OrderStatusTransitionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('mei', 'mei@example.com', 'secret')
+        statuses = ['pending'] * 6 + ['confirmed', 'cancelled', 'delivered']
+        Order.objects.bulk_create(
+            Order(
+                user=cls.user, order_number=f'KC-T{number}', status=status,
+                customer_name='Mei', customer_email='mei@example.com',
+                customer_phone='+60123456789', delivery_address='Penang',
+                total_amount=Decimal('10.00'),
+            )
+            for number, status in enumerate(statuses)
+        )
+
+    def statuses(self):
+        return sorted(Order.objects.values_list('status', flat=True))
+
+    def test_bulk_transition_moves_only_allowed_orders_in_two_statements(self):
+        with CaptureQueriesContext(connection) as queries:
+            moved = Order.objects.all().transition('confirmed', changed_by=self.user)
+
+        self.assertEqual(moved, 6)
+        statements = [q['sql'] for q in queries if 'SAVEPOINT' not in q['sql']]
+        self.assertEqual(len(statements), 2, statements)
+        self.assertEqual(self.statuses(), ['cancelled'] + ['confirmed'] * 7 + ['delivered'])
+        self.assertEqual(
+            set(OrderStatusEvent.objects.values_list('from_status', 'to_status', 'changed_by')),
+            {('pending', 'confirmed', self.user.pk)},
+        )
+
+    def test_cancelled_and_delivered_orders_cannot_move_back(self):
+        self.assertEqual(Order.objects.filter(status__in=['cancelled', 'delivered']).transition('preparing'), 0)
+        self.assertEqual(Order.objects.filter(status__in=['cancelled', 'delivered']).transition('pending'), 0)
+        self.assertFalse(OrderStatusEvent.objects.exists())
+
+    def test_cancelling_returns_items_to_stock(self):
+        product = Product.objects.create(name='Rendang', sku='R-9', price=Decimal('5.00'), stock=3)
+        untracked = Product.objects.create(name='Sambal', sku='S-9', price=Decimal('5.00'))
+        orders = [*Order.objects.filter(status='pending')[:2], Order.objects.get(status='delivered')]
+        for order in orders:
+            OrderItem.objects.create(order=order, product=product, quantity=2, price=product.price)
+            OrderItem.objects.create(order=order, product=untracked, quantity=1, price=product.price)
+
+        Order.objects.all().transition('cancelled')
+
+        product.refresh_from_db()
+        untracked.refresh_from_db()
+        # The delivered order is not cancelled, so its units stay sold
+        self.assertEqual((product.stock, untracked.stock), (3 + 2 * 2, None))
+
+    def test_cancel_records_source_status_of_each_order(self):
+        self.assertEqual(Order.objects.all().transition('cancelled'), 7)
+        self.assertEqual(
+            sorted(OrderStatusEvent.objects.values_list('from_status', flat=True)),
+            ['confirmed'] + ['pending'] * 6,
+        )
+
+    def test_admin_action_reports_rows_moved(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('admin:orders_order_changelist'), {
+            'action': 'mark_as_preparing',
+            '_selected_action': list(Order.objects.values_list('pk', flat=True)),
+        }, follow=True)
+        self.assertContains(response, '1 orders marked as preparing.')
+
+    def test_customer_cancel_only_applies_to_pending_orders(self):
+        pending = Order.objects.filter(status='pending').first()
+        confirmed = Order.objects.get(status='confirmed')
+        self.client.force_login(self.user)
+
+        self.client.post(reverse('orders:cancel_order', args=[pending.order_number]))
+        self.client.post(reverse('orders:cancel_order', args=[confirmed.order_number]))
+
+        pending.refresh_from_db()
+        confirmed.refresh_from_db()
+        self.assertEqual((pending.status, confirmed.status), ('cancelled', 'confirmed'))
+        event = OrderStatusEvent.objects.get()
+        self.assertEqual((event.order, event.note), (pending, 'cancelled by customer'))
+
+    def test_events_are_append_only(self):
+        order = Order.objects.filter(status='pending').first()
+        self.assertTrue(order.transition_to('confirmed'))
+        self.assertFalse(order.transition_to('delivered'))
+        event = order.status_events.get()
+        with self.assertRaises(ValueError):
+            event.save()
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class KitchenBoardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('chef', password='secret', is_staff=True)
+        product = Product.objects.create(name='Nasi Lemak', sku='NL-1', price=Decimal('9.00'))
+        for number, status in enumerate(['pending', 'preparing', 'delivered']):
+            order = Order.objects.create(
+                user=cls.staff, order_number=f'KC-K{number}', status=status,
+                customer_name='Chef', customer_email='chef@example.com',
+                customer_phone='+60123456789', delivery_address='Kuantan',
+                total_amount=Decimal('9.00'),
+            )
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+
+    def test_board_is_for_staff_only(self):
+        self.client.force_login(User.objects.create_user('guest'))
+        response = self.client.get(reverse('orders:kitchen_board'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_board_lists_open_orders_and_partial_reload_is_two_queries(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('orders:kitchen_board'))
+        self.assertContains(response, 'KC-K0')
+        self.assertContains(response, 'KC-K1')
+        self.assertNotContains(response, 'KC-K2')
+        self.assertContains(response, "orders/kitchen/events/")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('orders:kitchen_board'), HTTP_HX_REQUEST='true')
+        self.assertTemplateUsed(response, 'orders/partials/kitchen_board.html')
+        self.assertTemplateNotUsed(response, 'orders/kitchen_board.html')
+        board = [q for q in queries if 'orders_order' in q['sql']]
+        self.assertEqual(len(board), 2)
+
+    def test_event_stream_sends_changes_and_heartbeats(self):
+        self.client.force_login(self.staff)
+        with mock.patch('orders.views.wait_for_changes', return_value=iter([True, False])):
+            response = self.client.get(reverse('orders:kitchen_board_events'))
+            body = b''.join(response.streaming_content).decode()
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(body, 'retry: 3000\n\nevent: changed\ndata: orders\n\n: ping\n\n')
+
+    async def test_event_stream_waits_asynchronously_under_asgi(self):
+        async def changes(duration):
+            for changed in (True, False):
+                yield changed
+
+        await self.async_client.aforce_login(self.staff)
+        with mock.patch('orders.views.watch_board', changes):
+            response = await self.async_client.get(reverse('orders:kitchen_board_events'))
+            body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(body, 'retry: 3000\n\nevent: changed\ndata: orders\n\n: ping\n\n')
+
+    @override_settings(KITCHEN_BOARD_MAX_STREAMS=0)
+    def test_streams_beyond_the_cap_are_refused(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('orders:kitchen_board_events'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '30')
+
+    def test_boards_share_one_watcher_per_process(self):
+        board_feed = feed.BoardFeed()
+        release = threading.Event()
+        with mock.patch.object(feed.BoardFeed, '_run', lambda self: release.wait()):
+            first = board_feed.subscribe(feed.Subscription())
+            watcher = board_feed.thread
+            second = board_feed.subscribe(feed.Subscription())
+        self.assertIs(board_feed.thread, watcher)
+
+        board_feed.notify()
+        self.assertEqual([first.wait(0), second.wait(0), first.wait(0)], [True, True, False])
+
+        board_feed.unsubscribe(first)
+        board_feed.unsubscribe(second)
+        self.assertFalse(board_feed._keep_running())
+        self.assertIsNone(board_feed.thread)
+        release.set()
+        watcher.join()
+
+    @mock.patch.object(feed, 'POLL_INTERVAL', 0)
+    def test_polling_watcher_reports_version_changes(self):
+        versions = iter(['v1', 'v1'])
+        board_feed = feed.BoardFeed()
+        with mock.patch.object(feed, 'get_board_version', lambda: next(versions, 'v2')):
+            changes = feed.wait_for_changes(60, feed=board_feed)
+            self.assertIs(next(changes), True)
+            watcher = board_feed.thread
+            changes.close()
+            watcher.join()
+        self.assertEqual(len(board_feed), 0)
+        self.assertIsNone(board_feed.thread)
+
+    def test_board_version_moves_with_order_changes(self):
+        before = feed.get_board_version()
+        Order.objects.filter(status='pending').transition('confirmed')
+        # Boards share the cached version until it expires after POLL_INTERVAL
+        self.assertEqual(feed.get_board_version(), before)
+        cache.delete(feed.BOARD_VERSION_KEY)
+        self.assertNotEqual(feed.get_board_version(), before)
+
+
+class OrderNumberTests(TestCase):
+    def test_numbers_are_unique_fixed_width_and_time_ordered(self):
+        ticks = iter([1760000000.000] * 5000 + [1760000000.001] * 3)
+        generate = OrderNumberGenerator(node_id=7, clock=lambda: next(ticks))
+        numbers = [generate() for _ in range(5003)]
+
+        self.assertEqual(len(set(numbers)), len(numbers))
+        self.assertEqual(numbers, sorted(numbers))
+        self.assertTrue(all(len(n) == len(PREFIX) + WIDTH for n in numbers))
+
+    def test_clock_going_backwards_does_not_repeat(self):
+        ticks = iter([1760000000.500, 1760000000.100, 1760000000.100])
+        generate = OrderNumberGenerator(node_id=1, clock=lambda: next(ticks))
+        numbers = [generate() for _ in range(3)]
+        self.assertEqual(numbers, sorted(set(numbers)))
+
+    def test_nodes_never_collide(self):
+        generators = [OrderNumberGenerator(node_id, clock=lambda: 1760000000.0) for node_id in (1, 2)]
+        numbers = [generate() for generate in generators for _ in range(100)]
+        self.assertEqual(len(set(numbers)), 200)
+
+    def test_order_insert_is_a_single_statement(self):
+        user = User.objects.create_user('amir')
+        with self.assertNumQueries(1):
+            order = Order.objects.create(
+                user=user, customer_name='Amir', customer_email='amir@example.com',
+                customer_phone='+60123456789', delivery_address='Shah Alam',
+                total_amount=Decimal('10.00'),
+            )
+        self.assertTrue(order.order_number.startswith(PREFIX))
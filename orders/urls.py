@@ -8,4 +8,6 @@ urlpatterns = [
     path('order/<str:order_number>/', views.order_detail_view, name='order_detail'),
     path('orders/', views.order_list_view, name='order_list'),
     path('cancel/<str:order_number>/', views.cancel_order_view, name='cancel_order'),
+    path('kitchen/', views.kitchen_board_view, name='kitchen_board'),
+    path('kitchen/events/', views.kitchen_board_events, name='kitchen_board_events'),
 ]
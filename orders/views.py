@@ -1,20 +1,43 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
 from django.contrib import messages
 
 from django.views.decorators.http import require_POST
 from django.template.loader import render_to_string
-from django.core.mail import send_mail
-from django.conf import settings
-from cart.utils import get_or_create_cart
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, F, Prefetch, Sum, prefetch_related_objects
+from django.db.models.functions import Coalesce
+from cart.models import Cart
+from cart.utils import get_cart_for_read
+from pages.outbox import queue_email
+from products.inventory import InsufficientStock, reserve_stock
+from products.pagination import cursor_paginate
+from .feed import board_feed, wait_for_changes, watch_board
 from .models import Order, OrderItem
 from .forms import CheckoutForm
 
+ORDERS_PER_PAGE = 10
+
+# Statuses shown on the kitchen board, oldest order first
+KITCHEN_STATUSES = ('pending', 'confirmed', 'preparing')
+# Each event stream ends after this long; the browser reconnects by itself
+KITCHEN_STREAM_SECONDS = 300
 
 
 def checkout_view(request):
     """Checkout process - requires user to be logged in"""
-    cart = get_or_create_cart(request)
+    if request.method == 'POST' and request.user.is_authenticated:
+        # A resubmitted form (double click, client retry) gets its order back
+        existing = find_order_for_key(request.user, request.POST.get('idempotency_key'))
+        if existing is not None:
+            messages.info(request, f'Order {existing.order_number} has already been placed.')
+            return redirect('orders:order_detail', order_number=existing.order_number)
+
+    cart = get_cart_for_read(request)
 
     if not cart or cart.is_empty():
         messages.error(request, 'Your cart is empty.')
@@ -27,34 +50,25 @@ def checkout_view(request):
     if request.method == 'POST':
         form = CheckoutForm(request.POST)
         if form.is_valid():
-            # Create the order
-            order = Order.objects.create(
-                user=request.user,
-                customer_name=form.cleaned_data['customer_name'],
-                customer_email=form.cleaned_data['customer_email'],
-                customer_phone=form.cleaned_data['customer_phone'],
-                delivery_address=form.cleaned_data['delivery_address'],
-                notes=form.cleaned_data.get('notes', ''),
-                total_amount=cart.total_price
-            )
-
-            # Create order items from cart
-            for cart_item in cart.items.all():
-                OrderItem.objects.create(
-                    order=order,
-                    product=cart_item.product,
-                    quantity=cart_item.quantity,
-                    price=cart_item.product.price
-                )
-
-            # Clear the cart
-            cart.clear()
-
-            # Send confirmation email (optional)
             try:
-                send_order_confirmation_email(order)
-            except Exception as e:
-                print(f"Failed to send confirmation email: {e}")
+                order = place_order(
+                    cart, request.user, form.cleaned_data,
+                    idempotency_key=form.cleaned_data.get('idempotency_key') or None,
+                )
+            except InsufficientStock as e:
+                for shortfall in e.shortfalls:
+                    if shortfall.available:
+                        messages.error(
+                            request,
+                            f'Only {shortfall.available} of {shortfall.name} left '
+                            f'(you asked for {shortfall.requested}).'
+                        )
+                    else:
+                        messages.error(request, f'{shortfall.name} is sold out.')
+                return redirect('cart:cart_detail')
+            if order is None:
+                messages.error(request, 'Your cart is empty.')
+                return redirect('cart:cart_detail')
 
             messages.success(request, f'Order {order.order_number} placed successfully!')
             return redirect('orders:order_detail', order_number=order.order_number)
@@ -80,6 +94,91 @@ def checkout_view(request):
     return render(request, 'orders/checkout.html', context)
 
 
+def find_order_for_key(user, idempotency_key):
+    """Return the user's order placed with ``idempotency_key``, if any."""
+    if not idempotency_key:
+        return None
+    return Order.objects.filter(user=user, idempotency_key=idempotency_key).first()
+
+
+def place_order(cart, user, customer, idempotency_key=None):
+    """
+    Turn ``cart`` into an order as one atomic unit of work.
+
+    The cart row is locked so a concurrent checkout of the same cart waits,
+    the lines and their products are read in one query, the order items are
+    written with one bulk insert and the cart is emptied with one delete, so
+    the number of queries does not grow with the size of the cart. The
+    confirmation email is queued in the same transaction. Stock for all
+    lines is then reserved with one conditional UPDATE; if any line is
+    short, ``InsufficientStock`` is raised and the whole order rolls back.
+
+    With an ``idempotency_key``, a submission that lost the race to an
+    identical one returns the order that one created. Returns ``None`` if
+    the cart turned out to be empty once locked.
+    """
+    try:
+        with transaction.atomic():
+            return _place_order(cart, user, customer, idempotency_key)
+    except IntegrityError:
+        # The unique (user, idempotency_key) constraint caught a duplicate
+        existing = find_order_for_key(user, idempotency_key)
+        if existing is None:
+            raise
+        return existing
+
+
+def _place_order(cart, user, customer, idempotency_key):
+    cart = Cart.objects.select_for_update().get(pk=cart.pk)
+    cart_items = list(cart.items.select_related('product').order_by('pk'))
+    if not cart_items:
+        # Emptied by a checkout that held the lock first
+        return find_order_for_key(user, idempotency_key)
+
+    order = _insert_order(Order(
+        user=user,
+        customer_name=customer['customer_name'],
+        customer_email=customer['customer_email'],
+        customer_phone=customer['customer_phone'],
+        delivery_address=customer['delivery_address'],
+        notes=customer.get('notes', ''),
+        total_amount=sum(item.product.price * item.quantity for item in cart_items),
+        idempotency_key=idempotency_key,
+    ))
+    order_items = OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order,
+            product=item.product,
+            quantity=item.quantity,
+            price=item.product.price,
+        )
+        for item in cart_items
+    ])
+    cart.clear()
+    send_order_confirmation_email(order, order_items)
+
+    # Last, so the hot product rows stay locked only until the commit
+    reserve_stock((item.product, item.quantity) for item in cart_items)
+
+    return order
+
+
+def _insert_order(order):
+    """
+    Insert ``order``, once more with a fresh number if another process took
+    the one it was given, possible only when derived node ids collide.
+    """
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                order.save(force_insert=True)
+            return order
+        except IntegrityError:
+            if attempt or not Order.objects.filter(order_number=order.order_number).exists():
+                raise
+            order.order_number = ''
+
+
 @login_required
 def order_detail_view(request, order_number):
     """View order details"""
@@ -95,11 +194,30 @@ def order_detail_view(request, order_number):
 
 @login_required
 def order_list_view(request):
-    """List user's orders"""
-    orders = Order.objects.filter(user=request.user).prefetch_related('items__product')
+    """List user's orders, newest first, one cursor page at a time"""
+    orders = (
+        Order.objects
+        .filter(user=request.user)
+        .annotate(
+            line_count=Count('items'),
+            item_count=Coalesce(Sum('items__quantity'), 0),
+            items_total=Coalesce(
+                Sum(F('items__quantity') * F('items__price')), 0,
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+    )
+    page = cursor_paginate(orders, '-created_at', request.GET.get('cursor'), ORDERS_PER_PAGE)
+
+    # Item previews only for the orders on this page
+    prefetch_related_objects(
+        page.object_list,
+        Prefetch('items', queryset=OrderItem.objects.select_related('product')),
+    )
 
     context = {
-        'orders': orders,
+        'orders': page,
+        'is_first_page': not request.GET.get('cursor'),
     }
 
     return render(request, 'orders/order_list.html', context)
@@ -111,9 +229,11 @@ def cancel_order_view(request, order_number):
     """Cancel an order (only if status is pending)"""
     order = get_object_or_404(Order, order_number=order_number, user=request.user)
 
-    if order.status == 'pending':
-        order.status = 'cancelled'
-        order.save()
+    # Conditional on the stored status, so a concurrent admin change wins cleanly
+    cancelled = Order.objects.filter(pk=order.pk, status='pending').transition(
+        'cancelled', changed_by=request.user, note='cancelled by customer'
+    )
+    if cancelled:
         messages.success(request, f'Order {order.order_number} has been cancelled.')
     else:
         messages.error(request, 'This order cannot be cancelled.')
@@ -121,22 +241,73 @@ def cancel_order_view(request, order_number):
     return redirect('orders:order_detail', order_number=order.order_number)
 
 
-def send_order_confirmation_email(order):
-    """Send order confirmation email to customer"""
-    subject = f'Order Confirmation - {order.order_number}'
+@staff_member_required
+def kitchen_board_view(request):
+    """Live queue of orders the kitchen still has to prepare"""
+    orders = (
+        Order.objects
+        .filter(status__in=KITCHEN_STATUSES)
+        .order_by('created_at', 'pk')
+        .prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('product')))
+    )
+    context = {
+        'orders': orders,
+        'statuses': [(value, label) for value, label in Order.STATUS_CHOICES if value in KITCHEN_STATUSES],
+    }
+
+    # The board re-fetches just its columns when the event stream says so
+    if request.htmx:
+        return render(request, 'orders/partials/kitchen_board.html', context)
+    return render(request, 'orders/kitchen_board.html', context)
+
+
+@staff_member_required
+async def kitchen_board_events(request):
+    """
+    Server-sent events telling open boards to reload. Only a ``changed``
+    event or a heartbeat comment is sent; the board itself is fetched once
+    per change, not once per poll. Under ASGI a waiting board costs no
+    worker; under WSGI each one holds a thread, hence the cap.
+    """
+    if len(board_feed) >= settings.KITCHEN_BOARD_MAX_STREAMS:
+        response = HttpResponse('Too many kitchen boards are open.', status=503)
+        response['Retry-After'] = '30'
+        return response
+
+    def event(changed):
+        return 'event: changed\ndata: orders\n\n' if changed else ': ping\n\n'
+
+    async def async_stream():
+        yield 'retry: 3000\n\n'
+        async for changed in watch_board(KITCHEN_STREAM_SECONDS):
+            yield event(changed)
+
+    def stream():
+        yield 'retry: 3000\n\n'
+        for changed in wait_for_changes(KITCHEN_STREAM_SECONDS):
+            yield event(changed)
+
+    content = async_stream() if isinstance(request, ASGIRequest) else stream()
+    response = StreamingHttpResponse(content, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def send_order_confirmation_email(order, order_items=None):
+    """Queue the order confirmation email for the mail worker"""
+    if order_items is None:
+        order_items = order.items.select_related('product').all()
 
     # Render email template
     html_message = render_to_string('orders/emails/order_confirmation.html', {
         'order': order,
-        'order_items': order.items.select_related('product').all(),
+        'order_items': order_items,
     })
 
-    # Send email
-    send_mail(
-        subject=subject,
-        message='',  # Plain text version (optional)
-        html_message=html_message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=[order.customer_email],
-        fail_silently=False,
+    queue_email(
+        subject=f'Order Confirmation - {order.order_number}',
+        to=[order.customer_email],
+        html_body=html_message,
     )
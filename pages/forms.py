@@ -1,6 +1,6 @@
 from django import forms
-from django.core.mail import EmailMessage
-from django.conf import settings
+
+from .outbox import queue_email
 
 
 class ContactForm(forms.Form):
@@ -88,7 +88,7 @@ class ContactForm(forms.Form):
         return phone
 
     def send_email(self):
-        """Send contact form email using the existing email configuration"""
+        """Queue the contact form email for the mail worker"""
         if not self.is_valid():
             return False
 
@@ -125,27 +125,20 @@ This message was sent from the Kampung Cuisine contact form.
 Reply directly to this email to respond to the customer.
             """.strip()
 
-            # Send email using Django's EmailMessage (configured with Resend)
-            email_message = EmailMessage(
+            queue_email(
                 subject=email_subject,
                 body=email_body,
-                from_email=settings.DEFAULT_FROM_EMAIL,
                 to=['rroslan@gmail.com'],  # Send to recipient email
                 reply_to=[email],  # Allow direct reply to customer
             )
-
-            result = email_message.send(fail_silently=False)
-            return result
+            return True
 
         except Exception as e:
             # Log the error with more details
             import traceback
             error_details = traceback.format_exc()
-            print(f"Failed to send contact email: {str(e)}")
+            print(f"Failed to queue contact email: {str(e)}")
             print(f"Error details: {error_details}")
-            print(f"Email config - HOST: {settings.EMAIL_HOST}, PORT: {settings.EMAIL_PORT}")
-            print(f"From email: {settings.DEFAULT_FROM_EMAIL}")
-            print(f"Recipient: rroslan@gmail.com")
             return False
 
 
@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from pages.outbox import MAX_ATTEMPTS, deliver_batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Send queued emails from the EmailOutbox. Each batch is claimed with '
+        'SELECT ... FOR UPDATE SKIP LOCKED and sent over one SMTP connection; '
+        'failures are retried with exponential backoff. Several workers can '
+        'run at once.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Number of emails sent per SMTP connection (default: 50)',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5.0,
+            help='Seconds to wait when the outbox is empty (default: 5)',
+        )
+        parser.add_argument(
+            '--max-attempts',
+            type=int,
+            default=MAX_ATTEMPTS,
+            help=f'Give up on an email after this many attempts (default: {MAX_ATTEMPTS})',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Send everything that is due, then exit (for cron or tests)',
+        )
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+
+        try:
+            while True:
+                sent, failed = deliver_batch(options['batch_size'], options['max_attempts'])
+                total_sent += sent
+                total_failed += failed
+                if sent or failed:
+                    self.stdout.write(f'Sent {sent} emails, {failed} failed')
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Mail worker done: {total_sent} sent, {total_failed} failed')
+        )
@@ -0,0 +1,106 @@
+"""
+Transactional email outbox.
+
+``queue_email`` stores a message in ``EmailOutbox`` as part of the caller's
+transaction, so it is only sent if the surrounding work (an order, say)
+commits. ``deliver_batch`` is the worker side used by ``run_mail_worker``:
+
+* due rows are claimed and leased through ``core.work_queue.LeasedQueue``,
+  before any SMTP traffic, so several workers can run side by side;
+* each batch is sent over a single SMTP connection;
+* a failed message is retried with exponential backoff until
+  ``max_attempts`` is reached, then marked ``failed``. A worker that dies
+  mid-batch simply lets the lease expire and the rows are picked up again.
+"""
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.utils import timezone
+
+from core.work_queue import LeasedQueue
+
+from .models import EmailOutbox
+
+LEASE_SECONDS = 300
+BACKOFF_BASE_SECONDS = 60
+BACKOFF_MAX_SECONDS = 6 * 60 * 60
+MAX_ATTEMPTS = 8
+
+
+def queue_email(subject, to, body='', html_body='', from_email=None, reply_to=()):
+    """Add an email to the outbox. Returns the ``EmailOutbox`` row."""
+    return EmailOutbox.objects.create(
+        subject=subject,
+        body=body,
+        html_body=html_body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(to),
+        reply_to=list(reply_to),
+    )
+
+
+def backoff_delay(attempts):
+    """Seconds to wait before retrying a message that failed ``attempts`` times."""
+    return min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+
+
+mail_queue = LeasedQueue(EmailOutbox, LEASE_SECONDS, backoff_delay)
+
+
+def claim_batch(batch_size):
+    """Lease up to ``batch_size`` due messages to this worker and return them."""
+    return mail_queue.claim(batch_size)
+
+
+def build_message(row, connection=None):
+    message = EmailMultiAlternatives(
+        subject=row.subject,
+        body=row.body,
+        from_email=row.from_email,
+        to=row.to,
+        reply_to=row.reply_to or None,
+        connection=connection,
+    )
+    if row.html_body:
+        message.attach_alternative(row.html_body, 'text/html')
+    return message
+
+
+def deliver_batch(batch_size=50, max_attempts=MAX_ATTEMPTS):
+    """
+    Claim and send one batch over a single SMTP connection.
+    Returns ``(sent, failed)`` counts; ``(0, 0)`` means nothing was due.
+    """
+    batch = claim_batch(batch_size)
+    if not batch:
+        return 0, 0
+
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        for row in batch:
+            mail_queue.record_failure(row, e, max_attempts)
+        return 0, len(batch)
+
+    sent = failed = 0
+    try:
+        for row in batch:
+            try:
+                connection.send_messages([build_message(row, connection)])
+            except Exception as e:
+                mail_queue.record_failure(row, e, max_attempts)
+                failed += 1
+            else:
+                EmailOutbox.objects.filter(pk=row.pk).update(
+                    status='sent', attempts=row.attempts + 1,
+                    sent_at=timezone.now(), last_error='',
+                )
+                sent += 1
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+    return sent, failed
+
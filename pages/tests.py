@@ -1,3 +1,151 @@
-from django.test import TestCase
+import socketserver
+import threading
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import EmailOutbox
+from .outbox import backoff_delay, claim_batch, queue_email
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """
+    A minimal local SMTP server: accepts every message and records it, and
+    counts connections so tests can check the worker reuses one per batch.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, reject_rcpt=()):
+        self.messages = []
+        self.connections = 0
+        self.reject_rcpt = set(reject_rcpt)
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.port = self.server_address[1]
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost ready')
+        recipients = []
+        while line := self.rfile.readline():
+            command = line.decode().strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                self.reply('250 localhost')
+            elif verb == 'RCPT':
+                address = command.split(':', 1)[1].strip(' <>')
+                if address in self.server.reject_rcpt:
+                    self.reply('550 mailbox unavailable')
+                else:
+                    recipients.append(address)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 end with .')
+                data = []
+                while (chunk := self.rfile.readline()) not in (b'.\r\n', b''):
+                    data.append(chunk)
+                self.server.messages.append((recipients, b''.join(data)))
+                recipients = []
+                self.reply('250 queued')
+            elif verb == 'QUIT':
+                self.reply('221 bye')
+                return
+            elif verb == 'RSET':
+                recipients = []
+                self.reply('250 OK')
+            else:
+                self.reply('250 OK')
+
+
+class MailWorkerTests(TestCase):
+    def setUp(self):
+        self.smtp = SMTPStandIn(reject_rcpt=['bounce@example.com'])
+        self.addCleanup(self.smtp.stop)
+        smtp_settings = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.smtp.port,
+            EMAIL_USE_TLS=False, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+        )
+        smtp_settings.enable()
+        self.addCleanup(smtp_settings.disable)
+
+    def run_worker(self, *args):
+        out = StringIO()
+        call_command('run_mail_worker', '--once', *args, stdout=out)
+        return out.getvalue()
+
+    def test_sends_batch_over_one_connection(self):
+        for number in range(3):
+            queue_email(f'Order {number}', [f'customer{number}@example.com'], html_body='<p>Hi</p>')
+
+        output = self.run_worker('--batch-size=10')
+
+        self.assertIn('3 sent, 0 failed', output)
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertEqual(sorted(r[0] for r, _ in self.smtp.messages),
+                         [f'customer{n}@example.com' for n in range(3)])
+        self.assertIn(b'text/html', self.smtp.messages[0][1])
+        self.assertFalse(EmailOutbox.objects.exclude(status='sent').exists())
+
+    def test_failed_message_is_retried_with_backoff_then_given_up(self):
+        bounce = queue_email('Bounce', ['bounce@example.com'])
+        queue_email('Fine', ['fine@example.com'])
+
+        self.assertIn('1 sent, 1 failed', self.run_worker())
+        bounce.refresh_from_db()
+        self.assertEqual((bounce.status, bounce.attempts), ('pending', 1))
+        self.assertIn('SMTPRecipientsRefused', bounce.last_error)
+        self.assertGreater(bounce.next_attempt_at, timezone.now() + timedelta(seconds=backoff_delay(1) - 5))
+
+        # Not due yet, so nothing is claimed
+        self.assertIn('0 sent, 0 failed', self.run_worker())
+
+        EmailOutbox.objects.filter(pk=bounce.pk).update(next_attempt_at=timezone.now())
+        self.run_worker('--max-attempts=2')
+        bounce.refresh_from_db()
+        self.assertEqual((bounce.status, bounce.attempts), ('failed', 2))
+
+    def test_unreachable_relay_backs_off_whole_batch(self):
+        queue_email('Hello', ['a@example.com'])
+        self.smtp.stop()
+        with override_settings(EMAIL_PORT=self.smtp.port, EMAIL_TIMEOUT=1):
+            self.assertIn('0 sent, 1 failed', self.run_worker())
+        self.assertEqual(EmailOutbox.objects.get().attempts, 1)
+
+    def test_claimed_rows_are_leased(self):
+        queue_email('Hello', ['a@example.com'])
+        self.assertEqual(len(claim_batch(10)), 1)
+        self.assertEqual(claim_batch(10), [])
+
+    def test_backoff_grows_and_is_capped(self):
+        self.assertEqual([backoff_delay(n) for n in (1, 2, 3)], [60, 120, 240])
+        self.assertEqual(backoff_delay(30), 6 * 60 * 60)
+
+
+class ContactFormTests(TestCase):
+    def test_contact_form_queues_email_instead_of_sending(self):
+        response = self.client.post(reverse('pages:contact'), {
+            'name': 'Aisyah',
+            'email': 'aisyah@example.com',
+            'subject': 'order',
+            'message': 'Where is my rendang order please?',
+        })
+        self.assertRedirects(response, reverse('pages:contact_success'))
+        email = EmailOutbox.objects.get()
+        self.assertEqual((email.to, email.reply_to), (['rroslan@gmail.com'], ['aisyah@example.com']))
+        self.assertIn('Order Support', email.subject)
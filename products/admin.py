@@ -1,6 +1,13 @@
-from django.contrib import admin
-from django.utils.html import format_html
-from .models import Category, Product
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .image_jobs import enqueue_renditions
+from .images import render_picture
+from .models import Category, ImageJob, MediaBlob, Product, ProductImage
 
 
 @admin.register(Category)
@@ -16,26 +23,46 @@ class CategoryAdmin(admin.ModelAdmin):
     product_count.short_description = 'Number of Products'
 
 
+class ProductImageInline(admin.TabularInline):
+    model = ProductImage
+    fields = ('image', 'position', 'preview')
+    readonly_fields = ('preview',)
+    extra = 1
+
+    def preview(self, obj):
+        if obj.pk and obj.image:
+            return render_picture(obj.image, sizes='200px', style='max-height: 200px; max-width: 200px;')
+        return "-"
+    preview.short_description = "Preview"
+
+
+class StockActionForm(ActionForm):
+    delta = forms.IntegerField(
+        required=False, label='Stock change',
+        help_text='Units to add (or take off, if negative) for "Adjust stock".'
+    )
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ['name', 'sku', 'category', 'price', 'is_published', 'image_preview', 'created_at']
+    list_display = ['name', 'sku', 'category', 'price', 'stock', 'is_published', 'image_preview', 'created_at']
     list_filter = ['is_published', 'category', 'created_at', 'updated_at']
     search_fields = ['name', 'sku', 'description']
     prepopulated_fields = {'slug': ('name',)}
-    readonly_fields = ['created_at', 'updated_at', 'preview_all_images']
+    readonly_fields = ['created_at', 'updated_at']
+    # Stock is only changed relatively, by the adjust_stock action, so edits
+    # never overwrite units that checkouts reserved meanwhile
     list_editable = ['is_published', 'price']
+    action_form = StockActionForm
     list_per_page = 20
+    inlines = [ProductImageInline]
 
     fieldsets = (
         ('Basic Information', {
             'fields': ('name', 'slug', 'sku', 'category', 'description')
         }),
         ('Pricing & Availability', {
-            'fields': ('price', 'is_published')
-        }),
-        ('Images', {
-            'fields': ('image_main', 'image_1', 'image_2', 'image_3', 'preview_all_images'),
-            'description': 'Upload product images. Main image will be used as the primary display image.'
+            'fields': ('price', 'stock', 'is_published')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
@@ -43,55 +70,39 @@ class ProductAdmin(admin.ModelAdmin):
         })
     )
 
+    def get_readonly_fields(self, request, obj=None):
+        # New products may start with any stock; existing ones use adjust_stock
+        if obj is None:
+            return self.readonly_fields
+        return [*self.readonly_fields, 'stock']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_primary_image()
+
     def image_preview(self, obj):
-        if obj.image_main:
-            return format_html(
-                '<img src="{}" style="max-height: 50px; max-width: 50px;" />',
-                obj.image_main.url
+        image = obj.primary_image
+        if image:
+            return render_picture(
+                image.image, sizes='50px', alt='', loading='lazy',
+                style='max-height: 50px; max-width: 50px;'
             )
         return "-"
     image_preview.short_description = "Main Image"
 
-    def preview_all_images(self, obj):
-        if not obj.pk:
-            return "Save the product first to see image previews"
-
-        html = '<div style="display: flex; gap: 10px; flex-wrap: wrap;">'
-
-        if obj.image_main:
-            html += format_html(
-                '<div><p><strong>Main Image:</strong></p><img src="{}" style="max-height: 200px; max-width: 200px;" /></div>',
-                obj.image_main.url
-            )
-
-        if obj.image_1:
-            html += format_html(
-                '<div><p><strong>Image 1:</strong></p><img src="{}" style="max-height: 200px; max-width: 200px;" /></div>',
-                obj.image_1.url
-            )
-
-        if obj.image_2:
-            html += format_html(
-                '<div><p><strong>Image 2:</strong></p><img src="{}" style="max-height: 200px; max-width: 200px;" /></div>',
-                obj.image_2.url
-            )
-
-        if obj.image_3:
-            html += format_html(
-                '<div><p><strong>Image 3:</strong></p><img src="{}" style="max-height: 200px; max-width: 200px;" /></div>',
-                obj.image_3.url
-            )
-
-        html += '</div>'
-
-        if not any([obj.image_main, obj.image_1, obj.image_2, obj.image_3]):
-            return "No images uploaded"
-
-        return format_html(html)
-
-    preview_all_images.short_description = "All Images Preview"
-
-    actions = ['make_published', 'make_unpublished']
+    def save_formset(self, request, form, formset, change):
+        super().save_formset(request, form, formset, change)
+        if formset.model is not ProductImage:
+            return
+        uploaded = [
+            image_form.instance for image_form in formset.forms
+            if image_form.instance.pk and 'image' in image_form.changed_data
+            and image_form not in formset.deleted_forms
+        ]
+        # Resizing takes seconds per image; the process_images worker does it
+        if uploaded and enqueue_renditions(uploaded):
+            self.message_user(request, "Responsive image versions will be generated shortly.")
+
+    actions = ['make_published', 'make_unpublished', 'adjust_stock']
 
     def make_published(self, request, queryset):
         updated = queryset.update(is_published=True)
@@ -102,3 +113,49 @@ class ProductAdmin(admin.ModelAdmin):
         updated = queryset.update(is_published=False)
         self.message_user(request, f"{updated} product(s) were unpublished.")
     make_unpublished.short_description = "Unpublish selected products"
+
+    def adjust_stock(self, request, queryset):
+        form = self.action_form(request.POST)
+        form.fields['action'].choices = self.get_action_choices(request)
+        delta = form.cleaned_data['delta'] if form.is_valid() else None
+        if not delta:
+            self.message_user(request, "Enter a stock change other than 0.", messages.WARNING)
+            return
+        # Untracked products start being tracked; stock never goes below 0
+        updated = queryset.update(stock=Greatest(Coalesce(F('stock'), 0) + delta, Value(0)))
+        self.message_user(request, f"Stock of {updated} product(s) changed by {delta:+d}.")
+    adjust_stock.short_description = "Adjust stock of selected products"
+
+
+@admin.register(ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = ('source', 'product', 'status', 'attempts', 'next_attempt_at', 'finished_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('source', 'content_hash', 'image__product__name', 'image__product__sku')
+    list_select_related = ('image__product',)
+    readonly_fields = ('image', 'source', 'content_hash', 'created_at', 'finished_at', 'last_error')
+    actions = ['retry_now']
+
+    def product(self, obj):
+        return obj.image.product
+    product.short_description = 'Product'
+
+    def retry_now(self, request, queryset):
+        updated = queryset.update(status='pending', attempts=0, next_attempt_at=timezone.now())
+        self.message_user(request, f'{updated} image jobs queued for another attempt.')
+    retry_now.short_description = 'Process selected images again'
+
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    # Counts are kept by the ProductImage receivers; editing them would lose files
+    list_display = ('name', 'size', 'refcount', 'last_used', 'created_at')
+    list_filter = ('created_at',)
+    search_fields = ('name', 'digest')
+    readonly_fields = ('digest', 'name', 'size', 'refcount', 'last_used', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,118 @@
+"""
+Catalog-wide cache versioning.
+
+Every cached catalog read (category lists, product pages, grid fragments)
+puts the current catalog version into its cache key. Any write to
+``Product`` or ``Category`` bumps the version once the transaction commits,
+so readers move on to fresh keys and stale entries are simply never looked
+up again (the cache backend culls them).
+
+A bump only reaches the processes that share the cache. The version and the
+entries therefore expire after ``CATALOG_CACHE_TIMEOUT``. A host with its own
+cache, such as the file-based fallback, serves a stale page for at most that
+long after another host changed the catalog.
+"""
+
+import time
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+CATALOG_VERSION_KEY = 'products:catalog_version'
+# Upper bound on staleness where a version bump cannot reach every host
+CATALOG_CACHE_TIMEOUT = 600
+
+NavCategory = namedtuple('NavCategory', ['id', 'name', 'slug', 'product_count'])
+
+# Per-process memo of the category navigation: (catalog version, categories)
+_navigation_memo = (None, ())
+
+
+def _initial_version():
+    # Seeding from the clock keeps the version increasing even if the counter
+    # expires or is evicted and has to be recreated.
+    return int(time.time() * 1000)
+
+
+def get_catalog_version():
+    """Return the current catalog version, creating it if necessary."""
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        version = _initial_version()
+        if not cache.add(CATALOG_VERSION_KEY, version, CATALOG_CACHE_TIMEOUT):
+            version = cache.get(CATALOG_VERSION_KEY, version)
+    return version
+
+
+def bump_catalog_version():
+    """Advance the catalog version, invalidating every catalog cache key."""
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        version = _initial_version()
+        cache.set(CATALOG_VERSION_KEY, version, CATALOG_CACHE_TIMEOUT)
+        return version
+
+
+def bump_catalog_version_on_commit(using=None):
+    """
+    Bump the version after the current transaction commits (or immediately
+    in autocommit mode), so no reader can cache pre-commit rows under the
+    new version.
+    """
+    transaction.on_commit(bump_catalog_version, using=using)
+
+
+def catalog_cache_key(*parts, version=None):
+    """Build a cache key that is only valid for the current catalog version."""
+    if version is None:
+        version = get_catalog_version()
+    return ':'.join(['catalog', str(version), *map(str, parts)])
+
+
+def cached_catalog(key_parts, compute, version=None):
+    """
+    Return the cached value for ``key_parts`` under the current catalog
+    version, computing and storing it for ``CATALOG_CACHE_TIMEOUT`` on a miss.
+    """
+    key = catalog_cache_key(*key_parts, version=version)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, CATALOG_CACHE_TIMEOUT)
+    return value
+
+
+def get_category_navigation():
+    """
+    Return all categories as an immutable tuple of ``NavCategory`` with
+    published-product counts, ordered by name.
+
+    Each process keeps the last result in memory and only goes to the shared
+    cache (and, on a miss there, one aggregate query) when the catalog
+    version has moved on.
+    """
+    global _navigation_memo
+
+    version = get_catalog_version()
+    memo_version, categories = _navigation_memo
+    if memo_version == version:
+        return categories
+
+    categories = cached_catalog(('category_navigation',), _load_category_navigation, version)
+    _navigation_memo = (version, categories)
+    return categories
+
+
+def _load_category_navigation():
+    from .models import Category
+
+    rows = (
+        Category.objects
+        .annotate(product_count=Count('products', filter=Q(products__is_published=True)))
+        .order_by('name')
+        .values_list('id', 'name', 'slug', 'product_count')
+    )
+    return tuple(NavCategory(*row) for row in rows)
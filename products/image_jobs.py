@@ -0,0 +1,177 @@
+"""
+Background generation of image renditions.
+
+Saving a product records the size, colour and placeholder of each new or
+replaced gallery image (cheap, see ``images.update_summary``) and an
+``ImageJob`` for it; the ``process_images`` worker does the resizing on a
+process pool:
+
+* jobs are keyed by image and content hash, so queueing is idempotent and
+  an upload whose renditions are current is not queued;
+* due jobs are claimed and leased through ``core.work_queue.LeasedQueue``,
+  like the mail outbox, so a worker that dies mid-batch leaves jobs that
+  are picked up again once the lease expires, and several workers can run
+  side by side;
+* the pool processes only touch storage; the parent writes each batch's
+  results to ``ProductImage.renditions`` in one transaction, skipping
+  images that were replaced in the meantime.
+"""
+
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.work_queue import LeasedQueue
+
+from .images import (
+    content_hash, get_renditions, hash_file, is_complete, render_renditions, update_summary,
+)
+from .models import ImageJob, ProductImage
+
+LEASE_SECONDS = 600
+RETRY_SECONDS = 300
+MAX_ATTEMPTS = 3
+
+
+def enqueue_renditions(product_images):
+    """
+    Queue rendition jobs for ``product_images``, recording the summary of
+    any upload that has none yet. Returns the number queued.
+    """
+    queued = 0
+    for product_image in product_images:
+        fieldfile = product_image.image
+        digest = content_hash(fieldfile)
+        record = get_renditions(fieldfile)
+        if is_complete(record) and record['hash'] == digest:
+            continue
+        if record is None or record.get('hash') != digest:
+            # Pages get its size and placeholder now, without waiting for the worker
+            update_summary(product_image, digest)
+        job, created = ImageJob.objects.get_or_create(
+            image=product_image, content_hash=digest,
+            defaults={'source': fieldfile.name},
+        )
+        if not created and (job.status != 'pending' or job.source != fieldfile.name):
+            # Same content uploaded again under a new name, or a retry
+            ImageJob.objects.filter(pk=job.pk).update(
+                source=fieldfile.name, status='pending', attempts=0,
+                next_attempt_at=timezone.now(), last_error='',
+            )
+        queued += 1
+    return queued
+
+
+def retry_delay(attempts):
+    """Seconds to wait before retrying a job that failed ``attempts`` times."""
+    return RETRY_SECONDS * attempts
+
+
+image_queue = LeasedQueue(ImageJob, LEASE_SECONDS, retry_delay)
+
+
+def claim_batch(batch_size):
+    """Lease up to ``batch_size`` due jobs to this worker and return them."""
+    return image_queue.claim(batch_size)
+
+
+def process_batch(executor, batch_size, max_attempts=MAX_ATTEMPTS):
+    """
+    Claim one batch and render it on ``executor``. Returns ``(done, failed)``;
+    ``(0, 0)`` means nothing was due. Raises ``BrokenProcessPool`` (after
+    recording the failures) if a pool process died, e.g. on an image too
+    large for its memory, so the caller can start a new pool.
+    """
+    batch = claim_batch(batch_size)
+    if not batch:
+        return 0, 0
+
+    futures = {
+        executor.submit(render_renditions, job.source, job.content_hash): job for job in batch
+    }
+    results, broken = [], None
+    for future in as_completed(futures):
+        job = futures[future]
+        try:
+            results.append((job, future.result()))
+        except Exception as e:
+            image_queue.record_failure(job, e, max_attempts)
+            if isinstance(e, BrokenProcessPool):
+                broken = e
+
+    _record_results(results)
+    if broken:
+        raise broken
+    return len(results), len(batch) - len(results)
+
+
+def _record_results(results):
+    if not results:
+        return
+    with transaction.atomic():
+        product_images = ProductImage.objects.select_for_update().only(
+            'image', 'renditions'
+        ).in_bulk([job.image_id for job, _ in results])
+        changed = []
+        for job, record in results:
+            product_image = product_images.get(job.image_id)
+            # Replaced since it was queued; the new upload has its own job
+            if product_image is None or product_image.image.name != job.source:
+                continue
+            product_image.renditions = record
+            changed.append(product_image)
+        if changed:
+            ProductImage.objects.bulk_update(changed, ['renditions'])
+        ImageJob.objects.filter(pk__in=[job.pk for job, _ in results]).update(
+            status='done', attempts=F('attempts') + 1,
+            finished_at=timezone.now(), last_error='',
+        )
+
+
+def backfill(executor, chunk_size=500):
+    """
+    Queue jobs for every gallery image without a complete, current
+    rendition record (older records may lack keys added since), walking
+    images in primary key order ``chunk_size`` at a time. Uploads are hashed
+    on ``executor``. Yields ``(images_seen, images_queued)`` per chunk.
+    """
+    last_pk = 0
+    while True:
+        chunk = list(
+            ProductImage.objects.filter(pk__gt=last_pk).order_by('pk')
+            .only('image', 'renditions')[:chunk_size]
+        )
+        if not chunk:
+            return
+        last_pk = chunk[-1].pk
+
+        todo = [
+            product_image for product_image in chunk
+            if not is_complete(get_renditions(product_image.image))
+        ]
+        hashes = executor.map(_hash_or_none, [product_image.image.name for product_image in todo])
+        jobs = [
+            ImageJob(image=product_image, content_hash=digest, source=product_image.image.name)
+            for product_image, digest in zip(todo, hashes)
+            if digest is not None
+        ]
+        ImageJob.objects.bulk_create(jobs, ignore_conflicts=True)
+        # Jobs that already ran for this content run again (renditions on disk are kept)
+        ImageJob.objects.filter(
+            image__in=[job.image_id for job in jobs],
+            content_hash__in=[job.content_hash for job in jobs],
+        ).exclude(status='pending').update(
+            status='pending', attempts=0, next_attempt_at=timezone.now(), last_error='',
+        )
+        yield len(chunk), len(jobs)
+
+
+def _hash_or_none(name):
+    # Uploads missing from storage are skipped rather than failing the backfill
+    try:
+        return hash_file(name)
+    except OSError:
+        return None
@@ -0,0 +1,287 @@
+"""
+Responsive derivatives of product images.
+
+Uploads are kept as they are; ``generate_renditions`` writes resized copies
+next to the original at each width in ``WIDTHS`` (never wider than the
+original) in every format of ``FORMATS``: AVIF where Pillow supports it,
+WebP, and JPEG as the fallback every browser can show. Names carry a hash of
+the original's content, e.g. ``blobs/3f/3f9a…e21-640w.webp`` next to a blob
+of ``products/storage.py`` (``products/images/rendang-3f9a1c0b7e21-640w.webp``
+for older uploads), so a re-upload never collides with cached copies and the
+files can be cached forever. Blobs are named by their SHA-256 already, so
+hashing one is free.
+
+What was generated is recorded in ``ProductImage.renditions``, together
+with the original's width and height, its dominant colour and a tiny base64
+placeholder (LQIP). Those last four are cheap (the size comes from the
+header, the rest from a reduced decode), so ``update_summary`` records them
+as soon as an image is uploaded and only the resizing waits for the worker.
+Rendering a ``<picture>`` (``render_picture`` and the ``{% picture %}`` tag)
+is therefore pure string work that never touches storage, and the ``<img>``
+gets exact ``width``/``height`` and a placeholder background that shows until
+the real image arrives, renditions or not. If the image has been replaced
+since, the record no longer matches and the original is shown until the
+renditions are regenerated.
+"""
+
+import base64
+import hashlib
+import io
+
+from django.core.files.base import ContentFile
+from django.utils.html import format_html, format_html_join
+from PIL import ExifTags, Image, ImageOps, features
+
+from .storage import blob_digest, blob_storage
+
+WIDTHS = (320, 640, 960, 1280)
+# Width used for the plain ``src`` of browsers that ignore ``srcset``
+FALLBACK_WIDTH = 640
+
+# Best first; the last one is the ``<img>`` fallback
+FORMATS = tuple(fmt for fmt in ('avif', 'webp', 'jpeg') if fmt != 'avif' or features.check('avif'))
+MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+EXTENSIONS = {'avif': 'avif', 'webp': 'webp', 'jpeg': 'jpg'}
+SAVE_OPTIONS = {
+    'avif': {'quality': 55, 'speed': 8},
+    'webp': {'quality': 78, 'method': 4},
+    'jpeg': {'quality': 80, 'optimize': True, 'progressive': True},
+}
+
+# Longest side of the inline placeholder, in pixels
+PLACEHOLDER_SIZE = 16
+# Decoded size the colour and placeholder of a summary are worked out from
+SUMMARY_DRAFT_SIZE = 64
+# Keys recorded at upload, before any rendition exists
+SUMMARY_KEYS = ('source', 'hash', 'width', 'height', 'color', 'placeholder')
+# Keys a record needs before templates can rely on it
+RECORD_KEYS = ('source', 'hash', 'widths', 'formats', 'width', 'height', 'color', 'placeholder')
+
+HASH_LENGTH = 12
+CHUNK_SIZE = 64 * 1024
+
+
+def hash_file(name, storage=None):
+    """Short SHA-256 of a stored file's content, read in chunks unless its name carries it."""
+    digest = blob_digest(name)
+    if digest:
+        return digest[:HASH_LENGTH]
+    digest = hashlib.sha256()
+    with (storage or blob_storage).open(name, 'rb') as file:
+        for chunk in file.chunks(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def content_hash(fieldfile):
+    return hash_file(fieldfile.name, fieldfile.storage)
+
+
+def rendition_name(source, digest, width, fmt):
+    """Storage name of one rendition, in the original's directory."""
+    stem = source.rsplit('.', 1)[0]
+    if blob_digest(source):
+        # The blob's name is its full hash already
+        return f'{stem}-{width}w.{EXTENSIONS[fmt]}'
+    return f'{stem}-{digest}-{width}w.{EXTENSIONS[fmt]}'
+
+
+def _target_widths(original_width):
+    widths = [width for width in WIDTHS if width <= original_width]
+    # Small originals still get one rendition, at their own width
+    return widths or [original_width]
+
+
+def _flatten(image):
+    """``image`` as RGB, with any transparency over white."""
+    if image.mode == 'RGB':
+        return image
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+    return background
+
+
+def _encode(image, fmt):
+    if fmt == 'jpeg':
+        image = _flatten(image)
+    buffer = io.BytesIO()
+    image.save(buffer, fmt.upper(), **SAVE_OPTIONS[fmt])
+    return buffer.getvalue()
+
+
+def dominant_color(image):
+    """Most common colour of ``image`` after reducing it to a few, as ``#rrggbb``."""
+    sample = _flatten(image).copy()
+    sample.thumbnail((64, 64))
+    quantized = sample.quantize(colors=5)
+    _, index = max(quantized.getcolors())
+    red, green, blue = quantized.getpalette()[index * 3:index * 3 + 3]
+    return f'#{red:02x}{green:02x}{blue:02x}'
+
+
+def placeholder(image):
+    """A ``PLACEHOLDER_SIZE`` px WebP of ``image`` as a ``data:`` URI (a few hundred bytes)."""
+    tiny = image.copy()
+    tiny.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    buffer = io.BytesIO()
+    tiny.save(buffer, 'WEBP', quality=40)
+    return 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def _decode(name, storage, size):
+    """
+    The stored image ``name`` upright and in RGB(A), decoded at no less than
+    ``size`` where the format allows less, and the original's upright
+    ``(width, height)``.
+    """
+    with storage.open(name, 'rb') as file:
+        image = Image.open(file)
+        # Real size from the header: draft() below may decode at less
+        original_size = image.size
+        if image.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8):
+            original_size = original_size[::-1]
+        # JPEG can decode straight at a fraction of the size, much faster
+        image.draft('RGB', size)
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            alpha = 'A' in image.getbands() or 'transparency' in image.info
+            image = image.convert('RGBA' if alpha else 'RGB')
+        image.load()
+    return image, original_size
+
+
+def _summary(name, digest, image, original_size):
+    return {
+        'source': name,
+        'hash': digest,
+        'width': original_size[0],
+        'height': original_size[1],
+        'color': dominant_color(image),
+        'placeholder': placeholder(image),
+    }
+
+
+def describe_image(name, digest=None, storage=None):
+    """
+    The part of a rendition record known before any rendition exists: the
+    original's size, dominant colour and placeholder, from a reduced decode.
+    """
+    storage = storage or blob_storage
+    digest = digest or hash_file(name, storage)
+    image, original_size = _decode(name, storage, (SUMMARY_DRAFT_SIZE, SUMMARY_DRAFT_SIZE))
+    return _summary(name, digest, image, original_size)
+
+
+def generate_renditions(fieldfile, digest=None):
+    """
+    Write every rendition of ``fieldfile`` that is not in storage yet and
+    return the record to keep in ``ProductImage.renditions``. Safe to call
+    again: content-hashed names that already exist are skipped.
+    """
+    return render_renditions(fieldfile.name, digest, fieldfile.storage)
+
+
+def render_renditions(name, digest=None, storage=None):
+    """
+    ``generate_renditions`` for a storage name. Needs no database access, so
+    the ``process_images`` worker runs it in its process pool.
+    """
+    storage = storage or blob_storage
+    digest = digest or hash_file(name, storage)
+
+    image, original_size = _decode(name, storage, (WIDTHS[-1], WIDTHS[-1]))
+
+    widths = _target_widths(image.width)
+    for width in widths:
+        names = {fmt: rendition_name(name, digest, width, fmt) for fmt in FORMATS}
+        missing = [fmt for fmt, rendition in names.items() if not storage.exists(rendition)]
+        if not missing:
+            continue
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        for fmt in missing:
+            storage.save(names[fmt], ContentFile(_encode(resized, fmt)))
+
+    return {
+        **_summary(name, digest, image, original_size),
+        'widths': widths,
+        'formats': list(FORMATS),
+    }
+
+
+def update_renditions(product_image):
+    """Regenerate the renditions of a ``ProductImage`` and save the record."""
+    record = generate_renditions(product_image.image)
+    product_image.renditions = record
+    type(product_image).objects.filter(pk=product_image.pk).update(renditions=record)
+    return record
+
+
+def update_summary(product_image, digest=None):
+    """
+    Record the size, colour and placeholder of a freshly uploaded
+    ``ProductImage`` until its renditions replace the record.
+    """
+    fieldfile = product_image.image
+    record = describe_image(fieldfile.name, digest, fieldfile.storage)
+    product_image.renditions = record
+    type(product_image).objects.filter(pk=product_image.pk).update(renditions=record)
+    return record
+
+
+def get_renditions(fieldfile):
+    """The stored rendition record for ``fieldfile``, or ``None`` if stale."""
+    record = getattr(fieldfile.instance, 'renditions', None)
+    if record and record.get('source') == fieldfile.name:
+        return record
+    return None
+
+
+def is_complete(record):
+    """Whether ``record`` has everything the current code stores, so needs no reprocessing."""
+    return bool(record) and all(key in record for key in RECORD_KEYS)
+
+
+def _srcset(fieldfile, record, fmt):
+    storage = fieldfile.storage
+    return ', '.join(
+        f'{storage.url(rendition_name(record["source"], record["hash"], width, fmt))} {width}w'
+        for width in record['widths']
+    )
+
+
+def render_picture(fieldfile, sizes='100vw', alt='', **attrs):
+    """
+    ``<picture>`` markup for ``fieldfile`` with one ``<source>`` per modern
+    format and a JPEG ``<img>`` sized and backed by the stored placeholder;
+    extra keyword arguments become attributes of the ``<img>``. Falls back
+    to a plain ``<img>`` of the original when no current renditions are
+    recorded, still sized and backed by the placeholder if those are.
+    """
+    if not fieldfile:
+        return ''
+    record = get_renditions(fieldfile)
+    if record and all(key in record for key in SUMMARY_KEYS):
+        attrs = {'width': record['width'], 'height': record['height'], **attrs}
+        background = (
+            f"background-color: {record['color']}; "
+            f"background-image: url({record['placeholder']}); background-size: cover"
+        )
+        attrs['style'] = '; '.join(filter(None, [background, attrs.get('style')]))
+    img_attrs = format_html_join(
+        '', ' {}="{}"', ((key.replace('_', '-'), value) for key, value in attrs.items())
+    )
+    if not record or 'widths' not in record:
+        return format_html('<img src="{}" alt="{}"{}>', fieldfile.url, alt, img_attrs)
+
+    *modern, fallback = record['formats']
+    width = max([w for w in record['widths'] if w <= FALLBACK_WIDTH] or record['widths'][:1])
+    sources = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        ((MIME_TYPES[fmt], _srcset(fieldfile, record, fmt), sizes) for fmt in modern),
+    )
+    src = fieldfile.storage.url(rendition_name(record['source'], record['hash'], width, fallback))
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" alt="{}"{}></picture>',
+        sources, src, _srcset(fieldfile, record, fallback), sizes, alt, img_attrs,
+    )
@@ -0,0 +1,86 @@
+"""
+Stock reservation.
+
+``reserve_stock`` takes every tracked line of an order off ``Product.stock``
+with one conditional statement::
+
+    UPDATE products_product
+    SET stock = stock - CASE id WHEN ... END
+    WHERE id IN (...) AND stock >= CASE id WHEN ... END
+    RETURNING id, stock
+
+The database applies the check and the decrement atomically per row, so
+concurrent buyers of the same product never oversell it and nobody holds a
+``SELECT ... FOR UPDATE`` lock while the rest of the request runs. Products
+with ``stock`` left empty are not tracked and always succeed.
+"""
+
+from collections import namedtuple
+
+from django.db import connections
+
+from .cache import bump_catalog_version_on_commit
+
+Shortfall = namedtuple('Shortfall', ['product_id', 'name', 'requested', 'available'])
+
+
+class InsufficientStock(Exception):
+    """Raised by ``reserve_stock`` with a ``Shortfall`` for every short line."""
+
+    def __init__(self, shortfalls):
+        self.shortfalls = shortfalls
+        super().__init__(', '.join(
+            f'{s.name}: {s.requested} requested, {s.available} available' for s in shortfalls
+        ))
+
+
+def reserve_stock(lines, using='default'):
+    """
+    Decrement stock for ``lines``, an iterable of ``(product, quantity)``.
+
+    Must run inside a transaction: on a shortfall the other lines may have
+    been decremented already, and raising ``InsufficientStock`` is what
+    rolls them back. A product selling out bumps the catalog version so
+    cached pages stop offering it.
+    """
+    from .models import Product
+
+    wanted = {}
+    names = {}
+    for product, quantity in lines:
+        if product.stock is None:
+            continue
+        wanted[product.pk] = wanted.get(product.pk, 0) + quantity
+        names[product.pk] = product.name
+    if not wanted:
+        return
+
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    table = qn(Product._meta.db_table)
+    case = 'CASE {} {} END'.format(qn('id'), ' '.join(['WHEN %s THEN %s'] * len(wanted)))
+    case_params = [value for item in wanted.items() for value in item]
+    ids = ', '.join(['%s'] * len(wanted))
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {table} SET {qn('stock')} = {qn('stock')} - {case}
+            WHERE {qn('id')} IN ({ids}) AND {qn('stock')} >= {case}
+            RETURNING {qn('id')}, {qn('stock')}
+            """,
+            [*case_params, *wanted, *case_params],
+        )
+        remaining = dict(cursor.fetchall())
+
+    short = [pk for pk in wanted if pk not in remaining]
+    if short:
+        available = dict(
+            Product.objects.using(using).filter(pk__in=short).values_list('pk', 'stock')
+        )
+        raise InsufficientStock([
+            Shortfall(pk, names[pk], wanted[pk], available.get(pk) or 0) for pk in short
+        ])
+
+    if 0 in remaining.values():
+        bump_catalog_version_on_commit(using=using)
@@ -0,0 +1,108 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from products.models import Product
+from products.search import search_products
+
+
+FILLER_WORDS = [
+    'sambal', 'curry', 'kerisik', 'lemongrass', 'galangal', 'turmeric',
+    'coconut', 'chilli', 'belacan', 'tamarind', 'pandan', 'shallot',
+    'ginger', 'garlic', 'candlenut', 'cumin', 'fennel', 'star', 'anise',
+]
+NEEDLE = 'rendang'
+NEEDLE_COUNT = 25
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark product search against a growing catalog. All benchmark '
+        'rows are created inside a transaction that is rolled back at the end.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            default='1000,10000,100000,500000',
+            help='Comma-separated catalog sizes to measure (default: 1k to 500k)',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Number of timed queries per size',
+        )
+        parser.add_argument(
+            '--skip-legacy',
+            action='store_true',
+            help='Do not time the old icontains scan for comparison',
+        )
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        repeat = options['repeat']
+        rng = random.Random(42)
+
+        self.stdout.write(f'{"products":>10} {"fts (ms)":>10} {"icontains (ms)":>15}')
+        try:
+            with transaction.atomic():
+                created = 0
+                for size in sizes:
+                    created += self._grow_catalog(created, size, rng)
+                    fts_ms = self._time(self._search_query, repeat)
+                    legacy = '-'
+                    if not options['skip_legacy']:
+                        legacy = f'{self._time(self._legacy_query, repeat):.2f}'
+                    self.stdout.write(f'{size:>10} {fts_ms:>10.2f} {legacy:>15}')
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Done. Each query returns the same {NEEDLE_COUNT} matches; benchmark rows rolled back.'
+        ))
+
+    def _grow_catalog(self, existing, target, rng, batch_size=5000):
+        """Insert filler products (plus a fixed set of needles) up to ``target`` rows."""
+        products = []
+        for number in range(existing, target):
+            words = rng.sample(FILLER_WORDS, 6)
+            if number < NEEDLE_COUNT:
+                words[0] = NEEDLE
+            products.append(Product(
+                name=' '.join(words[:2]).title(),
+                sku=f'BENCH-{number:07d}',
+                slug=f'bench-{number}',
+                description=' '.join(words),
+                is_published=True,
+            ))
+        Product.objects.bulk_create(products, batch_size=batch_size)
+        return len(products)
+
+    def _search_query(self):
+        return search_products(Product.objects.all(), NEEDLE).order_by('-search_rank', '-created_at')
+
+    def _legacy_query(self):
+        return Product.objects.filter(
+            Q(name__icontains=NEEDLE) |
+            Q(description__icontains=NEEDLE) |
+            Q(sku__icontains=NEEDLE)
+        )
+
+    def _time(self, build_queryset, repeat):
+        """Median wall time in milliseconds to fetch the first page of results."""
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            list(build_queryset()[:4])
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
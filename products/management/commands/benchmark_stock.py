@@ -0,0 +1,145 @@
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, transaction
+
+from products.inventory import InsufficientStock, reserve_stock
+from products.models import Product
+
+MODES = ('conditional', 'locking')
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark stock reservation when many buyers hit one hot product at '
+        'once. Compares the conditional UPDATE used by checkout with a '
+        'SELECT ... FOR UPDATE, check, then write. A throwaway product is '
+        'created for each run and deleted afterwards. Run it against '
+        'PostgreSQL; SQLite serialises all writers whatever the approach.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--buyers',
+            type=int,
+            default=16,
+            help='Concurrent buyer threads (default: 16)',
+        )
+        parser.add_argument(
+            '--stock',
+            type=int,
+            default=2000,
+            help='Units of the hot product to sell (default: 2000)',
+        )
+        parser.add_argument(
+            '--quantity',
+            type=int,
+            default=1,
+            help='Units bought per checkout (default: 1)',
+        )
+        parser.add_argument(
+            '--think-ms',
+            type=float,
+            default=2.0,
+            help='Other checkout work done in the same transaction, in ms (default: 2)',
+        )
+        parser.add_argument(
+            '--modes',
+            default=','.join(MODES),
+            help=f'Comma-separated modes to run (default: {",".join(MODES)})',
+        )
+
+    def handle(self, *args, **options):
+        modes = [mode for mode in options['modes'].split(',') if mode]
+        for mode in modes:
+            if mode not in MODES:
+                self.stderr.write(self.style.ERROR(f'Unknown mode: {mode}'))
+                return
+
+        self.stdout.write(
+            f'{"mode":<12} {"buyers":>6} {"sold":>6} {"seconds":>8} '
+            f'{"checkouts/s":>12} {"retries":>8} {"left":>5}'
+        )
+        for mode in modes:
+            product = Product.objects.create(
+                name='Benchmark hot product', sku=f'BENCH-{uuid.uuid4().hex[:12]}',
+                price=Decimal('1.00'), stock=options['stock'],
+            )
+            try:
+                sold, retries, elapsed = self._run(mode, product, options)
+                product.refresh_from_db(fields=['stock'])
+                self.stdout.write(
+                    f'{mode:<12} {options["buyers"]:>6} {sold:>6} {elapsed:>8.2f} '
+                    f'{sold / options["quantity"] / elapsed:>12.0f} {retries:>8} {product.stock:>5}'
+                )
+                if sold + product.stock != options['stock']:
+                    self.stderr.write(self.style.ERROR(f'{mode}: stock does not add up (oversold?)'))
+            finally:
+                product.delete()
+
+    def _run(self, mode, product, options):
+        buy = self._buy_conditional if mode == 'conditional' else self._buy_locking
+        barrier = threading.Barrier(options['buyers'] + 1)
+        results = []
+        lock = threading.Lock()
+
+        def buyer():
+            sold = retries = 0
+            try:
+                barrier.wait()
+                while True:
+                    try:
+                        with transaction.atomic():
+                            if not buy(product, options['quantity'], options['think_ms'] / 1000):
+                                break
+                        sold += options['quantity']
+                    except OperationalError as exc:
+                        # SQLite reports lock contention instead of waiting
+                        if 'locked' not in str(exc):
+                            raise
+                        retries += 1
+            finally:
+                with lock:
+                    results.append((sold, retries))
+                connection.close()
+
+        threads = [threading.Thread(target=buyer) for _ in range(options['buyers'])]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        return sum(s for s, _ in results), sum(r for _, r in results), elapsed
+
+    @staticmethod
+    def _buy_conditional(product, quantity, think):
+        # Checkout's order: do the other work first, take the row lock last
+        time.sleep(think)
+        try:
+            reserve_stock([(product, quantity)])
+        except InsufficientStock:
+            return False
+        return True
+
+    @staticmethod
+    def _buy_locking(product, quantity, think):
+        # The pattern checkout avoids: hold a row lock from the read to the write
+        stock = (
+            Product.objects.select_for_update()
+            .filter(pk=product.pk).values_list('stock', flat=True).get()
+        )
+        time.sleep(think)
+        if stock < quantity:
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'UPDATE products_product SET stock = %s WHERE id = %s',
+                [stock - quantity, product.pk],
+            )
+        return True
@@ -0,0 +1,44 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from products.storage import GRACE_PERIOD, collect_garbage
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete content-addressed product images, with their renditions, '
+        'that no gallery image has used for the grace period. Deleting an '
+        'image only drops its reference; run this from cron to free the '
+        'space. Safe to run while uploads and other collectors are running.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-minutes',
+            type=float,
+            default=GRACE_PERIOD.total_seconds() / 60,
+            help=f'Keep unused blobs this long (default: {GRACE_PERIOD.total_seconds() / 60:.0f})',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Blobs deleted per transaction (default: 500)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would be deleted',
+        )
+
+    def handle(self, *args, **options):
+        blobs, size = collect_garbage(
+            grace=timedelta(minutes=options['grace_minutes']),
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+        )
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {blobs} unused images ({size / 1024 / 1024:.1f} MB)'
+        ))
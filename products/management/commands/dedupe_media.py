@@ -0,0 +1,94 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from products.image_jobs import enqueue_renditions
+from products.images import get_renditions, hash_file, is_complete, rendition_name
+from products.models import ProductImage
+from products.storage import BLOB_PREFIX, blob_storage
+
+
+class Command(BaseCommand):
+    help = (
+        'Move gallery images stored under their upload names into the '
+        'content-addressed store, so identical photos are kept once. Their '
+        'renditions move along; the old files are deleted once no image uses '
+        'them. Images are walked in primary key order, so an interrupted run '
+        'can simply be started again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Images read per query (default: 500)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only hash the images and report how many distinct files they need',
+        )
+
+    def handle(self, *args, **options):
+        moved, blobs, missing = 0, set(), 0
+        last_pk = 0
+        while True:
+            chunk = list(
+                ProductImage.objects.filter(pk__gt=last_pk)
+                .exclude(image__startswith=f'{BLOB_PREFIX}/')
+                .order_by('pk')[:options['chunk_size']]
+            )
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+            for product_image in chunk:
+                try:
+                    if options['dry_run']:
+                        blobs.add(hash_file(product_image.image.name))
+                    else:
+                        blobs.add(self._move(product_image))
+                except FileNotFoundError:
+                    missing += 1
+                    self.stderr.write(self.style.WARNING(f'Missing: {product_image.image.name}'))
+                    continue
+                moved += 1
+
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {moved} images into {len(blobs)} distinct files, {missing} missing'
+        ))
+
+    @staticmethod
+    def _move(product_image):
+        old = product_image.image.name
+        with blob_storage.open(old, 'rb') as file:
+            new = blob_storage.save(blob_storage.generate_filename(old), file)
+
+        record = get_renditions(product_image.image)
+        old_renditions = []
+        if record:
+            # Same content, same hash: the worker would produce exactly these names
+            for width in record['widths']:
+                for fmt in record['formats']:
+                    source = rendition_name(old, record['hash'], width, fmt)
+                    target = rendition_name(new, record['hash'], width, fmt)
+                    if blob_storage.exists(source) and not blob_storage.exists(target):
+                        with blob_storage.open(source, 'rb') as file:
+                            blob_storage.save(target, file)
+                    old_renditions.append(source)
+            record = {**record, 'source': new}
+
+        with transaction.atomic():
+            product_image.image.name = new
+            product_image.renditions = record or {}
+            product_image.save(update_fields=['image', 'renditions'])
+            if not ProductImage.objects.filter(image=old).exists():
+                transaction.on_commit(lambda: _delete_files([old, *old_renditions]))
+        if not is_complete(record):
+            enqueue_renditions([product_image])
+        return new
+
+
+def _delete_files(names):
+    for name in names:
+        blob_storage.delete(name)
@@ -0,0 +1,113 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from products.image_jobs import MAX_ATTEMPTS, backfill, process_batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate responsive renditions for queued product images on a pool '
+        'of worker processes. Jobs are claimed with SELECT ... FOR UPDATE SKIP '
+        'LOCKED and leased, so an interrupted run resumes where it stopped and '
+        'several workers can run at once. --backfill first queues every '
+        'existing image that has no current renditions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Worker processes (default: CPU count)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Jobs claimed at a time (default: 4 per worker)',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5.0,
+            help='Seconds to wait when no jobs are due (default: 5)',
+        )
+        parser.add_argument(
+            '--max-attempts',
+            type=int,
+            default=MAX_ATTEMPTS,
+            help=f'Give up on an image after this many attempts (default: {MAX_ATTEMPTS})',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process everything that is due, then exit (for cron or tests)',
+        )
+        parser.add_argument(
+            '--backfill',
+            action='store_true',
+            help='Queue all existing gallery images first; implies --once',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Images read per query when backfilling (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        batch_size = options['batch_size'] or workers * 4
+        once = options['once'] or options['backfill']
+        total_done = total_failed = 0
+        started = time.perf_counter()
+
+        # Pool processes never use the database; don't hand them our connection
+        connections.close_all()
+        executor = ProcessPoolExecutor(workers, initializer=django.setup)
+        try:
+            if options['backfill']:
+                seen = queued = 0
+                for chunk_seen, chunk_queued in backfill(executor, options['chunk_size']):
+                    seen += chunk_seen
+                    queued += chunk_queued
+                self.stdout.write(f'Backfill queued {queued} of {seen} images')
+                started = time.perf_counter()
+
+            while True:
+                batch_started = time.perf_counter()
+                try:
+                    done, failed = process_batch(executor, batch_size, options['max_attempts'])
+                except BrokenProcessPool:
+                    self.stderr.write(self.style.WARNING('A worker process died; restarting the pool'))
+                    executor.shutdown(cancel_futures=True)
+                    executor = ProcessPoolExecutor(workers, initializer=django.setup)
+                    continue
+                total_done += done
+                total_failed += failed
+                if done or failed:
+                    elapsed = time.perf_counter() - batch_started
+                    self.stdout.write(
+                        f'Processed {done} images, {failed} failed '
+                        f'({done / elapsed:.1f} images/s)'
+                    )
+                    continue
+                if once:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Image worker done: {total_done} processed, {total_failed} failed, '
+            f'{total_done / elapsed if elapsed else 0:.1f} images/s'
+        ))
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:12
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+from products.search import install_search_backend, uninstall_search_backend
+
+
+def install(apps, schema_editor):
+    install_search_backend(schema_editor)
+
+
+def uninstall(apps, schema_editor):
+    uninstall_search_backend(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(install, uninstall),
+    ]
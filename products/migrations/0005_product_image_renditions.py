@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:43
+
+from django.db import migrations, models
+
+from products.search import install_search_backend
+
+
+def reinstall_search(apps, schema_editor):
+    # SQLite adds a NOT NULL column with a default by rebuilding the table,
+    # which drops the FTS triggers on it
+    install_search_backend(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_product_stock'),
+    ]
+
+    operations = [
+        # Unapplying drops the column with another rebuild
+        migrations.RunPython(migrations.RunPython.noop, reinstall_search),
+        migrations.AddField(
+            model_name='product',
+            name='image_renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(reinstall_search, migrations.RunPython.noop),
+    ]
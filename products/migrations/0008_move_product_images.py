@@ -0,0 +1,72 @@
+"""
+Move ``Product.image_main`` and ``image_1`` to ``image_3`` into ``ProductImage``
+rows (positions 0-3, files left where they are) along with their rendition
+records, and point queued image jobs at the new rows.
+"""
+
+from django.db import migrations
+
+IMAGE_FIELDS = ('image_main', 'image_1', 'image_2', 'image_3')
+BATCH_SIZE = 500
+
+
+def move_to_gallery(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductImage = apps.get_model('products', 'ProductImage')
+    ImageJob = apps.get_model('products', 'ImageJob')
+
+    products = Product.objects.only('image_renditions', *IMAGE_FIELDS).order_by('pk')
+    images = []
+    for product in products.iterator(chunk_size=BATCH_SIZE):
+        renditions = product.image_renditions or {}
+        for position, field in enumerate(name for name in IMAGE_FIELDS if getattr(product, name)):
+            images.append(ProductImage(
+                product_id=product.pk,
+                image=getattr(product, field).name,
+                position=position,
+                renditions=renditions.get(field, {}),
+            ))
+    ProductImage.objects.bulk_create(images, batch_size=BATCH_SIZE)
+
+    gallery = {
+        (image.product_id, image.image.name): image.pk
+        for image in ProductImage.objects.only('product_id', 'image')
+    }
+    jobs = list(ImageJob.objects.only('product', 'source'))
+    for job in jobs:
+        job.image_id = gallery.get((job.product_id, job.source))
+    ImageJob.objects.bulk_update(jobs, ['image'], batch_size=BATCH_SIZE)
+    # Jobs for images that were replaced before the move have nothing to do
+    ImageJob.objects.filter(image__isnull=True).delete()
+
+
+def move_from_gallery(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductImage = apps.get_model('products', 'ProductImage')
+
+    products = {}
+    # Only four images fit back into the old fields
+    for image in ProductImage.objects.order_by('product_id', 'position', 'id').iterator(chunk_size=BATCH_SIZE):
+        product = products.setdefault(image.product_id, Product(pk=image.product_id, image_renditions={}))
+        taken = [field for field in IMAGE_FIELDS if getattr(product, field)]
+        if len(taken) == len(IMAGE_FIELDS):
+            continue
+        field = IMAGE_FIELDS[len(taken)]
+        setattr(product, field, image.image.name)
+        if image.renditions:
+            product.image_renditions[field] = image.renditions
+    Product.objects.bulk_update(
+        products.values(), [*IMAGE_FIELDS, 'image_renditions'], batch_size=BATCH_SIZE
+    )
+    ProductImage.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_productimage'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_to_gallery, move_from_gallery),
+    ]
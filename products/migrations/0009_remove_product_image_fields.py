@@ -0,0 +1,71 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+from products.search import install_search_backend
+
+
+def reinstall_search(apps, schema_editor):
+    # SQLite may rebuild products_product to change its columns, which drops
+    # the FTS triggers on it; a no-op everywhere else
+    install_search_backend(schema_editor)
+
+
+def clear_image_jobs(apps, schema_editor):
+    # Unapplying: the job queue cannot be restored to the old fields, but
+    # ``process_images --backfill`` rebuilds it
+    apps.get_model('products', 'ImageJob').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_move_product_images'),
+    ]
+
+    operations = [
+        # Unapplying re-adds the image columns, rebuilding the table
+        migrations.RunPython(migrations.RunPython.noop, reinstall_search),
+        migrations.RemoveConstraint(
+            model_name='imagejob',
+            name='image_job_key_uniq',
+        ),
+        migrations.RemoveField(
+            model_name='imagejob',
+            name='field',
+        ),
+        migrations.RemoveField(
+            model_name='imagejob',
+            name='product',
+        ),
+        migrations.AlterField(
+            model_name='imagejob',
+            name='image',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='products.productimage'),
+        ),
+        migrations.AddConstraint(
+            model_name='imagejob',
+            constraint=models.UniqueConstraint(fields=('image', 'content_hash'), name='image_job_key_uniq'),
+        ),
+        migrations.RemoveField(
+            model_name='product',
+            name='image_main',
+        ),
+        migrations.RemoveField(
+            model_name='product',
+            name='image_1',
+        ),
+        migrations.RemoveField(
+            model_name='product',
+            name='image_2',
+        ),
+        migrations.RemoveField(
+            model_name='product',
+            name='image_3',
+        ),
+        migrations.RemoveField(
+            model_name='product',
+            name='image_renditions',
+        ),
+        migrations.RunPython(reinstall_search, migrations.RunPython.noop),
+        migrations.RunPython(migrations.RunPython.noop, clear_image_jobs),
+    ]
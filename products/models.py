@@ -1,7 +1,76 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
 from django.utils.text import slugify
 from decimal import Decimal
 
+from .cache import bump_catalog_version_on_commit
+from .storage import blob_storage, release_blob, retain_blob
+
+
+class CatalogQuerySet(models.QuerySet):
+    """
+    QuerySet for catalog models whose bulk writes bypass model signals
+    (``update``, ``bulk_update``, ``bulk_create``) but must still invalidate
+    cached catalog reads.
+    """
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        if rows:
+            bump_catalog_version_on_commit(using=self.db)
+        return rows
+
+    update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if objs:
+            bump_catalog_version_on_commit(using=self.db)
+        return objs
+
+# Sent after a queryset update() (and so bulk_update()) of Product.price with
+# the ids of the products it may have repriced; single saves send post_save
+product_prices_changed = Signal()
+
+
+class ProductQuerySet(CatalogQuerySet):
+    def update(self, **kwargs):
+        if 'price' not in kwargs:
+            return super().update(**kwargs)
+        # Read the ids first: the filter may no longer match once prices move
+        product_ids = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        if rows:
+            product_prices_changed.send(sender=self.model, product_ids=product_ids, using=self.db)
+        return rows
+
+    update.alters_data = True
+
+    def with_primary_image(self):
+        """
+        Prefetch each product's first gallery image only, as ``primary_images``,
+        in one query for the whole page (a window function picks the first
+        image per product). ``Product.primary_image`` then needs no query.
+        """
+        return self.prefetch_related(primary_image_prefetch())
+
+    def with_gallery(self):
+        """Prefetch every gallery image in order, in one query."""
+        return self.prefetch_related('images')
+
+
+def primary_image_prefetch(lookup='images'):
+    """``Prefetch`` of the first image for ``lookup``, e.g. ``'product__images'`` from a cart item."""
+    return models.Prefetch(
+        lookup,
+        queryset=ProductImage.objects.order_by('position', 'id')[:1],
+        to_attr='primary_images',
+    )
+
+
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(max_length=100, unique=True, blank=True)
@@ -9,6 +78,8 @@ class Category(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CatalogQuerySet.as_manager()
+
     class Meta:
         verbose_name_plural = "Categories"
         ordering = ['name']
@@ -40,67 +111,230 @@ class Product(models.Model):
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
     is_published = models.BooleanField(default=False)
-
-    # Image fields
-    image_main = models.ImageField(
-        upload_to='products/main/',
-        blank=True,
-        null=True,
-        help_text="Main product image"
-    )
-    image_1 = models.ImageField(
-        upload_to='products/additional/',
-        blank=True,
-        null=True,
-        help_text="Additional product image 1"
-    )
-    image_2 = models.ImageField(
-        upload_to='products/additional/',
-        blank=True,
+    stock = models.PositiveIntegerField(
         null=True,
-        help_text="Additional product image 2"
-    )
-    image_3 = models.ImageField(
-        upload_to='products/additional/',
         blank=True,
-        null=True,
-        help_text="Additional product image 3"
+        help_text="Units available to sell. Leave empty to not track stock."
     )
 
+    # Full-text search (maintained by a database trigger, see products/search.py)
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
+
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['sku']),
             models.Index(fields=['is_published']),
             models.Index(fields=['-created_at']),
+            # Keyset pagination: one (sort key, id) index per cursor sort
+            models.Index(
+                fields=['name', 'id'], name='product_pub_name_id_idx',
+                condition=models.Q(is_published=True),
+            ),
+            models.Index(
+                fields=['price', 'id'], name='product_pub_price_id_idx',
+                condition=models.Q(is_published=True),
+            ),
+            models.Index(
+                fields=['created_at', 'id'], name='product_pub_created_id_idx',
+                condition=models.Q(is_published=True),
+            ),
+            models.Index(
+                fields=['category', 'created_at', 'id'], name='product_pub_cat_created_idx',
+                condition=models.Q(is_published=True),
+            ),
+            models.Index(
+                fields=['category', 'name', 'id'], name='product_pub_cat_name_idx',
+                condition=models.Q(is_published=True),
+            ),
+            models.Index(
+                fields=['category', 'price', 'id'], name='product_pub_cat_price_idx',
+                condition=models.Q(is_published=True),
+            ),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored price so receivers can tell whether it changed
+        instance._saved_price = instance.__dict__.get('price')
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
         super().save(*args, **kwargs)
+        self._saved_price = self.price
+
+    def price_changed(self):
+        """Whether ``price`` differs from the stored one (``True`` if unknown)."""
+        saved = getattr(self, '_saved_price', None)
+        return saved is None or saved != self.price
 
     def __str__(self):
         return f"{self.name} ({self.sku})"
 
+    @property
+    def is_sold_out(self):
+        return self.stock == 0
+
     def get_all_images(self):
-        """Return a list of all non-null images."""
-        images = []
-        if self.image_main:
-            images.append(self.image_main)
-        if self.image_1:
-            images.append(self.image_1)
-        if self.image_2:
-            images.append(self.image_2)
-        if self.image_3:
-            images.append(self.image_3)
-        return images
+        """Return the gallery, primary image first."""
+        return list(self.images.all())
+
+    @property
+    def primary_image(self):
+        """
+        The first gallery image, or ``None``. Free when the product came from
+        ``with_primary_image()`` or ``with_gallery()``, one query otherwise.
+        """
+        if hasattr(self, 'primary_images'):
+            images = self.primary_images
+        else:
+            images = self.get_all_images()
+        return images[0] if images else None
 
     @property
     def is_available(self):
         """Check if product is available (published)."""
         return self.is_published
+
+
+class ProductImage(models.Model):
+    """
+    One picture in a product's gallery. The lowest ``position`` is the
+    primary image shown in listings.
+    """
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
+    # Stored once per content under blobs/, see products/storage.py
+    image = models.ImageField(storage=blob_storage)
+    position = models.PositiveSmallIntegerField(default=0)
+    # Resized WebP/AVIF/JPEG copies, size and placeholder, see products/images.py
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = CatalogQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['position', 'id']
+        indexes = [
+            models.Index(fields=['product', 'position', 'id'], name='product_image_order_idx'),
+        ]
+
+    def __str__(self):
+        return self.image.name
+
+
+class ImageJob(models.Model):
+    """
+    Renditions to generate for one gallery image, run by the
+    ``process_images`` worker (see products/image_jobs.py).
+
+    Keyed by image and content hash, so queueing the same upload twice is a
+    no-op and a finished job is never redone.
+    """
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    image = models.ForeignKey(ProductImage, on_delete=models.CASCADE, related_name='jobs')
+    source = models.CharField(max_length=255)
+    content_hash = models.CharField(max_length=64)
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    # Earliest time the worker may (re)try; also the lease of a claimed job
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['image', 'content_hash'], name='image_job_key_uniq',
+            ),
+        ]
+        indexes = [
+            # The worker's claim query: due pending jobs, oldest first
+            models.Index(
+                fields=['next_attempt_at'], name='image_job_pending_due_idx',
+                condition=models.Q(status='pending'),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.source} ({self.status})"
+
+
+class MediaBlob(models.Model):
+    """
+    One content-addressed file in ``blob_storage`` and the number of
+    ``ProductImage`` rows using it; unused blobs are deleted by
+    ``collect_media_garbage``.
+    """
+
+    digest = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    # Last upload, reference or release; collection waits a grace period after it
+    last_used = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # The collector's query: unreferenced blobs, longest unused first
+            models.Index(
+                fields=['last_used'], name='media_blob_garbage_idx',
+                condition=models.Q(refcount=0),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
+
+
+@receiver(pre_save, sender=ProductImage)
+def remember_replaced_image(sender, instance, using=None, **kwargs):
+    instance._replaced_image = ''
+    if not instance._state.adding:
+        instance._replaced_image = (
+            sender.objects.using(using).filter(pk=instance.pk)
+            .values_list('image', flat=True).first() or ''
+        )
+
+
+@receiver(post_save, sender=ProductImage)
+def count_image_references(sender, instance, using=None, **kwargs):
+    replaced = getattr(instance, '_replaced_image', '')
+    if instance.image.name != replaced:
+        retain_blob(instance.image.name, using=using)
+        release_blob(replaced, using=using)
+
+
+@receiver(post_delete, sender=ProductImage)
+def release_deleted_image(sender, instance, using=None, **kwargs):
+    release_blob(instance.image.name, using=using)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_catalog_cache(sender, using=None, **kwargs):
+    bump_catalog_version_on_commit(using=using)
@@ -0,0 +1,162 @@
+"""
+Full-text search backend for products.
+
+PostgreSQL keeps a weighted ``tsvector`` in ``Product.search_vector`` (GIN
+indexed) and SQLite keeps an external-content FTS5 shadow table. Both are
+maintained by database triggers, so ``save()``, ``queryset.update()`` and the
+admin's ``list_editable`` stay in sync without any Python-side hooks.
+"""
+
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+PRODUCT_TABLE = 'products_product'
+FTS_TABLE = 'products_product_fts'
+GIN_INDEX = 'products_product_search_gin'
+PG_TRIGGER = 'products_product_search_trigger'
+PG_FUNCTION = 'products_product_search_update'
+SEARCH_CONFIG = 'english'
+
+# Name and SKU matches rank above description matches.
+PG_VECTOR_SQL = (
+    "setweight(to_tsvector('{config}', coalesce({row}.name, '')), 'A') || "
+    "setweight(to_tsvector('{config}', coalesce({row}.sku, '')), 'A') || "
+    "setweight(to_tsvector('{config}', coalesce({row}.description, '')), 'B')"
+)
+FTS_BM25_WEIGHTS = '10.0, 10.0, 1.0'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    """Split a raw search string into lower-case word tokens."""
+    return [token.lower() for token in TOKEN_RE.findall(query or '')]
+
+
+def install_search_backend(schema_editor):
+    """Create the search index and its triggers, then index existing rows."""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _install_postgresql(schema_editor)
+    elif vendor == 'sqlite':
+        _install_sqlite(schema_editor)
+
+
+def uninstall_search_backend(schema_editor):
+    """Drop everything created by ``install_search_backend``."""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {PG_TRIGGER} ON {PRODUCT_TABLE}')
+        schema_editor.execute(f'DROP FUNCTION IF EXISTS {PG_FUNCTION}()')
+        schema_editor.execute(f'DROP INDEX IF EXISTS {GIN_INDEX}')
+    elif vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def _install_postgresql(schema_editor):
+    new_vector = PG_VECTOR_SQL.format(config=SEARCH_CONFIG, row='NEW')
+    schema_editor.execute(f"""
+        CREATE OR REPLACE FUNCTION {PG_FUNCTION}() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := {new_vector};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    schema_editor.execute(f'DROP TRIGGER IF EXISTS {PG_TRIGGER} ON {PRODUCT_TABLE}')
+    schema_editor.execute(f"""
+        CREATE TRIGGER {PG_TRIGGER}
+        BEFORE INSERT OR UPDATE OF name, sku, description ON {PRODUCT_TABLE}
+        FOR EACH ROW EXECUTE FUNCTION {PG_FUNCTION}()
+    """)
+    schema_editor.execute(
+        f'UPDATE {PRODUCT_TABLE} SET search_vector = '
+        + PG_VECTOR_SQL.format(config=SEARCH_CONFIG, row=PRODUCT_TABLE)
+    )
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {GIN_INDEX} ON {PRODUCT_TABLE} USING gin (search_vector)'
+    )
+
+
+def _install_sqlite(schema_editor):
+    schema_editor.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+            name, sku, description,
+            content='{PRODUCT_TABLE}', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    schema_editor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {PRODUCT_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, name, sku, description)
+            VALUES (new.id, new.name, new.sku, new.description);
+        END
+    """)
+    schema_editor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {PRODUCT_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, sku, description)
+            VALUES ('delete', old.id, old.name, old.sku, old.description);
+        END
+    """)
+    schema_editor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+        AFTER UPDATE OF name, sku, description ON {PRODUCT_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, sku, description)
+            VALUES ('delete', old.id, old.name, old.sku, old.description);
+            INSERT INTO {FTS_TABLE}(rowid, name, sku, description)
+            VALUES (new.id, new.name, new.sku, new.description);
+        END
+    """)
+    schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def search_products(queryset, query):
+    """
+    Filter a Product queryset down to full-text matches for ``query``.
+
+    Every word must match, and the last word also matches as a prefix so
+    partial input ("rend") still finds "Rendang". Matches are annotated with
+    ``search_rank`` (higher is better) for relevance ordering. Backends
+    without a search index fall back to the old ``icontains`` scan.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())).none()
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        terms = [f"'{token}'" for token in tokens]
+        terms[-1] += ':*'
+        search_query = SearchQuery(' & '.join(terms), search_type='raw', config=SEARCH_CONFIG)
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query)
+        )
+
+    if vendor == 'sqlite':
+        terms = [f'"{token}"' for token in tokens]
+        terms[-1] += '*'
+        match = ' '.join(terms)
+        matches = RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+        # bm25() only exists inside a MATCH query, hence the correlated subquery
+        rank = RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, {FTS_BM25_WEIGHTS}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {PRODUCT_TABLE}.id',
+            [match], output_field=FloatField(),
+        )
+        return queryset.filter(pk__in=matches).annotate(search_rank=rank)
+
+    return _icontains_search(queryset, query)
+
+
+def _icontains_search(queryset, query):
+    return queryset.filter(
+        Q(name__icontains=query) |
+        Q(description__icontains=query) |
+        Q(sku__icontains=query)
+    ).annotate(search_rank=Value(0.0, output_field=FloatField()))
@@ -0,0 +1,206 @@
+"""
+Content-addressed storage for product images.
+
+``ContentAddressedStorage`` names every upload after the SHA-256 of its
+content, e.g. ``blobs/3f/3f9a1c0b…e21.jpg``, whatever it was called on the
+uploader's disk, so a photo used for ten products is stored once. Each blob
+has a ``MediaBlob`` row counting the ``ProductImage`` rows that use it; the
+receivers in ``products/models.py`` move the count with the rows. Deleting or
+replacing an image only decrements it, and ``collect_media_garbage`` later
+deletes blobs that have been unused for ``GRACE_PERIOD``, with their
+renditions.
+
+Collection is safe against an upload of the same content racing it:
+
+* saving touches the blob's row (upsert of ``last_used``) *before* looking
+  for the file, so the row is locked until the upload commits and is then
+  too recent to collect;
+* the collector locks the rows it deletes and removes the files before
+  committing, so an upload that got there second waits, finds the file
+  gone and writes it again.
+
+Blobs and their renditions never change once written, so everything under
+``blobs/`` can be cached forever; ``serve_media`` sends the headers for it
+when Django serves media in development.
+"""
+
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+import time
+from datetime import timedelta
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+from django.views.static import serve
+
+BLOB_PREFIX = 'blobs'
+BLOB_NAME_RE = re.compile(rf'^{BLOB_PREFIX}/[0-9a-f]{{2}}/([0-9a-f]{{64}})(\.[^/]*)?$')
+# How long an unreferenced blob is kept before it may be collected
+GRACE_PERIOD = timedelta(hours=1)
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+CHUNK_SIZE = 64 * 1024
+
+
+def blob_digest(name):
+    """The full SHA-256 a blob's storage name carries, or ``None`` for other names."""
+    match = BLOB_NAME_RE.match(name or '')
+    return match.group(1) if match else None
+
+
+@deconstructible(path='products.storage.ContentAddressedStorage')
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    ``FileSystemStorage`` that stores files saved through a ``FileField``
+    under the hash of their content. Other names, such as the renditions
+    ``products/images.py`` derives from a blob's name, are stored as given.
+    """
+
+    def generate_filename(self, filename):
+        # upload_to is irrelevant; only the extension of the upload is kept
+        filename = super().generate_filename(posixpath.basename(str(filename)))
+        return f'{BLOB_PREFIX}/{filename}'
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if posixpath.dirname(str(name).replace('\\', '/')) != BLOB_PREFIX:
+            return super().save(name, content, max_length)
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        incoming = self.path(BLOB_PREFIX)
+        os.makedirs(incoming, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='.upload-', dir=incoming)
+        try:
+            digest, size = hashlib.sha256(), 0
+            with os.fdopen(fd, 'wb') as temp:
+                for chunk in content.chunks(CHUNK_SIZE):
+                    digest.update(chunk)
+                    temp.write(chunk)
+                    size += len(chunk)
+            digest = digest.hexdigest()
+            extension = posixpath.splitext(name)[1].lower()
+            name = touch_blob(digest, f'{BLOB_PREFIX}/{digest[:2]}/{digest}{extension}', size)
+
+            full_path = self.path(name)
+            if os.path.exists(full_path):
+                os.unlink(temp_path)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                # mkstemp() files are private; blobs must be readable by the web server
+                os.chmod(temp_path, self.file_permissions_mode or 0o644)
+                os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        return name
+
+    def delete_blob(self, name):
+        """Delete blob ``name`` and every file derived from it."""
+        directory, filename = posixpath.split(name)
+        stem = posixpath.splitext(filename)[0]
+        try:
+            _, files = self.listdir(directory)
+        except FileNotFoundError:
+            return
+        for other in files:
+            if other == filename or other.startswith(f'{stem}-'):
+                self.delete(f'{directory}/{other}')
+
+    def delete_abandoned_uploads(self, older_than):
+        """Remove temporary files left by uploads that died, e.g. with their process."""
+        try:
+            _, files = self.listdir(BLOB_PREFIX)
+        except FileNotFoundError:
+            return
+        cutoff = time.time() - older_than.total_seconds()
+        for filename in files:
+            path = self.path(f'{BLOB_PREFIX}/{filename}')
+            if filename.startswith('.upload-') and os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+
+
+blob_storage = ContentAddressedStorage()
+
+
+def touch_blob(digest, name, size):
+    """
+    Record that blob ``digest`` is in use as of now and return its storage
+    name: the one it was first stored under, if the content is known.
+    """
+    from .models import MediaBlob
+
+    MediaBlob.objects.bulk_create(
+        [MediaBlob(digest=digest, name=name, size=size)],
+        update_conflicts=True, unique_fields=['digest'], update_fields=['last_used'],
+    )
+    return MediaBlob.objects.filter(digest=digest).values_list('name', flat=True).get()
+
+
+def retain_blob(name, using='default'):
+    """Count one more reference to blob ``name``; other names are ignored."""
+    from .models import MediaBlob
+
+    if blob_digest(name):
+        MediaBlob.objects.using(using).filter(name=name).update(
+            refcount=F('refcount') + 1, last_used=timezone.now(),
+        )
+
+
+def release_blob(name, using='default'):
+    """Drop a reference to blob ``name``; collection waits for ``GRACE_PERIOD``."""
+    from .models import MediaBlob
+
+    if blob_digest(name):
+        MediaBlob.objects.using(using).filter(name=name, refcount__gt=0).update(
+            refcount=F('refcount') - 1, last_used=timezone.now(),
+        )
+
+
+def collect_garbage(grace=GRACE_PERIOD, batch_size=500, dry_run=False, storage=None):
+    """
+    Delete blobs, with their renditions, that no image has used for
+    ``grace``. Rows are locked with ``SKIP LOCKED`` a batch at a time, so
+    blobs being uploaded again are left alone and several collectors can
+    run. Returns ``(blobs, bytes)`` deleted, or that would be with
+    ``dry_run``.
+    """
+    from .models import MediaBlob
+
+    storage = storage or blob_storage
+    cutoff = timezone.now() - grace
+    garbage = MediaBlob.objects.filter(refcount=0, last_used__lt=cutoff)
+    if dry_run:
+        return garbage.count(), sum(garbage.values_list('size', flat=True))
+
+    deleted = freed = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                garbage.select_for_update(skip_locked=True).order_by('last_used')[:batch_size]
+            )
+            for blob in batch:
+                storage.delete_blob(blob.name)
+            MediaBlob.objects.filter(pk__in=[blob.pk for blob in batch]).delete()
+        deleted += len(batch)
+        freed += sum(blob.size for blob in batch)
+        if len(batch) < batch_size:
+            break
+    storage.delete_abandoned_uploads(grace)
+    return deleted, freed
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """``django.views.static.serve`` with far-future caching of immutable blobs."""
+    response = serve(request, path, document_root, show_indexes)
+    if path.startswith(f'{BLOB_PREFIX}/') and response.status_code == 200:
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
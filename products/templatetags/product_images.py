@@ -0,0 +1,15 @@
+from django import template
+
+from ..images import render_picture
+
+register = template.Library()
+
+
+@register.simple_tag
+def picture(image, sizes='100vw', alt='', **attrs):
+    """
+    Responsive ``<picture>`` for a product image field, e.g.::
+
+        {% picture product.primary_image.image sizes="(min-width: 1024px) 25vw, 100vw" alt=product.name class="w-full" %}
+    """
+    return render_picture(image, sizes=sizes, alt=alt, **attrs)
@@ -1,3 +1,830 @@
-from django.test import TestCase
+import base64
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.db import OperationalError, connection, transaction
+from django.contrib.admin.sites import site
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import ExifTags, Image
+
+from . import cache as catalog_cache
+from . import images
+from .cache import get_catalog_version, get_category_navigation
+from .image_jobs import claim_batch, enqueue_renditions
+from .inventory import InsufficientStock, Shortfall, reserve_stock
+from .models import Category, ImageJob, MediaBlob, Product, ProductImage
+from .pagination import CURSOR_SORTS, cursor_paginate
+from .search import install_search_backend, search_products
+from .storage import IMMUTABLE_CACHE_CONTROL, blob_digest, collect_garbage, serve_media
+
+
+class ProductSearchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # core.settings_test skips migrations, so install the search index by
+        # hand; where migrations ran this is a no-op. It is left in place
+        # for the tests that run afterwards.
+        with connection.schema_editor() as schema_editor:
+            install_search_backend(schema_editor)
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Ready to Eat')
+        cls.rendang = Product.objects.create(
+            name='Rendang Daging', sku='RTE-REN-001', category=cls.category,
+            description='Slow-cooked beef in coconut and spices.',
+            price=Decimal('18.90'), is_published=True,
+        )
+        cls.paste = Product.objects.create(
+            name='Spice Paste', sku='SP-001', category=cls.category,
+            description='Paste for cooking rendang at home.',
+            price=Decimal('9.90'), is_published=True,
+        )
+        cls.sambal = Product.objects.create(
+            name='Sambal Tumis', sku='SP-002', category=cls.category,
+            description='Chilli paste.', price=Decimal('7.90'), is_published=True,
+        )
+
+    def search(self, query):
+        return list(search_products(Product.objects.all(), query).order_by('-search_rank'))
+
+    def test_matches_name_description_and_sku(self):
+        self.assertEqual(self.search('rendang'), [self.rendang, self.paste])
+        self.assertEqual(self.search('RTE-REN-001'), [self.rendang])
+
+    def test_last_word_matches_as_prefix(self):
+        self.assertEqual(self.search('samb'), [self.sambal])
+        self.assertEqual(self.search('tumis samb'), [self.sambal])
+
+    def test_empty_query_matches_nothing(self):
+        self.assertEqual(self.search('!!'), [])
+
+    def test_index_follows_save_bulk_update_and_delete(self):
+        self.sambal.name = 'Sambal Udang'
+        self.sambal.save()
+        self.assertEqual(self.search('udang'), [self.sambal])
+
+        Product.objects.filter(pk=self.sambal.pk).update(description='Prawn sambal')
+        self.assertEqual(self.search('prawn'), [self.sambal])
+        self.assertEqual(self.search('chilli'), [])
+
+        self.sambal.delete()
+        self.assertEqual(self.search('udang'), [])
+
+    def test_product_list_orders_results_by_relevance(self):
+        response = self.client.get(reverse('products:product_list'), {'q': 'rendang'})
+        self.assertEqual(list(response.context['products']), [self.rendang, self.paste])
+
+
+class CursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Spice Paste')
+        # Duplicate prices exercise the id tie-breaker.
+        for number in range(10):
+            Product.objects.create(
+                name=f'Paste {number:02d}', sku=f'SP-{number:03d}', category=cls.category,
+                price=Decimal('5.00') + number % 3, is_published=True,
+            )
+        Product.objects.create(name='Hidden', sku='SP-999', price=Decimal('1.00'))
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, sort, per_page=3):
+        seen, token = [], None
+        while True:
+            page = cursor_paginate(Product.objects.filter(is_published=True), sort, token, per_page)
+            seen.extend(page)
+            if not page.has_next:
+                return seen
+            token = page.next_cursor
+
+    def test_every_sort_visits_each_product_once_in_order(self):
+        published = Product.objects.filter(is_published=True)
+        for sort in CURSOR_SORTS:
+            with self.subTest(sort=sort):
+                expected = list(published.order_by(sort, '-pk' if sort.startswith('-') else 'pk'))
+                self.assertEqual(self.walk(sort), expected)
+
+    def test_deep_page_is_one_query_without_count(self):
+        first = cursor_paginate(Product.objects.filter(is_published=True), 'price', None, 3)
+        with CaptureQueriesContext(connection) as queries:
+            cursor_paginate(Product.objects.filter(is_published=True), 'price', first.next_cursor, 3)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('COUNT', queries[0]['sql'].upper())
+        self.assertNotIn('OFFSET', queries[0]['sql'].upper())
+
+    def test_tampered_or_mismatched_token_restarts(self):
+        first = cursor_paginate(Product.objects.filter(is_published=True), 'name', None, 3)
+        for token in (first.next_cursor + 'x', 'garbage'):
+            page = cursor_paginate(Product.objects.filter(is_published=True), 'name', token, 3)
+            self.assertEqual(list(page), list(first))
+        page = cursor_paginate(Product.objects.filter(is_published=True), '-name', first.next_cursor, 3)
+        self.assertEqual(page.object_list[0].name, 'Paste 09')
+
+    def test_htmx_cursor_request_renders_cards_with_next_sentinel(self):
+        url = reverse('products:category_detail', args=[self.category.slug])
+        response = self.client.get(url, {'cursor': '', 'sort': 'name'}, HTTP_HX_REQUEST='true')
+        self.assertTemplateUsed(response, 'products/partials/product_grid.html')
+        self.assertTemplateNotUsed(response, 'products/category_detail.html')
+        self.assertEqual([p.name for p in response.context['products']],
+                         ['Paste 00', 'Paste 01', 'Paste 02', 'Paste 03'])
+        self.assertContains(response, 'hx-trigger="revealed"')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CatalogVersionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Spice Blend')
+        cls.product = Product.objects.create(
+            name='Kurma Powder', sku='SB-001', category=cls.category,
+            price=Decimal('6.50'), is_published=True,
+        )
+
+    def setUp(self):
+        cache.clear()
+        catalog_cache._navigation_memo = (None, ())
+
+    def assertBumps(self, write):
+        before = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        self.assertGreater(get_catalog_version(), before)
+
+    def test_model_writes_bump_version(self):
+        self.assertBumps(self.product.save)
+        self.assertBumps(self.category.save)
+        self.assertBumps(lambda: Product.objects.filter(pk=self.product.pk).update(price=Decimal('7.00')))
+        self.assertBumps(lambda: Product.objects.create(name='Extra', sku='SB-002'))
+        self.assertBumps(lambda: Product.objects.filter(sku='SB-002').delete())
+
+    def test_admin_bulk_actions_bump_version(self):
+        admin = site._registry[Product]
+        request = RequestFactory().post('/')
+        request.user = User(is_superuser=True)
+        with mock.patch.object(admin, 'message_user'):
+            self.assertBumps(lambda: admin.make_unpublished(request, Product.objects.all()))
+            self.assertBumps(lambda: admin.make_published(request, Product.objects.all()))
+
+    def test_no_bump_when_update_matches_nothing(self):
+        before = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=0).update(price=Decimal('1.00'))
+        self.assertEqual(get_catalog_version(), before)
+
+    def test_entries_expire_even_without_a_bump(self):
+        # e.g. another host changed the catalog but cannot reach this cache
+        values = iter(['first', 'second'])
+        catalog_cache.cached_catalog(('probe',), lambda: next(values))
+        self.assertEqual(catalog_cache.cached_catalog(('probe',), lambda: next(values)), 'first')
+
+        later = time.time() + catalog_cache.CATALOG_CACHE_TIMEOUT + 1
+        with mock.patch('time.time', return_value=later):
+            self.assertEqual(catalog_cache.cached_catalog(('probe',), lambda: next(values)), 'second')
+
+    def test_product_detail_is_cached_until_catalog_changes(self):
+        url = reverse('products:product_detail', args=[self.product.slug])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(url), 'Kurma Powder')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(name='Kurma Blend')
+        self.assertContains(self.client.get(url), 'Kurma Blend')
+
+    def test_product_grids_are_cached_until_catalog_changes(self):
+        urls = [
+            reverse('products:product_list'),
+            reverse('products:category_detail', args=[self.category.slug]) + '?cursor=&sort=name',
+        ]
+        for url in urls:
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertContains(self.client.get(url), 'Kurma Powder')
+            self.assertFalse(any('products_product"' in q['sql'] for q in queries.captured_queries))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(name='Kurma Blend')
+        for url in urls:
+            self.assertContains(self.client.get(url), 'Kurma Blend')
+
+    def test_category_navigation_counts_published_products_in_one_query(self):
+        Product.objects.create(name='Draft', sku='SB-009', category=self.category)
+        Category.objects.create(name='Empty')
+        with self.assertNumQueries(1):
+            navigation = get_category_navigation()
+        self.assertEqual([(c.name, c.product_count) for c in navigation],
+                         [('Empty', 0), ('Spice Blend', 1)])
+
+        with self.assertNumQueries(0):
+            self.assertIs(get_category_navigation(), navigation)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.filter(name='Empty').update(name='Aromatics')
+        self.assertEqual(get_category_navigation()[0].name, 'Aromatics')
+
+    def test_category_navigation_shared_cache_backs_process_memo(self):
+        navigation = get_category_navigation()
+        catalog_cache._navigation_memo = (None, ())
+        with self.assertNumQueries(0):
+            self.assertEqual(get_category_navigation(), navigation)
+
+    def test_categories_context_processor_is_lazy(self):
+        from core.context_processors import categories
+
+        with self.assertNumQueries(0):
+            context = categories(RequestFactory().get('/'))
+        with self.assertNumQueries(1):
+            self.assertEqual(len(context['categories']), 1)
+
+
+class StockReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rendang = Product.objects.create(name='Rendang', sku='R-1', price=Decimal('18.90'), stock=5)
+        cls.paste = Product.objects.create(name='Spice Paste', sku='SP-1', price=Decimal('9.90'), stock=1)
+        cls.sambal = Product.objects.create(name='Sambal', sku='SA-1', price=Decimal('7.90'))
+
+    def stock(self):
+        return list(Product.objects.order_by('sku').values_list('sku', 'stock'))
+
+    def test_reserves_all_tracked_lines_in_one_statement(self):
+        with CaptureQueriesContext(connection) as queries:
+            reserve_stock([(self.rendang, 2), (self.paste, 1), (self.sambal, 50)])
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.stock(), [('R-1', 3), ('SA-1', None), ('SP-1', 0)])
+
+    def test_shortfall_reports_every_short_line_and_rolls_back(self):
+        with self.assertRaises(InsufficientStock) as raised:
+            with transaction.atomic():
+                reserve_stock([(self.rendang, 6), (self.paste, 2), (self.sambal, 1)])
+        self.assertEqual(raised.exception.shortfalls, [
+            Shortfall(self.rendang.pk, 'Rendang', 6, 5),
+            Shortfall(self.paste.pk, 'Spice Paste', 2, 1),
+        ])
+        self.assertEqual(self.stock(), [('R-1', 5), ('SA-1', None), ('SP-1', 1)])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_selling_out_bumps_catalog_version(self):
+        before = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_stock([(self.rendang, 1)])
+        self.assertEqual(get_catalog_version(), before)
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_stock([(self.paste, 1)])
+        self.assertGreater(get_catalog_version(), before)
+
+
+    def test_admin_adjusts_stock_relative_to_stored_value(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        change_url = reverse('admin:products_product_change', args=[self.rendang.pk])
+        self.assertNotContains(self.client.get(change_url), 'name="stock"')
+
+        # A checkout reserving stock after the page was loaded is not undone
+        reserve_stock([(self.rendang, 2)])
+        response = self.client.post(reverse('admin:products_product_changelist'), {
+            'action': 'adjust_stock', 'delta': '-4',
+            '_selected_action': [self.rendang.pk, self.paste.pk, self.sambal.pk],
+        }, follow=True)
+        self.assertContains(response, 'Stock of 3 product(s) changed by -4.')
+        self.assertEqual(self.stock(), [('R-1', 0), ('SA-1', 0), ('SP-1', 0)])
+
+    def test_sold_out_products_cannot_be_ordered_from_their_page(self):
+        Product.objects.filter(pk=self.paste.pk).update(is_published=True)
+        response = self.client.get(reverse('products:product_detail', args=[self.paste.slug]))
+        self.assertContains(response, 'Add to Cart')
+        Product.objects.filter(pk=self.paste.pk).update(stock=0)
+        cache.clear()
+        response = self.client.get(reverse('products:product_detail', args=[self.paste.slug]))
+        self.assertContains(response, 'Sorry, this item is sold out.')
+        self.assertNotContains(response, reverse('cart:add_to_cart', args=[self.paste.pk]))
+
+class ConcurrentStockReservationTests(TransactionTestCase):
+    buyers = 8
+    stock = 5
+
+    def test_hot_product_is_never_oversold(self):
+        product = Product.objects.create(name='Rendang', sku='R-1', price=Decimal('18.90'), stock=self.stock)
+        barrier = threading.Barrier(self.buyers)
+        sold, errors = [], []
+
+        def buy():
+            try:
+                barrier.wait()
+                while True:
+                    try:
+                        with transaction.atomic():
+                            reserve_stock([(product, 1)])
+                        sold.append(1)
+                        return
+                    except InsufficientStock:
+                        return
+                    except OperationalError as exc:
+                        # SQLite reports lock contention instead of waiting
+                        if 'locked' not in str(exc):
+                            raise
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy) for _ in range(self.buyers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(sold), self.stock)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 0)
+
+
+def make_photo(name='photo.jpg', size=(2000, 1500)):
+    """A camera-sized JPEG with enough detail not to compress to nothing."""
+    image = Image.effect_noise(size, 40).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=95)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+class ImageRenditionTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        self.product = Product.objects.create(
+            name='Rendang', sku='R-1', price=Decimal('18.90'), is_published=True,
+        )
+        self.image = ProductImage.objects.create(product=self.product, image=make_photo('rendang.jpg'))
+
+    def rendition_path(self, width, fmt):
+        record = self.image.renditions
+        return default_storage.path(images.rendition_name(record['source'], record['hash'], width, fmt))
+
+    def test_generates_every_width_and_format_next_to_original(self):
+        images.update_renditions(self.image)
+        record = self.image.renditions
+        self.assertEqual(record['widths'], list(images.WIDTHS))
+        self.assertEqual(record['formats'][-1], 'jpeg')
+        self.assertIn('webp', record['formats'])
+
+        original = os.path.getsize(self.image.image.path)
+        for width in images.WIDTHS:
+            for fmt in record['formats']:
+                path = self.rendition_path(width, fmt)
+                self.assertEqual(os.path.dirname(path), os.path.dirname(self.image.image.path))
+                with Image.open(path) as rendition:
+                    self.assertEqual(rendition.width, width)
+        # What the grid actually downloads on a phone
+        self.assertLess(os.path.getsize(self.rendition_path(320, 'webp')) * 10, original)
+
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.renditions, record)
+
+    def test_records_size_colour_and_placeholder_of_original(self):
+        red = Image.new('RGB', (1600, 900), (200, 30, 20))
+        red.paste((250, 250, 250), (0, 0, 400, 900))
+        exif = Image.Exif()
+        exif[ExifTags.Base.Orientation] = 6  # Camera held sideways
+        buffer = io.BytesIO()
+        red.save(buffer, 'JPEG', exif=exif)
+        sideways = ProductImage.objects.create(
+            product=self.product, image=SimpleUploadedFile('sideways.jpg', buffer.getvalue()), position=1,
+        )
+
+        record = images.update_renditions(sideways)
+        self.assertEqual((record['width'], record['height']), (900, 1600))
+        self.assertEqual(record['widths'], [320, 640])
+        red, green, blue = (int(record['color'][i:i + 2], 16) for i in (1, 3, 5))
+        self.assertGreater(red, 150)
+        self.assertLess(max(green, blue), 80)
+        self.assertTrue(record['placeholder'].startswith('data:image/webp;base64,'))
+        self.assertLess(len(record['placeholder']), 400)
+        with Image.open(io.BytesIO(base64.b64decode(record['placeholder'].split(',', 1)[1]))) as tiny:
+            self.assertEqual(tiny.size, (9, 16))
+
+    def test_regenerating_is_idempotent_and_never_upscales(self):
+        images.update_renditions(self.image)
+        path = self.rendition_path(320, 'webp')
+        written = os.path.getmtime(path)
+        images.update_renditions(self.image)
+        self.assertEqual(os.path.getmtime(path), written)
+
+        small = ProductImage.objects.create(
+            product=self.product, image=make_photo('small.jpg', size=(200, 150)), position=1,
+        )
+        self.assertEqual(images.update_renditions(small)['widths'], [200])
+
+    def test_picture_markup_needs_no_storage_access(self):
+        images.update_renditions(self.image)
+        image = ProductImage.objects.get(pk=self.image.pk)
+        with mock.patch.object(FileSystemStorage, 'exists', side_effect=AssertionError), \
+                mock.patch.object(FileSystemStorage, '_open', side_effect=AssertionError):
+            html = images.render_picture(
+                image.image, sizes='50vw', alt='Rendang', loading='lazy',
+            )
+        self.assertTrue(html.startswith('<picture><source type="image/'))
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('-320w.webp 320w', html)
+        self.assertIn('-1280w.jpg 1280w', html)
+        self.assertIn(f'src="/media/{image.image.name.rsplit(".", 1)[0]}-640w.jpg"', html)
+        self.assertIn('loading="lazy"', html)
+        self.assertIn('width="2000" height="1500"', html)
+        self.assertIn('style="background-color: #', html)
+        self.assertIn('background-image: url(data:image/webp;base64,', html)
+
+    def test_stale_or_missing_renditions_fall_back_to_original(self):
+        html = images.render_picture(self.image.image, alt='Rendang')
+        self.assertEqual(html, f'<img src="{self.image.image.url}" alt="Rendang">')
+
+        images.update_renditions(self.image)
+        self.image.image = make_photo('new.jpg')
+        self.image.save()
+        self.assertNotIn('<picture>', images.render_picture(self.image.image))
+
+    def test_grid_renders_picture_without_touching_storage(self):
+        images.update_renditions(self.image)
+        with mock.patch.object(FileSystemStorage, 'exists', side_effect=AssertionError), \
+                mock.patch.object(FileSystemStorage, 'size', side_effect=AssertionError), \
+                mock.patch.object(FileSystemStorage, '_open', side_effect=AssertionError):
+            response = self.client.get(reverse('products:product_list'))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, 'sizes="(min-width: 1280px) 25vw')
+        self.assertContains(response, 'width="2000" height="1500"')
+
+    def test_admin_upload_queues_renditions_for_new_images(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.force_login(user)
+        response = self.client.post(
+            reverse('admin:products_product_change', args=[self.product.pk]),
+            {
+                'name': 'Rendang', 'slug': self.product.slug, 'sku': 'R-1', 'price': '18.90',
+                'is_published': 'on',
+                'images-TOTAL_FORMS': '2', 'images-INITIAL_FORMS': '1',
+                'images-0-id': str(self.image.pk), 'images-0-product': str(self.product.pk),
+                'images-0-position': '0',
+                'images-1-product': str(self.product.pk), 'images-1-position': '1',
+                'images-1-image': make_photo('side.jpg', size=(800, 600)),
+            },
+        )
+        self.assertEqual(response.status_code, 302)
+        side = self.product.images.get(position=1)
+        job = ImageJob.objects.get()
+        self.assertEqual((job.image, job.source), (side, side.image.name))
+        self.assertEqual(job.content_hash, images.content_hash(side.image))
+        self.assertEqual(set(side.renditions), set(images.SUMMARY_KEYS))
+        self.assertEqual(side.renditions['hash'], job.content_hash)
+
+        # Before the worker runs: the original, but sized and with its placeholder
+        html = images.render_picture(side.image, alt='Side')
+        self.assertTrue(html.startswith(f'<img src="{side.image.url}" alt="Side"'))
+        self.assertIn('width="800" height="600"', html)
+        self.assertIn('background-image: url(data:image/webp;base64,', html)
+
+        # The worker's record replaces the summary
+        self.assertEqual(images.update_renditions(side)['widths'], [320, 640])
+        self.assertIn('<picture>', images.render_picture(side.image))
+
+
+class ProductGalleryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Ready to Eat')
+        cls.products = []
+        for i in range(5):
+            product = Product.objects.create(
+                name=f'Rendang {i}', sku=f'R-{i}', category=cls.category,
+                price=Decimal('18.90'), is_published=True,
+            )
+            # Uploaded out of order; position decides
+            for position in (2, 0, 1)[:i]:
+                ProductImage.objects.create(
+                    product=product, image=f'products/images/r{i}-{position}.jpg', position=position,
+                )
+            cls.products.append(product)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_primary_image_is_lowest_position(self):
+        product = self.products[3]
+        self.assertEqual(product.primary_image.image.name, 'products/images/r3-0.jpg')
+        self.assertEqual(
+            [image.position for image in product.get_all_images()], [0, 1, 2],
+        )
+        self.assertIsNone(self.products[0].primary_image)
+
+    def test_listing_prefetches_only_primary_images_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            products = list(Product.objects.order_by('pk').with_primary_image())
+            primaries = [product.primary_image for product in products]
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(
+            [image and image.image.name for image in primaries],
+            [None, 'products/images/r1-2.jpg', 'products/images/r2-0.jpg',
+             'products/images/r3-0.jpg', 'products/images/r4-0.jpg'],
+        )
+        self.assertTrue(all(len(product.primary_images) <= 1 for product in products))
+
+    def test_product_list_query_count_does_not_grow_with_images(self):
+        url = reverse('products:product_list')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, 'products/images/r4-0.jpg')
+        self.assertNotContains(response, 'products/images/r4-1.jpg')
+        self.assertEqual(sum('products_productimage' in q['sql'] for q in queries.captured_queries), 1)
+
+    def test_detail_page_loads_gallery_in_one_query(self):
+        url = reverse('products:product_detail', args=[self.products[3].slug])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        for position in range(3):
+            self.assertContains(response, f'products/images/r3-{position}.jpg')
+        self.assertEqual(
+            sum('products_productimage' in q['sql'] for q in queries.captured_queries),
+            2,  # The gallery, and the related products' primary images
+        )
+
+    def test_cart_shows_primary_image(self):
+        self.client.post(reverse('cart:add_to_cart', args=[self.products[2].pk]), {'quantity': 1})
+        response = self.client.get(reverse('cart:cart_detail'))
+        self.assertContains(response, 'products/images/r2-0.jpg')
+
+
+class ImageWorkerTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.images = []
+        for i in range(3):
+            product = Product.objects.create(name=f'Rendang {i}', sku=f'R-{i}', price=Decimal('18.90'))
+            self.images.append(ProductImage.objects.create(
+                product=product, image=make_photo(f'rendang{i}.jpg', size=(1000, 750)),
+            ))
+        self.images.append(ProductImage.objects.create(
+            product=product, image=make_photo('side.jpg', size=(700, 500)), position=1,
+        ))
+
+    def run_worker(self, *args):
+        out = io.StringIO()
+        call_command('process_images', '--workers', '2', *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_enqueue_is_idempotent_and_keyed_by_content(self):
+        image = self.images[0]
+        self.assertEqual(enqueue_renditions([image]), 1)
+        self.assertEqual(enqueue_renditions([image]), 1)
+        self.assertEqual(ImageJob.objects.count(), 1)
+
+        # Same content under another name reuses the job
+        ImageJob.objects.update(status='done')
+        image.image.name = default_storage.save('products/images/copy.jpg', image.image)
+        enqueue_renditions([image])
+        job = ImageJob.objects.get()
+        self.assertEqual((job.status, job.source), ('pending', image.image.name))
+
+    def test_worker_renders_queued_jobs_in_process_pool(self):
+        enqueue_renditions(self.images)
+        output = self.run_worker('--once')
+        self.assertIn('Image worker done: 4 processed, 0 failed', output)
+        self.assertIn('images/s', output)
+        self.assertFalse(ImageJob.objects.exclude(status='done').exists())
+
+        image = ProductImage.objects.get(pk=self.images[0].pk)
+        self.assertEqual(image.renditions['widths'], [320, 640, 960])
+        self.assertIn('<picture>', images.render_picture(image.image))
+
+        # Everything is current now: nothing to queue, nothing to do
+        self.assertEqual(enqueue_renditions(ProductImage.objects.all()), 0)
+        self.assertIn('0 processed', self.run_worker('--once'))
+
+    def test_worker_skips_images_replaced_while_processing(self):
+        image = self.images[1]
+        enqueue_renditions([image])
+        ProductImage.objects.filter(pk=image.pk).update(image='products/images/replaced.jpg')
+        self.run_worker('--once')
+        self.assertEqual(ImageJob.objects.get().status, 'done')
+        image.refresh_from_db()
+        # Only the summary recorded for the old upload when it was queued
+        self.assertNotIn('widths', image.renditions)
+        self.assertIsNone(images.get_renditions(image.image))
+
+    def test_failures_are_retried_then_given_up(self):
+        ProductImage.objects.filter(pk=self.images[2].pk).update(image='products/images/missing.jpg')
+        job = ImageJob.objects.create(
+            image=self.images[2], source='products/images/missing.jpg', content_hash='0' * 12,
+        )
+        self.assertIn('0 processed, 1 failed', self.run_worker('--once'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertGreater(job.next_attempt_at, timezone.now())
+        self.assertIn('FileNotFoundError', job.last_error)
+
+        ImageJob.objects.update(next_attempt_at=timezone.now())
+        self.run_worker('--once', '--max-attempts', '2')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+
+    def test_expired_lease_is_resumed(self):
+        enqueue_renditions(self.images[:1])
+        self.assertEqual(len(claim_batch(10)), 1)
+        # Claimed by a worker that died: nothing is due until the lease expires
+        self.assertEqual(claim_batch(10), [])
+        ImageJob.objects.update(next_attempt_at=timezone.now())
+        self.assertIn('1 processed', self.run_worker('--once'))
+
+    def test_backfill_completes_records_missing_newer_keys(self):
+        image = self.images[1]
+        images.update_renditions(image)
+        ImageJob.objects.create(
+            image=image, source=image.image.name, content_hash=image.renditions['hash'], status='done',
+        )
+        old_record = {
+            key: value for key, value in image.renditions.items()
+            if key not in ('color', 'placeholder')
+        }
+        ProductImage.objects.filter(pk=image.pk).update(renditions=old_record)
+        # Old records still render, without the placeholder
+        image.refresh_from_db()
+        self.assertNotIn('background-color', images.render_picture(image.image))
+
+        self.assertIn('Backfill queued 4 of 4 images', self.run_worker('--backfill'))
+        image.refresh_from_db()
+        self.assertTrue(images.is_complete(image.renditions))
+
+    def test_backfill_queues_existing_images_in_chunks(self):
+        images.update_renditions(self.images[0])
+        output = self.run_worker('--backfill', '--chunk-size', '2')
+        self.assertIn('Backfill queued 3 of 4 images', output)
+        self.assertIn('Image worker done: 3 processed, 0 failed', output)
+        for image in ProductImage.objects.all():
+            self.assertTrue(images.is_complete(image.renditions))
+
+
+class MediaStorageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.photo = make_photo('sambal.jpg', size=(800, 600))
+        self.products = [
+            Product.objects.create(name=f'Sambal {i}', sku=f'S-{i}', price=Decimal('9.90'))
+            for i in range(2)
+        ]
+
+    def upload(self, product, name='sambal.jpg', photo=None, position=0):
+        photo = photo or self.photo
+        return ProductImage.objects.create(
+            product=product, image=SimpleUploadedFile(name, photo.read()), position=position,
+        )
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media_root)
+            for root, _, names in os.walk(self.media_root) for name in names
+        )
+
+    def age(self, blob):
+        MediaBlob.objects.filter(pk=blob.pk).update(last_used=timezone.now() - timedelta(days=1))
+
+    def test_identical_uploads_are_stored_once(self):
+        first = self.upload(self.products[0], 'sambal.jpg')
+        self.photo.seek(0)
+        second = self.upload(self.products[1], 'SAMBAL copy.JPG')
+        self.assertEqual(first.image.name, second.image.name)
+        digest = blob_digest(first.image.name)
+        self.assertEqual(first.image.name, f'blobs/{digest[:2]}/{digest}.jpg')
+        self.assertEqual(self.stored_files(), [first.image.name])
+
+        blob = MediaBlob.objects.get()
+        self.assertEqual((blob.digest, blob.refcount), (digest, 2))
+        self.assertEqual(blob.size, os.path.getsize(first.image.path))
+
+        other = self.upload(self.products[1], photo=make_photo(size=(400, 300)), position=1)
+        self.assertNotEqual(other.image.name, first.image.name)
+        self.assertEqual(MediaBlob.objects.count(), 2)
+
+    def test_references_follow_replace_and_delete(self):
+        first = self.upload(self.products[0])
+        self.photo.seek(0)
+        self.upload(self.products[1])
+        blob = MediaBlob.objects.get()
+
+        first.image = make_photo('new.jpg', size=(400, 300))
+        first.save()
+        blob.refresh_from_db()
+        self.assertEqual(blob.refcount, 1)
+        self.assertEqual(MediaBlob.objects.get(name=first.image.name).refcount, 1)
+
+        # Saving without a new upload keeps the count
+        first.position = 3
+        first.save()
+        self.assertEqual(MediaBlob.objects.get(name=first.image.name).refcount, 1)
+
+        for product in self.products:
+            product.delete()
+        self.assertEqual(set(MediaBlob.objects.values_list('refcount', flat=True)), {0})
+
+    def test_garbage_is_collected_after_grace_period_with_renditions(self):
+        image = self.upload(self.products[0])
+        images.update_renditions(image)
+        kept = self.upload(self.products[1], photo=make_photo(size=(400, 300)))
+        blob = MediaBlob.objects.get(name=image.image.name)
+        image.delete()
+
+        # Just released: an upload in flight may still want it
+        self.assertEqual(collect_garbage(), (0, 0))
+        self.age(blob)
+        out = io.StringIO()
+        call_command('collect_media_garbage', '--dry-run', stdout=out)
+        self.assertIn('Would delete 1 unused images', out.getvalue())
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, blob.name)))
+
+        call_command('collect_media_garbage', stdout=out)
+        self.assertIn('Deleted 1 unused images', out.getvalue())
+        self.assertEqual(self.stored_files(), [kept.image.name])
+        self.assertEqual(list(MediaBlob.objects.values_list('name', flat=True)), [kept.image.name])
+
+    def test_reupload_of_released_blob_is_not_collected(self):
+        image = self.upload(self.products[0])
+        image.delete()
+        self.age(MediaBlob.objects.get())
+
+        self.photo.seek(0)
+        again = self.upload(self.products[1])
+        self.assertEqual(collect_garbage(grace=timedelta(minutes=1)), (0, 0))
+        self.assertTrue(os.path.exists(again.image.path))
+        self.assertEqual(MediaBlob.objects.get().refcount, 1)
+
+    def test_blob_hash_is_read_from_its_name(self):
+        image = self.upload(self.products[0])
+        with mock.patch.object(FileSystemStorage, '_open', side_effect=AssertionError):
+            digest = images.content_hash(image.image)
+        self.assertEqual(digest, blob_digest(image.image.name)[:images.HASH_LENGTH])
+
+    def test_blobs_are_served_with_immutable_cache_headers(self):
+        image = self.upload(self.products[0])
+        request = RequestFactory().get('/')
+        response = serve_media(request, image.image.name, document_root=self.media_root)
+        self.assertEqual(response['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+
+        default_storage.save('products/images/old.jpg', self.photo)
+        response = serve_media(request, 'products/images/old.jpg', document_root=self.media_root)
+        self.assertNotIn('Cache-Control', response)
+
+    def test_dedupe_media_moves_existing_uploads_with_renditions(self):
+        legacy = []
+        for i, product in enumerate(self.products):
+            self.photo.seek(0)
+            name = default_storage.save(f'products/images/sambal{i}.jpg', self.photo)
+            legacy.append(ProductImage.objects.create(product=product, image=name))
+        images.update_renditions(legacy[0])
+        old_rendition = default_storage.path(images.rendition_name(
+            legacy[0].image.name, legacy[0].renditions['hash'], 640, 'webp',
+        ))
+        self.assertTrue(os.path.exists(old_rendition))
+
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('dedupe_media', stdout=out, stderr=io.StringIO())
+        self.assertIn('Moved 2 images into 1 distinct files', out.getvalue())
+
+        moved = [ProductImage.objects.get(pk=image.pk) for image in legacy]
+        self.assertEqual(moved[0].image.name, moved[1].image.name)
+        self.assertEqual(MediaBlob.objects.get().refcount, 2)
+        self.assertFalse(os.path.exists(old_rendition))
+        self.assertFalse(any(name.startswith('products/') for name in self.stored_files()))
+        # Renditions came along, so the record is still current
+        self.assertIn('<picture>', images.render_picture(moved[0].image))
+        self.assertTrue(os.path.exists(default_storage.path(
+            images.rendition_name(moved[0].image.name, moved[0].renditions['hash'], 640, 'webp')
+        )))
+        # The second image had no renditions yet
+        self.assertEqual(ImageJob.objects.get().image_id, moved[1].pk)
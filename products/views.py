@@ -1,49 +1,108 @@
+from django.conf import settings
+from django.http import Http404
 from django.shortcuts import render, get_object_or_404
-from django.core.paginator import Paginator
-from django.db.models import Q
+from django.core.paginator import Page, Paginator
+from .cache import cached_catalog
 from .models import Product, Category
+from .pagination import CURSOR_SORTS, cursor_paginate
+from .search import search_products
+
+PRODUCTS_PER_PAGE = 4
+
+
+def paginate_products(request, products, sort, cache_key=None):
+    """
+    Paginate a product queryset, returning the template context for the grid.
+
+    Cursor mode (``?cursor=`` or ``PRODUCT_CURSOR_PAGINATION``) skips the
+    COUNT/OFFSET paginator and hands the grid a token for the next page, which
+    ``products/partials/product_grid.html`` loads with an infinite-scroll hx-get.
+
+    With ``cache_key`` the page of products is cached under the catalog
+    version, so browsing costs no queries until the catalog changes.
+    """
+    cursor_mode = 'cursor' in request.GET or settings.PRODUCT_CURSOR_PAGINATION
+    if cursor_mode and sort in CURSOR_SORTS:
+        token = request.GET.get('cursor')
+
+        def load_page():
+            return cursor_paginate(products, sort, token, PRODUCTS_PER_PAGE)
+
+        if cache_key is None:
+            page = load_page()
+        else:
+            page = cached_catalog((*cache_key, 'cursor', sort, token or ''), load_page)
+        next_query = None
+        if page.has_next:
+            params = request.GET.copy()
+            params.pop('page', None)
+            params['cursor'] = page.next_cursor
+            params['sort'] = sort
+            next_query = params.urlencode()
+        return {
+            'page_obj': None,
+            'products': page,
+            'next_query': next_query,
+        }
+
+    number = request.GET.get('page')
+
+    def load_page():
+        page_obj = Paginator(products, PRODUCTS_PER_PAGE).get_page(number)
+        # A Page holds its queryset; keep only the rows and the count
+        return list(page_obj.object_list), page_obj.number, page_obj.paginator.count
+
+    if cache_key is None:
+        page_obj = Paginator(products, PRODUCTS_PER_PAGE).get_page(number)
+    else:
+        number = number if number and number.isdigit() else '1'
+        rows, page_number, count = cached_catalog((*cache_key, 'page', sort, number), load_page)
+        page_obj = Page(rows, page_number, Paginator(range(count), PRODUCTS_PER_PAGE))
+    return {
+        'page_obj': page_obj,
+        'products': page_obj,
+        'next_query': None,
+    }
 
 
 def product_list(request):
     """Display all published products with filtering and pagination."""
-    products = Product.objects.filter(is_published=True).select_related('category')
+    products = Product.objects.filter(is_published=True).select_related('category').with_primary_image()
 
     # Search functionality
     query = request.GET.get('q')
     if query:
-        products = products.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query) |
-            Q(sku__icontains=query)
-        )
+        products = search_products(products, query)
 
     # Category filtering
     category_slug = request.GET.get('category')
     if category_slug:
         products = products.filter(category__slug=category_slug)
 
-    # Sorting
-    sort = request.GET.get('sort', '-created_at')
+    # Sorting (search results default to relevance)
+    sort = request.GET.get('sort', '' if query else '-created_at')
     if sort in ['name', '-name', 'price', '-price', 'created_at', '-created_at']:
         products = products.order_by(sort)
+    elif query:
+        products = products.order_by('-search_rank', '-created_at')
 
-    # Pagination
-    paginator = Paginator(products, 4)  # Show 4 products per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-
-    # Get all categories for filter sidebar
-    categories = Category.objects.all()
+    # Searches are too varied to be worth caching
+    cache_key = None
+    if not query and sort in CURSOR_SORTS:
+        cache_key = ('product_list', category_slug or '')
 
+    # The filter sidebar reads the cached `categories` from the context processor
     context = {
-        'page_obj': page_obj,
-        'products': page_obj,
-        'categories': categories,
+        **paginate_products(request, products, sort, cache_key),
         'current_category': category_slug,
         'query': query,
         'sort': sort,
     }
 
+    # Infinite scroll fetches only the next run of cards
+    if request.htmx and 'cursor' in request.GET:
+        return render(request, 'products/partials/product_grid.html', context)
+
     return render(request, 'products/product_list.html', context)
 
 
@@ -53,32 +112,32 @@ def category_detail(request, slug):
     products = Product.objects.filter(
         category=category,
         is_published=True
-    ).order_by('-created_at')
+    ).select_related('category').with_primary_image()
 
-    # Pagination
-    paginator = Paginator(products, 4)  # Show 4 products per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    sort = request.GET.get('sort', '-created_at')
+    if sort not in CURSOR_SORTS:
+        sort = '-created_at'
+    products = products.order_by(sort)
 
     context = {
+        **paginate_products(request, products, sort, ('category_detail', category.pk)),
         'category': category,
-        'page_obj': page_obj,
-        'products': page_obj,
         'all_categories': Category.objects.all().exclude(id=category.id),
+        'sort': sort,
     }
 
+    if request.htmx and 'cursor' in request.GET:
+        return render(request, 'products/partials/product_grid.html', context)
+
     return render(request, 'products/category_detail.html', context)
 
 
 def product_detail(request, slug):
     """Display a single product with all its details."""
-    product = get_object_or_404(Product, slug=slug, is_published=True)
-
-    # Get related products from the same category
-    related_products = Product.objects.filter(
-        category=product.category,
-        is_published=True
-    ).exclude(id=product.id)[:4]
+    cached = cached_catalog(('product_detail', slug), lambda: _load_product_detail(slug))
+    if cached is None:
+        raise Http404('No Product matches the given query.')
+    product, related_products = cached
 
     context = {
         'product': product,
@@ -90,3 +149,20 @@ def product_detail(request, slug):
         return render(request, 'products/partials/product_modal.html', context)
 
     return render(request, 'products/product_detail.html', context)
+
+
+def _load_product_detail(slug):
+    """Fetch a published product and its related products for caching."""
+    product = Product.objects.filter(
+        slug=slug, is_published=True
+    ).select_related('category').with_gallery().first()
+    if product is None:
+        return None
+
+    # Get related products from the same category
+    related_products = list(Product.objects.filter(
+        category=product.category,
+        is_published=True
+    ).exclude(id=product.id).with_primary_image()[:4])
+
+    return product, related_products